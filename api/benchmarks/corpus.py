@@ -0,0 +1,84 @@
+"""
+Deterministic synthetic corpus for the benchmarks.
+
+Documents are built from a fixed vocabulary grouped into topics, so
+queries drawn from a topic retrieve related chunks and results are
+comparable between runs with the same seed.
+
+Usage:
+    python benchmarks/corpus.py --documents 500 --words 800 > corpus.jsonl
+"""
+from typing import Dict, Iterator, List
+import argparse
+import json
+import random
+
+TOPICS = {
+    "billing": "invoice payment refund subscription plan charge card receipt tax currency discount".split(),
+    "security": "password token encryption access role audit certificate firewall breach policy key".split(),
+    "deployment": "container cluster rollout image registry node scaling pipeline release canary manifest".split(),
+    "support": "ticket escalation customer response priority agent queue satisfaction sla channel resolution".split(),
+    "analytics": "dashboard metric report query aggregation trend cohort funnel retention segment chart".split()
+}
+
+FILLER = (
+    "the a of to and in for with on by from this that which when where how system process "
+    "service user data team should can will must may also each every new current"
+).split()
+
+
+def generate_document(rng: random.Random, topic: str, n_words: int) -> str:
+    """One document of roughly n_words words, with sentence and paragraph breaks"""
+    vocabulary = TOPICS[topic]
+    sentences: List[str] = []
+    words = 0
+    while words < n_words:
+        length = rng.randint(8, 20)
+        sentence = [
+            rng.choice(vocabulary) if rng.random() < 0.35 else rng.choice(FILLER)
+            for _ in range(length)
+        ]
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        words += length
+        if rng.random() < 0.15:
+            sentences.append("\n")
+    return " ".join(sentences)
+
+
+def generate_corpus(n_documents: int, n_words: int, seed: int = 42) -> Iterator[Dict]:
+    """Yield {"content", "metadata"} documents spread across topics"""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    for i in range(n_documents):
+        topic = topics[i % len(topics)]
+        yield {
+            "content": generate_document(rng, topic, n_words),
+            "metadata": {"topic": topic, "synthetic_id": i}
+        }
+
+
+def generate_queries(n_queries: int, seed: int = 7) -> List[str]:
+    """Short questions built from topic vocabulary"""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    queries = []
+    for i in range(n_queries):
+        vocabulary = TOPICS[topics[i % len(topics)]]
+        terms = rng.sample(vocabulary, 3)
+        queries.append(f"How does the {terms[0]} {terms[1]} relate to {terms[2]}?")
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus as JSON lines")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--words", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for document in generate_corpus(args.documents, args.words, args.seed):
+        print(json.dumps(document))
+
+
+if __name__ == "__main__":
+    main()
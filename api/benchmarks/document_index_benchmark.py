@@ -0,0 +1,189 @@
+"""
+Recall and latency of two-stage (document index) retrieval against flat
+chunk search, at growing corpus sizes.
+
+Builds a synthetic corpus of unit-length chunk embeddings clustered by
+topic and by document, and indexes it twice in an in-memory Chroma: the
+chunk collection, and a collection with one centroid per document
+(core/centroid.py, as at ingest). Queries are perturbed copies of random
+chunks. Each query's exact top-k chunks are found by brute force; then, per
+corpus size, the report gives recall@k and p50/p99 latency of:
+
+  * flat: one query over every chunk
+  * two_stage (per --top-documents value): nearest documents first, then
+    a chunk query restricted to them (where document_id $in ...)
+
+Usage (from the api/ directory):
+    python benchmarks/document_index_benchmark.py --sizes 10000,100000,500000 \\
+        --chunks-per-document 20 --top-documents 5,20,50
+"""
+from typing import Any, Dict, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from core.centroid import Centroid  # noqa: E402
+from hnsw_sweep import exact_top_k, int_list  # noqa: E402
+from run_benchmark import percentile  # noqa: E402
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def make_corpus(size: int, args, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """(chunk embeddings, document index of each chunk): topics > documents > chunks"""
+    documents = max(1, size // args.chunks_per_document)
+    topics = unit(rng.standard_normal((args.topics, args.dim)))
+    document_topic = rng.integers(0, args.topics, documents)
+    centers = unit(topics[document_topic] + args.document_spread * unit(rng.standard_normal((documents, args.dim))))
+
+    owner = np.repeat(np.arange(documents), args.chunks_per_document)[:size]
+    chunks = unit(centers[owner] + args.chunk_spread * unit(rng.standard_normal((len(owner), args.dim))))
+    return chunks.astype(np.float32), owner
+
+
+def timed(fn) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def evaluate_size(size: int, args, rng: np.random.Generator) -> Dict[str, Any]:
+    import chromadb
+    from chromadb.config import Settings
+
+    chunks, owner = make_corpus(size, args, rng)
+    rows = rng.choice(len(chunks), args.queries, replace=False)
+    queries = unit(chunks[rows] + args.query_noise * unit(rng.standard_normal((args.queries, args.dim))))
+    queries = queries.astype(np.float32)
+    truth = exact_top_k(chunks, queries, args.k, args.space)
+
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    metadata = {"hnsw:space": args.space}
+    chunk_collection = client.create_collection(name="chunks", metadata=metadata)
+    document_collection = client.create_collection(name="chunks__documents", metadata=metadata)
+    chunk_ids = [f"c{i}" for i in range(len(chunks))]
+    document_ids = [f"d{d}" for d in owner]
+
+    def build_chunks():
+        for offset in range(0, len(chunks), args.batch_size):
+            end = offset + args.batch_size
+            chunk_collection.add(
+                ids=chunk_ids[offset:end],
+                embeddings=chunks[offset:end].tolist(),
+                metadatas=[{"document_id": d} for d in document_ids[offset:end]]
+            )
+
+    def build_documents():
+        centroids: Dict[int, Centroid] = {}
+        for offset in range(0, len(chunks), args.batch_size):
+            end = offset + args.batch_size
+            for document in np.unique(owner[offset:end]):
+                mask = owner[offset:end] == document
+                centroids.setdefault(int(document), Centroid()).add(chunks[offset:end][mask])
+        ids = list(centroids)
+        for offset in range(0, len(ids), args.batch_size):
+            batch = ids[offset:offset + args.batch_size]
+            document_collection.add(
+                ids=[f"d{d}" for d in batch],
+                embeddings=[centroids[d].vector() for d in batch]
+            )
+        return len(ids)
+
+    _, chunk_build = timed(build_chunks)
+    documents, document_build = timed(build_documents)
+    index_of = {id_: i for i, id_ in enumerate(chunk_ids)}
+
+    def score(search) -> Dict[str, Any]:
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            found, elapsed = timed(lambda: search(query.tolist()))
+            latencies.append(elapsed)
+            hits += len({index_of[id_] for id_ in found} & set(expected.tolist()))
+        return {
+            f"recall@{args.k}": round(hits / (len(queries) * args.k), 4),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3)
+        }
+
+    def flat(query):
+        return chunk_collection.query(query_embeddings=[query], n_results=args.k, include=[])["ids"][0]
+
+    def two_stage(top_documents):
+        def search(query):
+            nearest = document_collection.query(
+                query_embeddings=[query], n_results=top_documents, include=[]
+            )["ids"][0]
+            return chunk_collection.query(
+                query_embeddings=[query],
+                n_results=args.k,
+                where={"document_id": {"$in": nearest}},
+                include=[]
+            )["ids"][0]
+        return search
+
+    result = {
+        "chunks": len(chunks),
+        "documents": documents,
+        "build_seconds": {"chunks": round(chunk_build, 3), "documents": round(document_build, 3)},
+        "flat": score(flat),
+        "two_stage": [
+            dict(top_documents=top_documents, **score(two_stage(top_documents)))
+            for top_documents in args.top_documents
+        ]
+    }
+    client.reset()
+    return result
+
+
+def run(args) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for size in args.sizes:
+        result = evaluate_size(size, args, rng)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    return {
+        "benchmark": "document_index",
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Two-stage (document index) vs flat retrieval")
+    parser.add_argument("--sizes", type=int_list, default=[10000, 50000, 200000], help="Comma-separated chunk counts")
+    parser.add_argument("--chunks-per-document", type=int, default=20)
+    parser.add_argument("--topics", type=int, default=50, help="Clusters of related documents")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--document-spread", type=float, default=0.8, help="Document distance from its topic")
+    parser.add_argument("--chunk-spread", type=float, default=0.6, help="Chunk distance from its document")
+    parser.add_argument("--query-noise", type=float, default=0.3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--top-documents", type=int_list, default=[5, 20, 50])
+    parser.add_argument("--space", choices=["l2", "ip", "cosine"], default="l2")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
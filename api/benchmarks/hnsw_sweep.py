@@ -0,0 +1,178 @@
+"""
+Recall/latency sweep of HNSW settings on a sample of a real knowledge base.
+
+Reads a sample of stored embeddings from a Chroma collection, holds out
+some of them as queries, and computes the exact top-k of every query by
+brute force. Then, for each candidate setting, builds an in-memory
+collection with those HNSW parameters from the sample and reports build
+time, recall@k against the exact answer and p50/p99 query latency.
+
+Nothing is re-encoded and the source collection is only read.
+
+Usage (from the api/ directory):
+    python benchmarks/hnsw_sweep.py --knowledge-base default --sample 20000 \\
+        --m 8,16,32 --construction-ef 100,200 --search-ef 10,50,100
+
+Apply the chosen setting with POST /api/admin/knowledge-bases/{id}/rebuild.
+"""
+from typing import Any, Dict, List
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from run_benchmark import percentile  # noqa: E402
+from services.chroma_client import create_chroma_client  # noqa: E402
+from services.vectorstore_service import HNSW_PARAMS  # noqa: E402
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def load_sample(args):
+    """(ids, embeddings) of up to sample + queries records of the collection"""
+    client = create_chroma_client(args.persist_dir)
+    collection = client.get_collection(name=args.knowledge_base)
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+
+    wanted = min(collection.count(), args.sample + args.queries)
+    ids: List[str] = []
+    embeddings: List[List[float]] = []
+    while len(ids) < wanted:
+        batch = collection.get(
+            limit=min(args.batch_size, wanted - len(ids)),
+            offset=len(ids),
+            include=["embeddings"]
+        )
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        embeddings.extend(batch["embeddings"])
+
+    return ids, np.asarray(embeddings, dtype=np.float32), space
+
+
+def exact_top_k(base: np.ndarray, queries: np.ndarray, k: int, space: str) -> np.ndarray:
+    """Indices of the true k nearest neighbours of each query (same metric as Chroma)"""
+    if space == "cosine":
+        base = base / np.maximum(np.linalg.norm(base, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        distances = -(queries @ base.T)
+    elif space == "ip":
+        distances = -(queries @ base.T)
+    else:
+        distances = (
+            np.sum(queries ** 2, axis=1, keepdims=True)
+            - 2 * queries @ base.T
+            + np.sum(base ** 2, axis=1)
+        )
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(distances, top, axis=1).argsort(axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def evaluate(setting: Dict[str, Any], base_ids, base, queries, truth, args) -> Dict[str, Any]:
+    import chromadb
+    from chromadb.config import Settings
+
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    metadata = {HNSW_PARAMS[name]: value for name, value in setting.items()}
+    collection = client.create_collection(name="hnsw-sweep", metadata=metadata)
+
+    start = time.perf_counter()
+    for offset in range(0, len(base), args.batch_size):
+        collection.add(
+            ids=base_ids[offset:offset + args.batch_size],
+            embeddings=base[offset:offset + args.batch_size].tolist()
+        )
+    build_seconds = time.perf_counter() - start
+
+    id_to_index = {id_: i for i, id_ in enumerate(base_ids)}
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=args.k, include=[])
+        latencies.append(time.perf_counter() - start)
+        found = {id_to_index[id_] for id_ in result["ids"][0]}
+        hits += len(found & set(expected.tolist()))
+
+    client.reset()
+    return {
+        "setting": setting,
+        "build_seconds": round(build_seconds, 3),
+        f"recall@{args.k}": round(hits / (len(queries) * args.k), 4),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    ids, embeddings, space = load_sample(args)
+    if len(ids) <= args.queries:
+        raise SystemExit(f"Collection has only {len(ids)} records; need more than --queries ({args.queries})")
+
+    # Held-out queries: real embeddings that are not in the index
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(ids))
+    query_rows, base_rows = order[:args.queries], order[args.queries:]
+    base_ids = [ids[i] for i in base_rows]
+    base, queries = embeddings[base_rows], embeddings[query_rows]
+
+    space = args.space or space
+    truth = exact_top_k(base, queries, args.k, space)
+
+    settings = [
+        {"space": space, "M": m, "construction_ef": c, "search_ef": s}
+        for m, c, s in itertools.product(args.m, args.construction_ef, args.search_ef)
+    ]
+    results = []
+    for setting in settings:
+        result = evaluate(setting, base_ids, base, queries, truth, args)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    return {
+        "benchmark": "hnsw_sweep",
+        "knowledge_base": args.knowledge_base,
+        "space": space,
+        "indexed": len(base_ids),
+        "queries": len(queries),
+        "k": args.k,
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW recall/latency sweep on a knowledge base sample")
+    parser.add_argument("--knowledge-base", default="default")
+    parser.add_argument("--persist-dir", default=os.getenv("CHROMA_PERSIST_DIR", "./data/chroma"))
+    parser.add_argument("--sample", type=int, default=20000, help="Records to index per setting")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out records used as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--space", choices=["l2", "ip", "cosine"], help="Default: the collection's own")
+    parser.add_argument("--m", type=int_list, default=[16], help="Comma-separated M values")
+    parser.add_argument("--construction-ef", type=int_list, default=[100])
+    parser.add_argument("--search-ef", type=int_list, default=[10, 50, 100])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
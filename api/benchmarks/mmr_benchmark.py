@@ -0,0 +1,109 @@
+"""
+Cost of MMR selection (core/mmr.py) for growing candidate pools.
+
+Times the vectorized greedy MMR on clustered random vectors for candidate pools
+of 100 to 1000 and several top_k values, next to a straightforward
+pure-Python implementation of the same algorithm, and checks that both
+pick the same candidates.
+
+Usage (from the api/ directory):
+    python benchmarks/mmr_benchmark.py --pools 100,250,500,1000 --top-k 5,10,20
+"""
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from core.mmr import mmr_select  # noqa: E402
+
+
+def mmr_reference(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """Unvectorized MMR: recomputes the max similarity to the selection per candidate"""
+    candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    query = query / np.linalg.norm(query)
+    relevance = [float(c @ query) for c in candidates]
+
+    selected: List[int] = []
+    while len(selected) < min(k, len(candidates)):
+        best, best_score = -1, -np.inf
+        for i, candidate in enumerate(candidates):
+            if i in selected:
+                continue
+            if selected:
+                redundancy = max(float(candidate @ candidates[j]) for j in selected)
+                score = lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            else:
+                # First pick: the most relevant candidate
+                score = relevance[i]
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-repeat wall time in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(args) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    rows = []
+
+    for pool in args.pools:
+        # Clustered candidates, like overlapping chunks of the same sections
+        centers = rng.normal(size=(max(1, pool // 10), args.dim)).astype(np.float32)
+        candidates = centers[rng.integers(0, len(centers), pool)]
+        candidates = candidates + 0.1 * rng.normal(size=candidates.shape).astype(np.float32)
+        query = rng.normal(size=args.dim).astype(np.float32)
+
+        for k in args.top_k:
+            vectorized_ms = time_call(lambda: mmr_select(query, candidates, k, args.mmr_lambda), args.repeat)
+            row = {"pool": pool, "top_k": k, "vectorized_ms": round(vectorized_ms, 3)}
+
+            if not args.skip_reference:
+                reference_ms = time_call(lambda: mmr_reference(query, candidates, k, args.mmr_lambda), 1)
+                same = mmr_select(query, candidates, k, args.mmr_lambda) == \
+                    mmr_reference(query, candidates, k, args.mmr_lambda)
+                row.update(
+                    reference_ms=round(reference_ms, 3),
+                    speedup=round(reference_ms / vectorized_ms, 1) if vectorized_ms else None,
+                    same_selection=same
+                )
+            rows.append(row)
+
+    return {
+        "benchmark": "mmr",
+        "config": {"dim": args.dim, "mmr_lambda": args.mmr_lambda, "repeat": args.repeat, "seed": args.seed},
+        "results": rows
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MMR selection cost benchmark")
+    parser.add_argument("--pools", type=lambda v: [int(x) for x in v.split(",")], default=[100, 250, 500, 1000])
+    parser.add_argument("--top-k", type=lambda v: [int(x) for x in v.split(",")], default=[5, 10, 20])
+    parser.add_argument("--dim", type=int, default=384, help="Embedding size (all-MiniLM-L6-v2: 384)")
+    parser.add_argument("--mmr-lambda", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--skip-reference", action="store_true", help="Only time the vectorized version")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
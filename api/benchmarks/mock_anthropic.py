@@ -0,0 +1,242 @@
+"""
+Local stand-in for the Anthropic Messages API used by the benchmarks.
+
+Implements POST /v1/messages (plain and streaming) with configurable
+latency so API throughput can be measured without calling Claude:
+
+  * --latency-ms       time before the first byte of a response
+  * --token-latency-ms time per generated output token
+  * --output-tokens    number of output tokens per response
+  * --tool-turns       when tools are offered, answer with a tool_use for
+                       this many assistant turns before ending the turn
+  * --tool-calls       tool_use blocks per such turn (distinct inputs)
+  * --rpm-limit        answer 429 (with retry-after) once more than this
+                       many requests arrived in the last 60 seconds
+  * --error-rate       fraction of requests answered with a random 429
+
+Usage:
+    python benchmarks/mock_anthropic.py --port 8901 --latency-ms 400
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8901 uvicorn main:app
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+
+app = FastAPI(title="Mock Anthropic Messages API")
+
+config = {
+    "latency_ms": 300.0,
+    "token_latency_ms": 0.0,
+    "output_tokens": 200,
+    "tool_turns": 1,
+    "tool_calls": 1,
+    "rpm_limit": 0,
+    "error_rate": 0.0,
+    "retry_after": 1.0
+}
+
+stats = {"requests": 0, "streaming_requests": 0, "rate_limited": 0}
+
+recent_requests = collections.deque()
+
+WORDS = "the quick brown fox jumps over the lazy dog while agents retrieve context".split()
+
+
+def estimate_input_tokens(body: Dict[str, Any]) -> int:
+    """Same rough 4-chars-per-token estimate the API service uses"""
+    return max(1, len(json.dumps(body.get("messages", []))) // 4 + len(body.get("system") or "") // 4)
+
+
+def assistant_turns(messages: List[Dict[str, Any]]) -> int:
+    return sum(1 for m in messages if m.get("role") == "assistant")
+
+
+def pick_tool_call(body: Dict[str, Any], n: int = 0) -> Dict[str, Any]:
+    """Build a plausible tool_use block (the n-th of its turn) for the first offered tool"""
+    tools = body["tools"]
+    tool = next((t for t in tools if t["name"] == "search_knowledge_base"), tools[0])
+
+    first_user = next((m for m in body["messages"] if m.get("role") == "user"), {})
+    content = first_user.get("content", "")
+    query = content if isinstance(content, str) else "benchmark query"
+    if n:
+        query = f"{query[:190]} (part {n + 1})"
+
+    tool_input = {}
+    properties = tool.get("input_schema", {}).get("properties", {})
+    for name in tool.get("input_schema", {}).get("required", []):
+        prop_type = properties.get(name, {}).get("type", "string")
+        tool_input[name] = query[:200] if prop_type == "string" else 1
+
+    return {
+        "type": "tool_use",
+        "id": f"toolu_{uuid.uuid4().hex[:24]}",
+        "name": tool["name"],
+        "input": tool_input
+    }
+
+
+def build_content(body: Dict[str, Any]):
+    """Return (content blocks, stop_reason) for a request"""
+    n_tokens = min(config["output_tokens"], body.get("max_tokens", 4096))
+    text = " ".join(WORDS[i % len(WORDS)] for i in range(n_tokens))
+
+    if body.get("tools") and assistant_turns(body.get("messages", [])) < config["tool_turns"]:
+        calls = [pick_tool_call(body, n) for n in range(config["tool_calls"])]
+        return [{"type": "text", "text": "Let me look that up."}] + calls, "tool_use"
+
+    return [{"type": "text", "text": text}], "end_turn"
+
+
+def rate_limited_response():
+    """429 for this request if the simulated limits are exceeded, else None"""
+    now = time.monotonic()
+    while recent_requests and now - recent_requests[0] > 60:
+        recent_requests.popleft()
+
+    retry_after = None
+    if config["rpm_limit"] and len(recent_requests) >= config["rpm_limit"]:
+        retry_after = max(1, int(60 - (now - recent_requests[0])) + 1)
+    elif config["error_rate"] and random.random() < config["error_rate"]:
+        retry_after = config["retry_after"]
+
+    if retry_after is None:
+        recent_requests.append(now)
+        return None
+
+    stats["rate_limited"] += 1
+    return JSONResponse(
+        status_code=429,
+        headers={"retry-after": str(retry_after)},
+        content={
+            "type": "error",
+            "error": {"type": "rate_limit_error", "message": "Number of requests has exceeded your rate limit"}
+        }
+    )
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+
+    limited = rate_limited_response()
+    if limited is not None:
+        return limited
+
+    content, stop_reason = build_content(body)
+    usage = {
+        "input_tokens": estimate_input_tokens(body),
+        "output_tokens": sum(len(b.get("text", "").split()) or 10 for b in content)
+    }
+    message = {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "mock"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": usage
+    }
+
+    await asyncio.sleep(config["latency_ms"] / 1000)
+
+    if body.get("stream"):
+        stats["streaming_requests"] += 1
+        return StreamingResponse(stream_message(message), media_type="text/event-stream")
+
+    await asyncio.sleep(config["token_latency_ms"] * usage["output_tokens"] / 1000)
+    return JSONResponse(message)
+
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_message(message: Dict[str, Any]):
+    """Replay a message as Messages API server-sent events"""
+    start = dict(message, content=[], stop_reason=None)
+    start["usage"] = {"input_tokens": message["usage"]["input_tokens"], "output_tokens": 1}
+    yield sse("message_start", {"type": "message_start", "message": start})
+
+    delay = config["token_latency_ms"] / 1000
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            yield sse("content_block_start", {
+                "type": "content_block_start", "index": index,
+                "content_block": {"type": "text", "text": ""}
+            })
+            words = block["text"].split(" ")
+            for i, word in enumerate(words):
+                await asyncio.sleep(delay)
+                yield sse("content_block_delta", {
+                    "type": "content_block_delta", "index": index,
+                    "delta": {"type": "text_delta", "text": word if i == len(words) - 1 else word + " "}
+                })
+        else:
+            yield sse("content_block_start", {
+                "type": "content_block_start", "index": index,
+                "content_block": {"type": "tool_use", "id": block["id"], "name": block["name"], "input": {}}
+            })
+            payload = json.dumps(block["input"])
+            for i in range(0, len(payload), 16):
+                await asyncio.sleep(delay)
+                yield sse("content_block_delta", {
+                    "type": "content_block_delta", "index": index,
+                    "delta": {"type": "input_json_delta", "partial_json": payload[i:i + 16]}
+                })
+        yield sse("content_block_stop", {"type": "content_block_stop", "index": index})
+
+    yield sse("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]}
+    })
+    yield sse("message_stop", {"type": "message_stop"})
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Anthropic Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency-ms", type=float, default=config["latency_ms"])
+    parser.add_argument("--token-latency-ms", type=float, default=config["token_latency_ms"])
+    parser.add_argument("--output-tokens", type=int, default=config["output_tokens"])
+    parser.add_argument("--tool-turns", type=int, default=config["tool_turns"])
+    parser.add_argument("--tool-calls", type=int, default=config["tool_calls"])
+    parser.add_argument("--rpm-limit", type=int, default=config["rpm_limit"])
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"])
+    parser.add_argument("--retry-after", type=float, default=config["retry_after"],
+                        help="retry-after seconds sent with random 429s")
+    args = parser.parse_args()
+
+    config.update(
+        latency_ms=args.latency_ms,
+        token_latency_ms=args.token_latency_ms,
+        output_tokens=args.output_tokens,
+        tool_turns=args.tool_turns,
+        tool_calls=args.tool_calls,
+        rpm_limit=args.rpm_limit,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Exercise the Claude request scheduler against the mock Messages API.
+
+Starts benchmarks/mock_anthropic.py with a simulated requests-per-minute
+limit (and optional random 429s), then fires a burst of interactive,
+batch and agent requests through ClaudeService. Reports, per priority,
+latency percentiles and failures, plus how many 429s the mock returned.
+
+With the scheduler's buckets configured below the mock's limit, the mock
+should see (almost) no 429s and interactive requests should finish first.
+
+Usage (from the api/ directory):
+    python benchmarks/rate_limit_benchmark.py --requests 60 --mock-rpm 40 --rpm 30
+"""
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from run_benchmark import start_process, stop_process, wait_until_ok, latency_summary  # noqa: E402
+
+
+async def run(args) -> Dict[str, Any]:
+    os.environ.update({
+        "ANTHROPIC_API_KEY": "benchmark",
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{args.mock_port}",
+        "ANTHROPIC_RPM_LIMIT": str(args.rpm),
+        "ANTHROPIC_ITPM_LIMIT": str(args.itpm),
+        "ANTHROPIC_OTPM_LIMIT": str(args.otpm),
+        "ANTHROPIC_MAX_RETRIES": str(args.max_retries),
+        "ANTHROPIC_RETRY_BASE_DELAY": str(args.base_delay)
+    })
+
+    from services.claude_service import ClaudeService
+    from core.rate_limit import Priority
+
+    mock = start_process(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_anthropic.py"),
+         "--port", str(args.mock_port), "--latency-ms", str(args.latency_ms),
+         "--output-tokens", "50", "--rpm-limit", str(args.mock_rpm),
+         "--error-rate", str(args.error_rate)],
+        cwd=BENCH_DIR, env=dict(os.environ), log_path=os.devnull
+    )
+
+    try:
+        async with httpx.AsyncClient() as client:
+            await wait_until_ok(client, f"http://127.0.0.1:{args.mock_port}/stats", 30)
+
+            claude = ClaudeService()
+            priorities = [Priority.BATCH, Priority.AGENT, Priority.INTERACTIVE]
+            results: Dict[str, Dict[str, List]] = {
+                p.name.lower(): {"latencies": [], "errors": []} for p in priorities
+            }
+
+            async def one(i: int):
+                priority = priorities[i % len(priorities)]
+                start = time.perf_counter()
+                try:
+                    await claude.generate(
+                        prompt=f"benchmark request {i} " * 20,
+                        max_tokens=args.max_tokens,
+                        priority=priority
+                    )
+                    results[priority.name.lower()]["latencies"].append(time.perf_counter() - start)
+                except Exception as e:
+                    results[priority.name.lower()]["errors"].append(type(e).__name__)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.requests)))
+            elapsed = time.perf_counter() - start
+
+            mock_stats = (await client.get(f"http://127.0.0.1:{args.mock_port}/stats")).json()
+    finally:
+        stop_process(mock)
+
+    return {
+        "benchmark": "rate_limit",
+        "config": vars(args),
+        "elapsed_seconds": round(elapsed, 3),
+        "mock": mock_stats,
+        "by_priority": {
+            name: dict(
+                latency_summary(r["latencies"], len(r["errors"]), elapsed),
+                error_types=sorted(set(r["errors"]))
+            )
+            for name, r in results.items()
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claude scheduler benchmark against a 429-ing mock")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--mock-rpm", type=int, default=40, help="Requests per minute the mock accepts")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Random 429 fraction in the mock")
+    parser.add_argument("--rpm", type=float, default=30, help="Scheduler requests-per-minute bucket")
+    parser.add_argument("--itpm", type=float, default=0, help="Scheduler input-tokens-per-minute bucket")
+    parser.add_argument("--otpm", type=float, default=0, help="Scheduler output-tokens-per-minute bucket")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--max-retries", type=int, default=4)
+    parser.add_argument("--base-delay", type=float, default=1.0)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--mock-port", type=int, default=8902)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
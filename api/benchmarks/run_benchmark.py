@@ -0,0 +1,401 @@
+"""
+End-to-end benchmark for the Agentic RAG API.
+
+Starts the mock Messages API (benchmarks/mock_anthropic.py) and the real
+FastAPI app pointed at it, loads a synthetic corpus and measures:
+
+  * ingest throughput through /api/documents/add-text (docs/s, chunks/s)
+  * /api/rag/search and /api/rag/query latency (p50/p95/p99) and
+    throughput at rising concurrency
+  * /api/agent/execute latency for a multi-iteration tool-using task
+
+Results are written as JSON. Pass --compare with a previous result file to
+list latency/throughput regressions beyond --threshold.
+
+--chroma-mode server runs the app against a Chroma server (CHROMA_MODE=server)
+instead of the embedded store: the one at --chroma-host, or a local one
+started for the run. --chroma-mode both runs the benchmark once per mode and
+reports every metric of server mode relative to embedded mode.
+
+Usage (from the api/ directory):
+    python benchmarks/run_benchmark.py --documents 300 --concurrency 1,4,16 \\
+        --output bench.json
+    python benchmarks/run_benchmark.py --compare bench.json --fail-on-regression
+    python benchmarks/run_benchmark.py --chroma-mode both --agent-tasks 0
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from corpus import generate_corpus, generate_queries
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def latency_summary(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": max(ms) if ms else None
+    }
+
+
+def start_process(cmd: List[str], cwd: str, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def wait_until_ok(client: httpx.AsyncClient, url: str, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            response = await client.get(url)
+            if response.status_code == 200:
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready within {timeout}s")
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    path: str,
+    payloads: List[Dict[str, Any]],
+    concurrency: int
+) -> Dict[str, Any]:
+    """Send all payloads with at most `concurrency` requests in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(payload):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in payloads))
+    return latency_summary(latencies, errors, time.perf_counter() - start)
+
+
+async def bench_ingest(client: httpx.AsyncClient, args, knowledge_base_id: str) -> Dict[str, Any]:
+    documents = list(generate_corpus(args.documents, args.words, args.seed))
+    semaphore = asyncio.Semaphore(args.ingest_concurrency)
+    chunks = 0
+    errors = 0
+
+    async def one(document):
+        nonlocal chunks, errors
+        async with semaphore:
+            response = await client.post("/api/documents/add-text", json={
+                "content": document["content"],
+                "metadata": document["metadata"],
+                "knowledge_base_id": knowledge_base_id
+            })
+            if response.status_code == 200:
+                chunks += response.json()["chunks_created"]
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(d) for d in documents))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "documents": len(documents),
+        "chunks": chunks,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(len(documents) / elapsed, 3),
+        "chunks_per_second": round(chunks / elapsed, 3)
+    }
+
+
+async def bench_endpoint(client, args, path: str, make_payload) -> List[Dict[str, Any]]:
+    queries = generate_queries(args.requests, args.seed)
+    levels = []
+    for concurrency in args.concurrency:
+        payloads = [make_payload(q) for q in queries]
+        summary = await run_load(client, path, payloads, concurrency)
+        summary["concurrency"] = concurrency
+        levels.append(summary)
+        print(f"  {path} c={concurrency}: p50={summary['p50_ms']} p95={summary['p95_ms']} "
+              f"rps={summary['throughput_rps']} errors={summary['errors']}", file=sys.stderr)
+    return levels
+
+
+async def bench_agent(client, args, knowledge_base_id: str) -> Dict[str, Any]:
+    latencies: List[float] = []
+    iterations: List[int] = []
+    errors = 0
+    start = time.perf_counter()
+    for query in generate_queries(args.agent_tasks, args.seed + 1):
+        t0 = time.perf_counter()
+        response = await client.post("/api/agent/execute", json={
+            "task": query,
+            "knowledge_base_id": knowledge_base_id,
+            "max_iterations": 5
+        })
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - t0)
+            iterations.append(len(response.json()["steps"]))
+        else:
+            errors += 1
+    summary = latency_summary(latencies, errors, time.perf_counter() - start)
+    summary["mean_iterations"] = round(sum(iterations) / len(iterations), 2) if iterations else None
+    return summary
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """List metrics that got worse than baseline by more than `threshold`"""
+    regressions = []
+
+    def check(name: str, new: Optional[float], old: Optional[float], higher_is_better: bool):
+        if not new or not old:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        if worse > threshold:
+            regressions.append({
+                "metric": name,
+                "baseline": old,
+                "current": new,
+                "change_pct": round(change * 100, 1)
+            })
+
+    for key in ("docs_per_second", "chunks_per_second"):
+        check(f"ingest.{key}", current.get("ingest", {}).get(key), baseline.get("ingest", {}).get(key), True)
+
+    for endpoint in ("search", "query"):
+        old_levels = {level["concurrency"]: level for level in baseline.get(endpoint, [])}
+        for level in current.get(endpoint, []):
+            old = old_levels.get(level["concurrency"])
+            if not old:
+                continue
+            prefix = f"{endpoint}.c{level['concurrency']}"
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                check(f"{prefix}.{key}", level.get(key), old.get(key), False)
+            check(f"{prefix}.throughput_rps", level.get("throughput_rps"), old.get("throughput_rps"), True)
+
+    if "agent" in current and "agent" in baseline:
+        for key in ("p50_ms", "p95_ms"):
+            check(f"agent.{key}", current["agent"].get(key), baseline["agent"].get(key), False)
+
+    return regressions
+
+
+async def run(args) -> Dict[str, Any]:
+    if args.chroma_mode != "both":
+        return await run_once(args, args.chroma_mode)
+
+    embedded = await run_once(args, "embedded")
+    server = await run_once(args, "server")
+    return {
+        "benchmark": "chroma_modes",
+        "embedded": embedded,
+        "server": server,
+        # Every metric, not only regressions: change_pct is server vs embedded
+        "server_vs_embedded": compare(server, embedded, float("-inf"))
+    }
+
+
+async def run_once(args, chroma_mode: str) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="agentic-rag-bench-")
+    knowledge_base_id = f"bench_{int(time.time())}"
+    print(f"Chroma mode: {chroma_mode}", file=sys.stderr)
+
+    mock = start_process(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_anthropic.py"),
+         "--port", str(args.mock_port),
+         "--latency-ms", str(args.latency_ms),
+         "--token-latency-ms", str(args.token_latency_ms),
+         "--output-tokens", str(args.output_tokens),
+         "--tool-turns", str(args.tool_turns),
+         "--tool-calls", str(args.tool_calls)],
+        cwd=BENCH_DIR, env=dict(os.environ), log_path=os.path.join(workdir, "mock.log")
+    )
+
+    app_env = dict(os.environ)
+    app_env.update({
+        "ANTHROPIC_API_KEY": "benchmark",
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{args.mock_port}",
+        "CHROMA_PERSIST_DIR": os.path.join(workdir, "chroma"),
+        "CHROMA_MODE": chroma_mode
+    })
+
+    chroma = None
+    if chroma_mode == "server":
+        host, port = args.chroma_host, args.chroma_port
+        if not host:
+            host = "127.0.0.1"
+            chroma_env = dict(os.environ)
+            chroma_env.update({
+                "IS_PERSISTENT": "TRUE",
+                "PERSIST_DIRECTORY": os.path.join(workdir, "chroma-server"),
+                "ANONYMIZED_TELEMETRY": "FALSE"
+            })
+            chroma = start_process(
+                [sys.executable, "-m", "uvicorn", "chromadb.app:app", "--port", str(port),
+                 "--log-level", "warning"],
+                cwd=workdir, env=chroma_env, log_path=os.path.join(workdir, "chroma.log")
+            )
+        app_env.update({"CHROMA_HOST": host, "CHROMA_PORT": str(port)})
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        app_env[key] = value
+
+    app = start_process(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=SRC_DIR, env=app_env, log_path=os.path.join(workdir, "app.log")
+    )
+
+    results: Dict[str, Any] = {
+        "benchmark": "end_to_end",
+        "timestamp": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {
+            **{k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+            "chroma_mode": chroma_mode
+        },
+        "logs": workdir
+    }
+
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout) as client:
+            await wait_until_ok(client, f"http://127.0.0.1:{args.mock_port}/stats", 30)
+            if chroma_mode == "server":
+                await wait_until_ok(
+                    client, f"http://{app_env['CHROMA_HOST']}:{app_env['CHROMA_PORT']}/api/v1/heartbeat", 60
+                )
+            results["time_to_ready_seconds"] = round(
+                await wait_until_ok(client, "/health/ready", args.ready_timeout), 3
+            )
+
+            print("Ingesting corpus...", file=sys.stderr)
+            results["ingest"] = await bench_ingest(client, args, knowledge_base_id)
+
+            print("Benchmarking /search...", file=sys.stderr)
+            results["search"] = await bench_endpoint(
+                client, args, "/api/rag/search",
+                lambda q: {"query": q, "knowledge_base_id": knowledge_base_id, "top_k": 5}
+            )
+
+            print("Benchmarking /query...", file=sys.stderr)
+            results["query"] = await bench_endpoint(
+                client, args, "/api/rag/query",
+                lambda q: {"query": q, "knowledge_base_id": knowledge_base_id, "top_k": 5}
+            )
+
+            if args.agent_tasks:
+                print("Benchmarking agent loop...", file=sys.stderr)
+                results["agent"] = await bench_agent(client, args, knowledge_base_id)
+    finally:
+        stop_process(app)
+        stop_process(mock)
+        if chroma is not None:
+            stop_process(chroma)
+
+    return results
+
+
+def parse_levels(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end API benchmark")
+    parser.add_argument("--documents", type=int, default=200, help="Synthetic documents to ingest")
+    parser.add_argument("--words", type=int, default=600, help="Words per document")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--concurrency", type=parse_levels, default=[1, 4, 16, 32],
+                        help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--agent-tasks", type=int, default=10, help="Agent tasks to run (0 to skip)")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Mock time to first byte")
+    parser.add_argument("--token-latency-ms", type=float, default=0, help="Mock time per output token")
+    parser.add_argument("--output-tokens", type=int, default=200, help="Mock output tokens per response")
+    parser.add_argument("--tool-turns", type=int, default=1, help="Mock tool_use turns per agent task")
+    parser.add_argument("--tool-calls", type=int, default=1, help="Mock tool_use blocks per tool turn")
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--mock-port", type=int, default=8901)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--chroma-mode", choices=["embedded", "server", "both"], default="embedded")
+    parser.add_argument("--chroma-host", help="Existing Chroma server for server mode (default: start one)")
+    parser.add_argument("--chroma-port", type=int, default=8951)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the app (repeatable)")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Regression threshold (fraction)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        results["regressions"] = compare(results, baseline, args.threshold)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if args.fail_on_regression and results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
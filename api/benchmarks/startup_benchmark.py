@@ -0,0 +1,145 @@
+"""
+Startup-time benchmark for the Agentic RAG API.
+
+Measures, in fresh interpreter processes:
+  * the wall time of `import main` and the heaviest modules it pulls in
+    (parsed from `python -X importtime`)
+  * optionally, the time until /health/live and /health/ready answer 200
+    when the app is started with uvicorn
+
+Results are printed as JSON so runs can be compared over time.
+
+Usage (from the api/ directory):
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --runs 3 --serve --port 8765
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def measure_import(top: int) -> Dict[str, Any]:
+    """Import the app module in a fresh interpreter and parse -X importtime"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{proc.stderr[-2000:]}")
+
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|", 2)
+        modules.append({
+            "module": name.rstrip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000
+        })
+
+    # Nested imports are indented two spaces per level below their parent;
+    # keep `main` and the modules it imports directly
+    top_level = []
+    for m in modules:
+        name = m["module"]
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            top_level.append({**m, "module": name.strip()})
+    top_level.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+
+    return {
+        "wall_seconds": wall,
+        "import_seconds": sum(m["self_ms"] for m in modules) / 1000,
+        "heaviest_imports": top_level[:top]
+    }
+
+
+def wait_for(url: str, timeout: float):
+    """Poll a URL until it answers 200"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def measure_serve(port: int, timeout: float) -> Dict[str, Any]:
+    """Start uvicorn and time liveness and readiness"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SRC_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{port}/health/live", timeout)
+        live = time.perf_counter() - start
+        wait_for(f"http://127.0.0.1:{port}/health/ready", timeout)
+        ready = time.perf_counter() - start
+        return {
+            "time_to_live_seconds": live,
+            "time_to_ready_seconds": ready
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API import and startup time")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh processes to measure")
+    parser.add_argument("--top", type=int, default=15, help="Number of heaviest imports to report")
+    parser.add_argument("--serve", action="store_true", help="Also time /health/live and /health/ready")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --serve")
+    parser.add_argument("--timeout", type=float, default=300, help="Readiness timeout in seconds")
+    args = parser.parse_args()
+
+    imports = [measure_import(args.top) for _ in range(args.runs)]
+    report: Dict[str, Any] = {
+        "benchmark": "startup",
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_wall_seconds": summarize([r["wall_seconds"] for r in imports]),
+        "import_seconds": summarize([r["import_seconds"] for r in imports]),
+        "heaviest_imports": imports[-1]["heaviest_imports"]
+    }
+
+    if args.serve:
+        serves = [measure_serve(args.port, args.timeout) for _ in range(args.runs)]
+        report["time_to_live_seconds"] = summarize([r["time_to_live_seconds"] for r in serves])
+        report["time_to_ready_seconds"] = summarize([r["time_to_ready_seconds"] for r in serves])
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
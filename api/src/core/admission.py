@@ -0,0 +1,233 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import os
+from monitoring.metrics import track_stage, ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTIONS
+from monitoring.tracing import annotate
+
+# Admission control for expensive routes.
+#
+# Each route class (rag, agent, search, batch) runs at most max_in_flight
+# requests per process; up to max_queue more wait for a slot and everything
+# beyond that is turned away at once with a Retry-After instead of slowing
+# every request down. Waiting requests are served by self-clocked fair queuing
+# (SCFQ) across tenants: each request gets a virtual finish tag
+#     max(virtual_time, tenant's last tag) + 1 / weight
+# where virtual_time is the tag of the request last let through, and the
+# smallest tag goes next, so a tenant with a deep backlog cannot
+# push ahead of a tenant that just arrived, and a tenant with weight 2 gets
+# twice the slots of a tenant with weight 1 while both are backlogged.
+
+ROUTE_CLASS_DEFAULTS = {
+    # max_in_flight, max_queue, queue_timeout (seconds)
+    "rag": (32, 64, 10.0),
+    "agent": (8, 16, 30.0),
+    "search": (64, 128, 5.0),
+    # Whole /query/batch requests; each of their generations also takes a rag slot
+    "batch": (4, 8, 30.0)
+}
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a request is not admitted (status_code is 429 or 503)"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("tenant", "future", "cancelled")
+
+    def __init__(self, tenant: str, future: asyncio.Future):
+        self.tenant = tenant
+        self.future = future
+        self.cancelled = False
+
+
+class RouteClassLimiter:
+    """Bounded concurrency plus a weighted fair queue for one route class"""
+
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int,
+        max_queue: int,
+        max_queue_per_tenant: int,
+        queue_timeout: float,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.queue_timeout = queue_timeout
+        self.weights = weights or {}
+        self.in_flight = 0
+        self.queued = 0
+        self._queued_by_tenant: Dict[str, int] = {}
+        self._last_tag: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._heap: List[Tuple[float, int, _Ticket]] = []
+        self._seq = itertools.count()
+        # Smoothed time a request holds its slot, for Retry-After estimates
+        self._service_time = 1.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_in_flight > 0
+
+    async def acquire(self, tenant: str):
+        """Wait for a slot (fair across tenants) or raise AdmissionRejectedError"""
+        with track_stage("admission", f"{self.name}_queue_wait"):
+            annotate(route_class=self.name, tenant=tenant, in_flight=self.in_flight, queued=self.queued)
+            if not self.enabled or (self.in_flight < self.max_in_flight and self.queued == 0):
+                self._start()
+                return
+
+            if self.queued >= self.max_queue:
+                self._reject("queue_full", 503, f"Server busy: {self.name} queue is full")
+            if self._queued_by_tenant.get(tenant, 0) >= self.max_queue_per_tenant:
+                self._reject("tenant_queue_full", 429, f"Too many queued {self.name} requests for this tenant")
+
+            ticket = self._enqueue(tenant)
+            try:
+                await asyncio.wait_for(ticket.future, self.queue_timeout)
+            except BaseException as e:
+                if ticket.future.done() and not ticket.future.cancelled():
+                    # The slot was granted just as we gave up on it
+                    self.release(0.0)
+                else:
+                    self._dequeue(ticket)
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject("queue_timeout", 503, f"Server busy: no {self.name} slot within {self.queue_timeout:g}s")
+                raise
+
+    def release(self, elapsed: float):
+        """Free a slot held for `elapsed` seconds and hand it to the next tenant in line"""
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+        if elapsed > 0:
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+        self._dispatch()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new request"""
+        slots = max(self.max_in_flight, 1)
+        return max(1, min(60, math.ceil(self._service_time * (1 + self.queued / slots))))
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "tenants_queued": sum(1 for count in self._queued_by_tenant.values() if count)
+        }
+
+    def _start(self):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+
+    def _reject(self, reason: str, status_code: int, message: str):
+        ADMISSION_REJECTIONS.labels(self.name, reason).inc()
+        annotate(rejected=reason)
+        raise AdmissionRejectedError(message, status_code, self.retry_after())
+
+    def _enqueue(self, tenant: str) -> _Ticket:
+        weight = max(self.weights.get(tenant, 1.0), 1e-3)
+        tag = max(self._virtual_time, self._last_tag.get(tenant, 0.0)) + 1.0 / weight
+        self._last_tag[tenant] = tag
+
+        ticket = _Ticket(tenant, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (tag, next(self._seq), ticket))
+        self.queued += 1
+        self._queued_by_tenant[tenant] = self._queued_by_tenant.get(tenant, 0) + 1
+        ADMISSION_QUEUED.labels(self.name).inc()
+        return ticket
+
+    def _dequeue(self, ticket: _Ticket):
+        # Left in the heap and skipped when it reaches the top
+        ticket.cancelled = True
+        self.queued -= 1
+        self._queued_by_tenant[ticket.tenant] -= 1
+        ADMISSION_QUEUED.labels(self.name).dec()
+
+    def _dispatch(self):
+        while self._heap and self.in_flight < self.max_in_flight:
+            tag, _, ticket = heapq.heappop(self._heap)
+            if ticket.cancelled:
+                continue
+            self._virtual_time = tag
+            self.queued -= 1
+            self._queued_by_tenant[ticket.tenant] -= 1
+            ADMISSION_QUEUED.labels(self.name).dec()
+            self._start()
+            ticket.future.set_result(None)
+
+        if not self._heap:
+            # Idle: old tags no longer matter, drop them instead of growing forever
+            self._last_tag.clear()
+            self._queued_by_tenant.clear()
+
+
+class AdmissionController:
+    """Limiters by route class"""
+
+    def __init__(self, limiters: Dict[str, RouteClassLimiter]):
+        self.limiters = limiters
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        weights = parse_weights(os.getenv("ADMISSION_TENANT_WEIGHTS", ""))
+        limiters = {}
+        for name, (max_in_flight, max_queue, queue_timeout) in ROUTE_CLASS_DEFAULTS.items():
+            prefix = f"ADMISSION_{name.upper()}_"
+            max_queue = int(os.getenv(prefix + "MAX_QUEUE", str(max_queue)))
+            limiters[name] = RouteClassLimiter(
+                name,
+                max_in_flight=int(os.getenv(prefix + "MAX_IN_FLIGHT", str(max_in_flight))),
+                max_queue=max_queue,
+                max_queue_per_tenant=int(os.getenv(prefix + "MAX_QUEUE_PER_TENANT", str(max(1, max_queue // 2)))),
+                queue_timeout=float(os.getenv(prefix + "QUEUE_TIMEOUT", str(queue_timeout))),
+                weights=weights
+            )
+        return cls(limiters)
+
+    def limiter(self, route_class: str) -> RouteClassLimiter:
+        return self.limiters[route_class]
+
+    def status(self) -> Dict[str, Any]:
+        return {name: limiter.status() for name, limiter in self.limiters.items()}
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """'kb:docs=2,key:3f9a0c1b2d4e=4' -> {'kb:docs': 2.0, 'key:3f9a0c1b2d4e': 4.0}"""
+    weights = {}
+    for item in value.split(","):
+        tenant, sep, weight = item.strip().rpartition("=")
+        if sep and tenant:
+            weights[tenant] = float(weight)
+    return weights
+
+
+def tenant_of(headers, body: Any) -> str:
+    """
+    Tenant of a request: its API key (X-API-Key or a Bearer token, as
+    key:<first 12 hex chars of its SHA-256>, so keys never reach metrics or
+    logs), else the knowledge base it targets, else "anonymous".
+    """
+    key = headers.get("x-api-key")
+    authorization = headers.get("authorization", "")
+    if not key and authorization.lower().startswith("bearer "):
+        key = authorization[7:].strip()
+    if key:
+        return "key:" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+    if isinstance(body, dict) and body.get("knowledge_base_id"):
+        return f"kb:{body['knowledge_base_id']}"
+    return "anonymous"
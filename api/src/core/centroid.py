@@ -0,0 +1,43 @@
+from typing import List, Optional, Sequence, Union
+import numpy as np
+
+# Document vectors for the two-level index.
+#
+# A document is represented by the centroid of its chunk embeddings,
+# accumulated batch by batch so streamed uploads never hold all of them.
+# The mean is rescaled to the chunks' mean norm: with unit-length
+# embeddings the centroid is unit-length too, so documents rank the same
+# under l2, ip and cosine instead of favouring documents whose chunks
+# point in similar directions (whose raw mean is longer).
+
+ArrayLike = Union[np.ndarray, Sequence[Sequence[float]]]
+
+
+class Centroid:
+    """Running centroid of a document's chunk embeddings"""
+
+    def __init__(self):
+        self.count = 0
+        self._sum: Optional[np.ndarray] = None
+        self._norm_sum = 0.0
+
+    def add(self, embeddings: ArrayLike):
+        vectors = np.asarray(embeddings, dtype=np.float64)
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        if not len(vectors):
+            return
+        total = vectors.sum(axis=0)
+        self._sum = total if self._sum is None else self._sum + total
+        self._norm_sum += float(np.linalg.norm(vectors, axis=1).sum())
+        self.count += len(vectors)
+
+    def vector(self) -> Optional[List[float]]:
+        """The centroid, or None if nothing was added"""
+        if not self.count:
+            return None
+        mean = self._sum / self.count
+        norm = np.linalg.norm(mean)
+        if norm < 1e-12:
+            return mean.tolist()
+        return (mean * (self._norm_sum / self.count / norm)).tolist()
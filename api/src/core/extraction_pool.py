@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+import time
+import weakref
+
+from monitoring.tracing import annotate
+
+# Process pool for CPU-heavy document extraction.
+#
+# Parsing a PDF holds the GIL for the whole parse, so a thread would still
+# stall the event loop and only one core would ever be used. Work is sent to
+# worker processes instead, split into independent tasks (e.g. page ranges)
+# so one document can use several cores.
+#
+# Documents share the pool, and a worker stuck on one cannot be stopped
+# without killing the whole pool. When a document misses its deadline the
+# pool is killed and marked as such; the other documents whose tasks were
+# running there get BrokenProcessPool and resubmit their unfinished tasks to
+# a fresh pool, within their own deadline. Only the slow document fails.
+
+
+class ExtractionTimeoutError(Exception):
+    """A document took longer than the per-document extraction timeout"""
+
+
+class ExtractionPool:
+    """Lazily started process pool with a per-document deadline"""
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        timeout: float = 120.0
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Pools killed because a document missed its deadline
+        self._killed: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+
+    @classmethod
+    def from_env(cls) -> "ExtractionPool":
+        workers = int(os.getenv("EXTRACTION_WORKERS", "0"))
+        return cls(
+            max_workers=workers or None,
+            timeout=float(os.getenv("EXTRACTION_TIMEOUT", "120"))
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that already runs torch and asyncio
+            # threads is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run one picklable function call in a worker process"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    async def map_ordered(self, fn: Callable, tasks: List[Tuple], deadline: Optional[float] = None) -> List[Any]:
+        """
+        Run fn(*args) for every args tuple in parallel and return the results
+        in task order. Raises ExtractionTimeoutError once the deadline (a
+        time.monotonic() value, default now + timeout) passes; the workers are
+        then killed and the pool is recreated on next use. Tasks lost because
+        another document's timeout killed the pool are run again.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+
+        loop = asyncio.get_running_loop()
+        results: Dict[int, Any] = {}
+        annotate(tasks=len(tasks), workers=self.max_workers)
+
+        while True:
+            executor = self._get_executor()
+            futures = {
+                i: loop.run_in_executor(executor, fn, *args)
+                for i, args in enumerate(tasks)
+                if i not in results
+            }
+            try:
+                _, running = await asyncio.wait(
+                    futures.values(),
+                    timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_EXCEPTION
+                )
+                if running and executor in self._killed:
+                    # Killed for another document: the rest fail with it
+                    await asyncio.wait(running)
+                    running = set()
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+
+            # Whatever is still running here is abandoned: timed out, or a task failed
+            for future in running:
+                future.cancel()
+
+            lost = False
+            error: Optional[BaseException] = None
+            for i, future in futures.items():
+                if future.cancelled():
+                    # Queued tasks are cancelled when a pool is killed
+                    lost = lost or future not in running
+                elif isinstance(future.exception(), BrokenProcessPool):
+                    lost = True
+                elif future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    results[i] = future.result()
+
+            if error is not None:
+                raise error
+            if lost:
+                if executor not in self._killed:
+                    # A worker died (e.g. out of memory); start a fresh pool next time
+                    self._reset(executor)
+                    raise BrokenProcessPool("An extraction worker died")
+                # Killed because another document missed its deadline: run the lost tasks again
+                annotate(resubmitted=True)
+            elif running:
+                self._reset(executor, killed=True)
+                raise ExtractionTimeoutError(
+                    f"Extraction did not finish within {self.timeout:g}s"
+                )
+            if len(results) == len(tasks):
+                return [results[i] for i in range(len(tasks))]
+
+    def _reset(self, executor: ProcessPoolExecutor, killed: bool = False):
+        """Kill a pool whose workers are stuck on a pathological document"""
+        if self._executor is executor:
+            self._executor = None
+        if killed:
+            self._killed.add(executor)
+        # ProcessPoolExecutor has no public way to stop running tasks
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
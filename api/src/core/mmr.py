@@ -0,0 +1,57 @@
+from typing import List, Sequence, Union
+import numpy as np
+
+# Maximal marginal relevance (Carbonell & Goldstein, 1998).
+#
+# Greedily picks the candidate that maximizes
+#     lambda * sim(query, c) - (1 - lambda) * max(sim(c, s) for s in selected)
+# so near-duplicates of already picked chunks lose to slightly less similar
+# but new information. The running max is updated with one matrix-vector
+# product per pick, so selection is O(k * n * dim) in NumPy with no Python
+# loop over candidates.
+
+ArrayLike = Union[np.ndarray, Sequence[Sequence[float]]]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(
+    query_embedding: Union[np.ndarray, Sequence[float]],
+    candidate_embeddings: ArrayLike,
+    k: int,
+    lambda_mult: float = 0.5
+) -> List[int]:
+    """
+    Indices of k candidates chosen by MMR, in selection order.
+    lambda_mult = 1 is plain similarity ranking, 0 is maximum diversity.
+    Similarities are cosine.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or len(candidates) == 0 or k <= 0:
+        return []
+
+    candidates = _normalize(candidates)
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+
+    relevance = candidates @ query
+    k = min(k, len(candidates))
+
+    selected = np.empty(k, dtype=np.intp)
+    max_similarity = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    index = int(np.argmax(relevance))
+    for i in range(k):
+        selected[i] = index
+        available[index] = False
+        if i == k - 1:
+            break
+        np.maximum(max_similarity, candidates @ candidates[index], out=max_similarity)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        index = int(np.argmax(scores))
+
+    return selected.tolist()
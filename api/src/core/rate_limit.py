@@ -0,0 +1,246 @@
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from monitoring.metrics import track_stage
+from monitoring.tracing import annotate
+
+
+class Priority(IntEnum):
+    """Scheduling class of a Claude request (lower is served first)"""
+    INTERACTIVE = 0
+    BATCH = 1
+    AGENT = 2
+
+
+class RateLimitExceededError(Exception):
+    """Raised when Claude keeps answering 429 after all retries"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket for a per-minute limit.
+
+    The level may go negative when a request turns out to have used more
+    than it reserved; later requests then wait for the debt to be repaid.
+    A limit of 0 disables the bucket.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)"""
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        # A single request larger than the whole bucket only needs a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.enabled:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Adjust after the fact (negative amounts charge extra usage)"""
+        if self.enabled:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        """Empty the bucket (used after an upstream 429)"""
+        if self.enabled:
+            self._refill()
+            self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cost", "cancelled")
+
+    def __init__(self, priority: int, seq: int, cost: Tuple[float, float, float]):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.cancelled = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ClaudeScheduler:
+    """
+    Admits Claude requests against requests/input-token/output-token
+    per-minute buckets, in priority order, and retries 429/529 responses
+    with jittered exponential backoff that honors `retry-after`.
+
+    Output tokens are reserved at max_tokens when a request is admitted
+    and the unused part is returned once the real usage is known, which is
+    how the API itself accounts for output-token limits.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        input_tokens_per_minute: float = 0,
+        output_tokens_per_minute: float = 0,
+        max_retries: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.output_tokens = TokenBucket(output_tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Condition()
+
+    @classmethod
+    def from_env(cls) -> "ClaudeScheduler":
+        return cls(
+            requests_per_minute=float(os.getenv("ANTHROPIC_RPM_LIMIT", "0")),
+            input_tokens_per_minute=float(os.getenv("ANTHROPIC_ITPM_LIMIT", "0")),
+            output_tokens_per_minute=float(os.getenv("ANTHROPIC_OTPM_LIMIT", "0")),
+            max_retries=int(os.getenv("ANTHROPIC_MAX_RETRIES", "4")),
+            base_delay=float(os.getenv("ANTHROPIC_RETRY_BASE_DELAY", "1.0")),
+            max_delay=float(os.getenv("ANTHROPIC_RETRY_MAX_DELAY", "60"))
+        )
+
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._queue if not waiter.cancelled)
+
+    def _wait_time(self, cost: Tuple[float, float, float]) -> float:
+        requests, input_tokens, output_tokens = cost
+        return max(
+            self.paused_until - time.monotonic(),
+            self.requests.wait_time(requests),
+            self.input_tokens.wait_time(input_tokens),
+            self.output_tokens.wait_time(output_tokens)
+        )
+
+    async def acquire(self, input_tokens: int, output_tokens: int, priority: Priority):
+        """Wait until this request is at the head of the queue and fits the buckets"""
+        cost = (1.0, float(input_tokens), float(output_tokens))
+        waiter = _Waiter(int(priority), next(self._seq), cost)
+
+        async with self._changed:
+            heapq.heappush(self._queue, waiter)
+            # A new high-priority arrival may become the head
+            self._changed.notify_all()
+            try:
+                while True:
+                    while self._queue and self._queue[0].cancelled:
+                        heapq.heappop(self._queue)
+
+                    timeout = None
+                    if self._queue[0] is waiter:
+                        wait = self._wait_time(cost)
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            self.requests.take(cost[0])
+                            self.input_tokens.take(cost[1])
+                            self.output_tokens.take(cost[2])
+                            self._changed.notify_all()
+                            return
+                        timeout = wait
+
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                waiter.cancelled = True
+                self._changed.notify_all()
+                raise
+
+    def settle(self, reserved: Tuple[int, int], used: Tuple[int, int]):
+        """Return (or charge) the difference between reserved and used tokens"""
+        self.input_tokens.give_back(reserved[0] - used[0])
+        self.output_tokens.give_back(reserved[1] - used[1])
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Delay before retry `attempt` (1-based)"""
+        if retry_after is not None and retry_after > 0:
+            # Small jitter so a burst of 429s does not retry in lockstep
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _pause(self, seconds: float):
+        """Hold every queued request after an upstream rate limit"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.requests.drain()
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        input_tokens: int,
+        output_tokens: int,
+        priority: Priority,
+        usage_of: Callable[[Any], Tuple[int, int]],
+        retry_after_of: Callable[[BaseException], Optional[float]]
+    ) -> Any:
+        """
+        Run `call` under the rate limits.
+
+        `usage_of` extracts (input, output) tokens from a response and
+        `retry_after_of` returns None for errors that must not be retried,
+        or the server-suggested delay (0 when absent) for 429/529s.
+        """
+        attempt = 0
+        while True:
+            with track_stage("claude", "scheduler_wait"):
+                annotate(priority=priority.name.lower(), estimated_input_tokens=input_tokens)
+                await self.acquire(input_tokens, output_tokens, priority)
+
+            try:
+                response = await call()
+            except Exception as error:
+                # Nothing was generated; hand the output reservation back
+                self.settle((input_tokens, output_tokens), (input_tokens, 0))
+
+                retry_after = retry_after_of(error)
+                if retry_after is None:
+                    raise
+
+                attempt += 1
+                delay = self.backoff(attempt, retry_after)
+                if attempt > self.max_retries:
+                    raise RateLimitExceededError(
+                        f"Claude API rate limit exceeded after {self.max_retries} retries",
+                        retry_after=delay
+                    ) from error
+
+                self._pause(delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self.settle((input_tokens, output_tokens), usage_of(response))
+            return response
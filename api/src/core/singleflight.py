@@ -0,0 +1,69 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+import asyncio
+import json
+from monitoring.metrics import CacheStats
+
+T = TypeVar("T")
+
+
+class _Call:
+    """One in-flight execution shared by every caller with the same key"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key starts the work as its own task; callers
+    arriving while it runs await the same task and get the same result (or
+    the same exception). The task is shielded from any single caller: if
+    the caller that started it disconnects, the work keeps going for the
+    others, and it is only cancelled once nobody is waiting for it. The key
+    is released as soon as the task finishes, so a failure is never cached.
+    """
+
+    def __init__(self, stats: Optional[CacheStats] = None):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.stats = stats
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            if self.stats:
+                self.stats.record(hit=False)
+        elif self.stats:
+            self.stats.record(hit=True)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller went away: stop the work instead of orphaning it
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        """Number of distinct keys currently executing"""
+        return len(self._calls)
+
+
+def make_key(*parts: Any) -> tuple:
+    """Build a hashable key, canonicalizing dict/list parts"""
+    return tuple(
+        json.dumps(part, sort_keys=True, default=str) if isinstance(part, (dict, list)) else part
+        for part in parts
+    )
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+import time
+
+from monitoring.metrics import CacheStats
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after a per-entry TTL.
+    Not thread-safe; meant to be used from the event loop.
+    """
+
+    def __init__(self, max_entries: int = 1024, stats: Optional[CacheStats] = None):
+        self.max_entries = max_entries
+        self.stats = stats
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING and entry[1] < time.monotonic():
+            del self._entries[key]
+            entry = _MISSING
+
+        if self.stats is not None:
+            self.stats.record(entry is not _MISSING)
+
+        if entry is _MISSING:
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: float):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
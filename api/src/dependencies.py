@@ -0,0 +1,72 @@
+from functools import lru_cache
+import time
+from fastapi import HTTPException, Request
+from services.vectorstore_service import VectorStoreService
+from services.claude_service import ClaudeService
+from services.rag_service import RAGService
+from services.agent_service import AgentService
+from services.job_service import JobService
+from core.extraction_pool import ExtractionPool
+from core.admission import AdmissionController, AdmissionRejectedError, tenant_of
+
+# Shared service instances.
+# Every router and the app lifecycle go through these getters so that the
+# embedding model and vector store warmed up at startup are the ones that
+# actually serve requests.
+
+@lru_cache(maxsize=None)
+def get_vectorstore_service() -> VectorStoreService:
+    """Process-wide vector store service"""
+    return VectorStoreService()
+
+@lru_cache(maxsize=None)
+def get_claude_service() -> ClaudeService:
+    """Process-wide Claude service (raises if ANTHROPIC_API_KEY is missing)"""
+    return ClaudeService()
+
+@lru_cache(maxsize=None)
+def get_rag_service() -> RAGService:
+    """Process-wide RAG service (holds the in-flight request coalescing state)"""
+    return RAGService(get_vectorstore_service(), get_claude_service())
+
+@lru_cache(maxsize=None)
+def get_agent_service() -> AgentService:
+    """Process-wide agent service (holds the tool result cache)"""
+    return AgentService(get_vectorstore_service(), get_claude_service())
+
+@lru_cache(maxsize=None)
+def get_job_service() -> JobService:
+    """Process-wide agent job queue and worker pool"""
+    return JobService.from_env(get_agent_service())
+
+@lru_cache(maxsize=None)
+def get_extraction_pool() -> ExtractionPool:
+    """Process-wide pool for CPU-heavy document extraction (started on first use)"""
+    return ExtractionPool.from_env()
+
+@lru_cache(maxsize=None)
+def get_admission_controller() -> AdmissionController:
+    """Process-wide admission limits per route class"""
+    return AdmissionController.from_env()
+
+def admission(route_class: str):
+    """Route dependency holding an admission slot of route_class for the whole request"""
+    async def admit(request: Request):
+        limiter = get_admission_controller().limiter(route_class)
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+
+        try:
+            await limiter.acquire(tenant_of(request.headers, body))
+        except AdmissionRejectedError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            limiter.release(time.monotonic() - start)
+
+    return admit
@@ -1,14 +1,17 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import uvicorn
+import asyncio
 import os
+import signal
 from dotenv import load_dotenv
 
-from routes import rag_router, agent_router, documents_router
-from services.vectorstore_service import VectorStoreService
-from services.claude_service import ClaudeService
+from routes import rag_router, agent_router, documents_router, admin_router
+from dependencies import get_vectorstore_service, get_claude_service, get_extraction_pool, get_job_service
+from monitoring.metrics import render_metrics
 
 load_dotenv()
 
@@ -27,26 +30,71 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-vectorstore_service = VectorStoreService()
-claude_service = ClaudeService()
+# Initialize services (cheap: heavy models are loaded by the warm-up task)
+vectorstore_service = get_vectorstore_service()
 
 # Include routers
 app.include_router(rag_router.router, prefix="/api/rag", tags=["RAG"])
 app.include_router(agent_router.router, prefix="/api/agent", tags=["Agent"])
 app.include_router(documents_router.router, prefix="/api/documents", tags=["Documents"])
+app.include_router(admin_router.router, prefix="/api/admin", tags=["Admin"])
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize services on startup"""
+    """Start warming up services in the background"""
     print("Starting Agentic RAG API...")
-    await vectorstore_service.initialize()
-    print("✓ Vector store initialized")
+    # Do not block startup on the embedding model: the process answers
+    # liveness probes right away and reports readiness once warm-up is done
+    app.state.warmup_task = asyncio.create_task(warm_up_services())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     print("Shutting down Agentic RAG API...")
+    warmup_task = getattr(app.state, "warmup_task", None)
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    get_extraction_pool().shutdown()
+    if get_job_service.cache_info().currsize:
+        await get_job_service().shutdown()
+
+async def warm_up_services():
+    """Load the Claude client, vector store and embedding model"""
+    try:
+        await asyncio.to_thread(get_claude_service)
+        print("✓ Claude client initialized")
+    except ValueError as e:
+        print(f"✗ Claude client not initialized: {e}")
+
+    # A failed warm-up (Chroma server not up yet, model download error, ...)
+    # is retried with exponential backoff. After WARMUP_MAX_ATTEMPTS failures
+    # (0 = keep trying) the process exits so the orchestrator restarts it
+    # instead of keeping a live but never ready pod.
+    max_attempts = int(os.getenv("WARMUP_MAX_ATTEMPTS", "0"))
+    delay = float(os.getenv("WARMUP_RETRY_BASE_DELAY", "2"))
+    max_delay = float(os.getenv("WARMUP_RETRY_MAX_DELAY", "60"))
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await vectorstore_service.initialize()
+            print("✓ Vector store initialized")
+            return
+        except Exception as e:
+            print(f"✗ Vector store initialization failed (attempt {attempt}): {e}")
+        if max_attempts and attempt >= max_attempts:
+            print("✗ Giving up on warm-up, exiting")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def claude_is_ready() -> bool:
+    """Check the Claude service without raising when it is not configured"""
+    try:
+        return get_claude_service().is_ready()
+    except ValueError:
+        return False
 
 @app.get("/")
 async def root():
@@ -57,20 +105,51 @@ async def root():
             "rag": "/api/rag",
             "agent": "/api/agent",
             "documents": "/api/documents",
+            "health": "/health",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
 
 @app.get("/health")
 async def health_check():
+    ready = vectorstore_service.is_ready() and claude_is_ready()
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else "starting",
         "services": {
             "vectorstore": vectorstore_service.is_ready(),
-            "claude": claude_service.is_ready()
+            "claude": claude_is_ready()
         }
     }
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe: the process is up and the event loop is responsive"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the embedding model and collections are warm"""
+    services = {
+        "vectorstore": vectorstore_service.is_ready(),
+        "claude": claude_is_ready()
+    }
+    ready = all(services.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "services": services,
+            "warmup": vectorstore_service.get_warmup_status()
+        }
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
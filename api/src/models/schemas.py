@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 
 class DocumentInput(BaseModel):
@@ -14,12 +14,22 @@ class RAGQueryRequest(BaseModel):
     include_sources: bool = Field(default=True, description="Include source documents in response")
     model: str = Field(default="claude-3-5-sonnet-20241022", description="Claude model to use")
     temperature: float = Field(default=0.7, ge=0, le=1, description="Temperature for generation")
+    filter: Optional[Dict[str, Any]] = Field(default=None, description="Metadata filters for retrieval")
+    mmr: bool = Field(default=False, description="Diversify results with maximal marginal relevance")
+    mmr_lambda: float = Field(default=0.5, ge=0, le=1, description="MMR trade-off: 1 = pure relevance, 0 = maximum diversity")
+    fetch_k: Optional[int] = Field(default=None, ge=1, le=1000, description="MMR candidate pool size (default: 4 * top_k)")
+    debug: bool = Field(default=False, description="Return a per-stage timing trace")
 
 class RAGQueryResponse(BaseModel):
     answer: str = Field(..., description="Generated answer")
     sources: Optional[List[Dict[str, Any]]] = Field(default=None, description="Source documents")
     usage: Optional[Dict[str, int]] = Field(default=None, description="Token usage")
     model: str = Field(..., description="Model used")
+    trace: Optional[Dict[str, Any]] = Field(default=None, description="Timing span tree (only when debug is requested)")
+
+class RAGBatchQueryRequest(BaseModel):
+    queries: List[RAGQueryRequest] = Field(..., min_length=1, max_length=1000, description="Queries to answer")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64, description="Maximum Claude generations in flight (default: RAG_BATCH_CONCURRENCY)")
 
 class AgentTaskRequest(BaseModel):
     task: str = Field(..., description="Task for the agent to execute")
@@ -27,12 +37,30 @@ class AgentTaskRequest(BaseModel):
     max_iterations: int = Field(default=5, ge=1, le=20, description="Maximum iterations for the agent")
     knowledge_base_id: Optional[str] = Field(default=None, description="Optional knowledge base to use")
     tools: Optional[List[str]] = Field(default_factory=list, description="Tools available to the agent")
+    prefetch: bool = Field(default=False, description="Search knowledge_base_id for the task up front and give the top hits to the first turn")
+    debug: bool = Field(default=False, description="Return a per-stage timing trace")
 
 class AgentTaskResponse(BaseModel):
     result: str = Field(..., description="Result of the agent task")
     steps: List[Dict[str, Any]] = Field(..., description="Steps taken by the agent")
     usage: Dict[str, int] = Field(..., description="Total token usage")
     success: bool = Field(..., description="Whether the task was completed successfully")
+    trace: Optional[Dict[str, Any]] = Field(default=None, description="Timing span tree (only when debug is requested)")
+
+class AgentJobRequest(AgentTaskRequest):
+    webhook_url: Optional[str] = Field(default=None, description="URL that receives a POST with the final job state")
+
+class AgentJobResponse(BaseModel):
+    job_id: str = Field(..., description="ID of the job")
+    status: str = Field(..., description="queued, running, succeeded, failed or cancelled")
+    created_at: float = Field(..., description="Submission time (Unix seconds)")
+    started_at: Optional[float] = Field(default=None, description="Start time (Unix seconds)")
+    finished_at: Optional[float] = Field(default=None, description="Completion time (Unix seconds)")
+    cancel_requested: bool = Field(default=False, description="Whether cancellation was requested")
+    steps: List[Dict[str, Any]] = Field(default_factory=list, description="Steps recorded so far")
+    result: Optional[AgentTaskResponse] = Field(default=None, description="Final result once the job succeeded")
+    error: Optional[str] = Field(default=None, description="Error message if the job failed")
+    webhook: Optional[Dict[str, Any]] = Field(default=None, description="Webhook delivery outcome")
 
 class DocumentUploadResponse(BaseModel):
     document_id: str = Field(..., description="ID of the uploaded document")
@@ -45,6 +73,9 @@ class SearchRequest(BaseModel):
     knowledge_base_id: str = Field(default="default", description="Knowledge base to search")
     top_k: int = Field(default=5, ge=1, le=20, description="Number of results to return")
     filter: Optional[Dict[str, Any]] = Field(default=None, description="Metadata filters")
+    mmr: bool = Field(default=False, description="Diversify results with maximal marginal relevance")
+    mmr_lambda: float = Field(default=0.5, ge=0, le=1, description="MMR trade-off: 1 = pure relevance, 0 = maximum diversity")
+    fetch_k: Optional[int] = Field(default=None, ge=1, le=1000, description="MMR candidate pool size (default: 4 * top_k)")
 
 class SearchResult(BaseModel):
     content: str = Field(..., description="Content of the result")
@@ -55,3 +86,33 @@ class SearchResponse(BaseModel):
     results: List[SearchResult] = Field(..., description="Search results")
     total: int = Field(..., description="Total number of results")
     query: str = Field(..., description="Original query")
+
+class IndexParams(BaseModel):
+    space: Optional[Literal["l2", "ip", "cosine"]] = Field(default=None, description="Distance function")
+    M: Optional[int] = Field(default=None, ge=2, le=256, description="HNSW graph degree (more = better recall, more memory)")
+    construction_ef: Optional[int] = Field(default=None, ge=1, le=4096, description="Candidate list size while building")
+    search_ef: Optional[int] = Field(default=None, ge=1, le=4096, description="Candidate list size while searching")
+
+class KnowledgeBaseCreateRequest(BaseModel):
+    knowledge_base_id: str = Field(..., min_length=3, max_length=63, description="Name of the new knowledge base")
+    index: IndexParams = Field(default_factory=IndexParams, description="HNSW index settings (unset = Chroma defaults)")
+    embedding_model: Optional[str] = Field(default=None, description="Embedding model (default: EMBEDDING_MODEL; must be in EMBEDDING_MODELS_ALLOWED)")
+    document_index: bool = Field(default=False, description="Keep one vector per document and search in two stages: nearest documents first, then only their chunks")
+    top_documents: Optional[int] = Field(default=None, ge=1, le=1000, description="Documents whose chunks are searched per query (default: DOCUMENT_INDEX_TOP_DOCUMENTS)")
+
+class KnowledgeBaseIndexResponse(BaseModel):
+    knowledge_base_id: str = Field(..., description="Knowledge base")
+    index: Dict[str, Any] = Field(..., description="HNSW index settings (null = Chroma default)")
+    embedding_model: str = Field(..., description="Model the knowledge base is embedded with")
+    embedding_dim: Optional[int] = Field(default=None, description="Embedding dimension (null for knowledge bases created before it was recorded)")
+    count: int = Field(..., description="Number of chunks")
+    copied: Optional[int] = Field(default=None, description="Records copied (rebuild only)")
+    document_index: Optional[Dict[str, Any]] = Field(default=None, description="top_documents and number of documents (null without a document index)")
+
+class KnowledgeBaseImportResponse(BaseModel):
+    knowledge_base_id: str = Field(..., description="Knowledge base the snapshot was loaded into")
+    embedding_model: str = Field(..., description="Model the snapshot was embedded with")
+    embedding_dim: int = Field(..., description="Embedding dimension")
+    imported: int = Field(..., description="Records loaded")
+    replaced: bool = Field(..., description="Whether an existing knowledge base was replaced")
+    seconds: float = Field(..., description="Time spent loading")
@@ -0,0 +1,183 @@
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from typing import Dict, Tuple
+from monitoring.tracing import open_span, close_span
+import time
+
+# Prometheus metrics for the API.
+#
+# Recording is a dictionary lookup plus a couple of float updates per stage;
+# nothing is serialized until /metrics is scraped, so leaving the
+# instrumentation on costs close to nothing when no one is scraping.
+
+STAGE_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+STAGE_LATENCY = Histogram(
+    "agentic_rag_stage_duration_seconds",
+    "Latency of instrumented pipeline stages",
+    ["component", "stage"],
+    buckets=STAGE_BUCKETS
+)
+
+STAGE_IN_FLIGHT = Gauge(
+    "agentic_rag_stage_in_flight",
+    "Number of pipeline stages currently executing",
+    ["component", "stage"]
+)
+
+STAGE_ERRORS = Counter(
+    "agentic_rag_stage_errors_total",
+    "Number of pipeline stages that raised",
+    ["component", "stage"]
+)
+
+CLAUDE_TOKENS = Counter(
+    "agentic_rag_claude_tokens_total",
+    "Claude tokens consumed",
+    ["model", "direction"]
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "agentic_rag_admission_in_flight",
+    "Requests holding an admission slot",
+    ["route_class"]
+)
+
+ADMISSION_QUEUED = Gauge(
+    "agentic_rag_admission_queued",
+    "Requests waiting for an admission slot",
+    ["route_class"]
+)
+
+ADMISSION_REJECTIONS = Counter(
+    "agentic_rag_admission_rejections_total",
+    "Requests turned away by admission control",
+    ["route_class", "reason"]
+)
+
+_stage_children: Dict[Tuple[str, str], tuple] = {}
+
+
+def _children(component: str, stage: str) -> tuple:
+    """Resolve (and memoize) the labelled metric children for a stage"""
+    key = (component, stage)
+    children = _stage_children.get(key)
+    if children is None:
+        children = (
+            STAGE_LATENCY.labels(component, stage),
+            STAGE_IN_FLIGHT.labels(component, stage),
+            STAGE_ERRORS.labels(component, stage)
+        )
+        _stage_children[key] = children
+    return children
+
+
+class track_stage:
+    """
+    Context manager timing one pipeline stage.
+
+        with track_stage("vectorstore", "encode"):
+            embeddings = model.encode(texts)
+
+    Works inside async functions as long as the awaited work is inside the
+    block; the in-flight gauge covers the whole duration. When the current
+    request is being traced, the stage also becomes a span in its trace.
+    """
+
+    __slots__ = ("component", "stage", "_start", "_children", "_span", "_token")
+
+    def __init__(self, component: str, stage: str):
+        self.component = component
+        self.stage = stage
+
+    def __enter__(self):
+        self._children = _children(self.component, self.stage)
+        self._children[1].inc()
+        self._span, self._token = open_span(f"{self.component}.{self.stage}")
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        latency, in_flight, errors = self._children
+        latency.observe(time.perf_counter() - self._start)
+        in_flight.dec()
+        if exc_type is not None:
+            errors.inc()
+        if self._span is not None:
+            close_span(self._span, self._token, exc)
+        return False
+
+
+def record_claude_usage(model: str, usage: Dict[str, int]):
+    """Count Claude input and output tokens for a model"""
+    CLAUDE_TOKENS.labels(model, "input").inc(usage.get("input_tokens", 0))
+    CLAUDE_TOKENS.labels(model, "output").inc(usage.get("output_tokens", 0))
+
+
+class CacheStats:
+    """Hit/miss counters for an in-process cache, exported with a hit ratio"""
+
+    __slots__ = ("name", "hits", "misses")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+_caches: Dict[str, CacheStats] = {}
+
+
+def get_cache_stats(name: str) -> CacheStats:
+    """Get (or register) the stats object for a named cache"""
+    stats = _caches.get(name)
+    if stats is None:
+        stats = CacheStats(name)
+        _caches[name] = stats
+    return stats
+
+
+class _CacheCollector:
+    """Computes cache counters and hit ratios only when scraped"""
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "agentic_rag_cache_hits",
+            "Cache lookups served from the cache",
+            labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "agentic_rag_cache_misses",
+            "Cache lookups that missed",
+            labels=["cache"]
+        )
+        ratio = GaugeMetricFamily(
+            "agentic_rag_cache_hit_ratio",
+            "Fraction of cache lookups served from the cache since start",
+            labels=["cache"]
+        )
+        for stats in list(_caches.values()):
+            total = stats.hits + stats.misses
+            hits.add_metric([stats.name], stats.hits)
+            misses.add_metric([stats.name], stats.misses)
+            ratio.add_metric([stats.name], stats.hits / total if total else 0.0)
+        yield hits
+        yield misses
+        yield ratio
+
+
+REGISTRY.register(_CacheCollector())
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Serialize all metrics in the Prometheus text format"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,87 @@
+from collections import Counter
+from typing import Dict, Optional
+import os
+import sys
+import threading
+import time
+
+# Sampling profiler for a live worker.
+#
+# A background thread snapshots the stack of every other thread in the
+# process with sys._current_frames() at a fixed interval and aggregates
+# them as "collapsed" stacks (frame;frame;frame count), the input format
+# of flamegraph.pl, inferno and speedscope. Nothing is installed in the
+# interpreter, so the overhead is limited to the sampling thread and only
+# exists while a profile is running.
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfiler:
+    """Collects collapsed stack samples for all threads of this process"""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+
+    def run(self, duration: float) -> Dict[str, object]:
+        """Sample for `duration` seconds (blocking; call from a thread)"""
+        own_id = threading.get_ident()
+        thread_names = {}
+        deadline = time.perf_counter() + duration
+
+        while time.perf_counter() < deadline:
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = self._collapse(frame)
+                if stack:
+                    name = thread_names.get(thread_id, str(thread_id))
+                    self.samples[f"{name};{stack}"] += 1
+            self.sample_count += 1
+            time.sleep(self.interval)
+
+        return {
+            "duration_seconds": duration,
+            "interval_seconds": self.interval,
+            "sweeps": self.sample_count,
+            "unique_stacks": len(self.samples)
+        }
+
+    def _collapse(self, frame) -> Optional[str]:
+        """Render a frame chain root-first as `file:function:line;...`"""
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        frames.reverse()
+        return ";".join(frames)
+
+    def collapsed(self) -> str:
+        """Collapsed stacks, one `stack count` per line, most frequent first"""
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.samples.most_common()
+        ) + "\n"
+
+
+_profile_lock = threading.Lock()
+
+
+def profile_process(duration: float, interval: float = 0.005) -> SamplingProfiler:
+    """Run one profile at a time across the worker (blocking)"""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running in this worker")
+    try:
+        profiler = SamplingProfiler(interval=interval)
+        profiler.run(duration)
+        return profiler
+    finally:
+        _profile_lock.release()
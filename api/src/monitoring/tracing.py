@@ -0,0 +1,158 @@
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional
+import time
+
+# Opt-in per-request tracing.
+#
+# A trace is a tree of spans held in a context variable, so every
+# track_stage() block executed while serving a traced request (including
+# inside tasks spawned from it) becomes a child span. When no trace is
+# active, opening a span is a single ContextVar lookup.
+
+TRACE_HEADER = "X-Debug-Trace"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation inside a traced request"""
+
+    __slots__ = ("name", "attributes", "start", "end", "children", "error")
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict[str, Any]:
+        """Serialize the span tree with offsets relative to the root"""
+        origin = self.start if origin is None else origin
+        data = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3)
+        }
+        if self.attributes:
+            data["attributes"] = self.attributes
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+def open_span(name: str, attributes: Optional[Dict[str, Any]] = None):
+    """Start a child of the current span; returns (span, token) or (None, None)"""
+    parent = _current_span.get()
+    if parent is None:
+        return None, None
+    span = Span(name, attributes)
+    parent.children.append(span)
+    return span, _current_span.set(span)
+
+
+def close_span(span: Span, token, error: Optional[BaseException] = None):
+    """Finish a span opened with open_span()"""
+    span.end = time.perf_counter()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    _current_span.reset(token)
+
+
+def tracing() -> bool:
+    """Whether the current request is being traced"""
+    return _current_span.get() is not None
+
+
+def annotate(**attributes):
+    """Attach attributes to the current span, if a trace is active"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+class span:
+    """Context manager for an ad-hoc span; a no-op outside traced requests"""
+
+    __slots__ = ("name", "attributes", "_span", "_token")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self._span, self._token = open_span(self.name, self.attributes)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            close_span(self._span, self._token, exc)
+        return False
+
+
+class RequestTrace:
+    """
+    Root of a per-request trace.
+
+        with RequestTrace("rag.query", enabled=request.debug) as trace:
+            ...
+        if trace.enabled:
+            body.trace = trace.to_dict()
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.root: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> "RequestTrace":
+        if self.enabled:
+            self.root = Span(self.name)
+            self._token = _current_span.set(self.root)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.root is not None:
+            close_span(self.root, self._token, exc)
+        return False
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return self.root.to_dict() if self.root else None
+
+    def server_timing(self) -> str:
+        """Flatten the span tree into a Server-Timing header value"""
+        if self.root is None:
+            return ""
+
+        entries = []
+        counts: Dict[str, int] = {}
+
+        def visit(node: Span):
+            # Server-Timing metric names must be tokens and unique enough to
+            # tell repeated stages (e.g. several Claude calls) apart
+            base = node.name.replace(" ", "_")
+            counts[base] = counts.get(base, 0) + 1
+            metric = base if counts[base] == 1 else f"{base}-{counts[base]}"
+            entries.append(f"{metric};dur={node.duration_ms:.1f}")
+            for child in node.children:
+                visit(child)
+
+        visit(self.root)
+        return ", ".join(entries)
+
+
+def trace_requested(flag: bool, headers) -> bool:
+    """A trace is requested by a `debug` body flag or the X-Debug-Trace header"""
+    if flag:
+        return True
+    value = headers.get(TRACE_HEADER, "")
+    return value.lower() in ("1", "true", "yes", "on")
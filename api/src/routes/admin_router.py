@@ -0,0 +1,179 @@
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, UploadFile, File, Form
+from fastapi.responses import PlainTextResponse, FileResponse
+from starlette.background import BackgroundTask
+from typing import Optional
+import asyncio
+import hmac
+import os
+import shutil
+import tempfile
+from monitoring.profiler import profile_process, ProfilerBusyError
+from models.schemas import IndexParams, KnowledgeBaseIndexResponse, KnowledgeBaseImportResponse
+from dependencies import get_vectorstore_service
+from services.vectorstore_service import KnowledgeBaseBusyError
+from services.snapshot_service import SnapshotService, SnapshotError, pack, unpack
+
+router = APIRouter()
+
+def require_admin(x_admin_key: Optional[str] = Header(default=None)):
+    """Dependency guarding admin endpoints with the ADMIN_API_KEY secret"""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_API_KEY not set)")
+    if not x_admin_key or not hmac.compare_digest(x_admin_key, admin_key):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+@router.post("/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile_worker(
+    seconds: float = Query(default=10, gt=0, le=120, description="How long to sample"),
+    interval_ms: float = Query(default=5, ge=1, le=1000, description="Sampling interval")
+):
+    """
+    Sample the stacks of every thread in this worker for N seconds.
+    Returns collapsed stacks (`frame;frame;frame count` per line), ready for
+    flamegraph.pl, inferno-flamegraph or speedscope.
+    """
+    try:
+        profiler = await asyncio.to_thread(profile_process, seconds, interval_ms / 1000)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "X-Profile-Sweeps": str(profiler.sample_count),
+            "X-Profile-Worker-Pid": str(os.getpid())
+        }
+    )
+
+@router.post(
+    "/knowledge-bases/{knowledge_base_id}/rebuild",
+    response_model=KnowledgeBaseIndexResponse,
+    dependencies=[Depends(require_admin)]
+)
+async def rebuild_knowledge_base(
+    knowledge_base_id: str,
+    index: IndexParams,
+    batch_size: int = Query(default=1000, ge=1, le=10000, description="Records copied per batch")
+):
+    """
+    Rebuild a knowledge base's HNSW index with new settings.
+    Every record is copied (stored embeddings are reused, nothing is
+    re-encoded) into a collection built with the new settings, which then
+    replaces the old one. Uploads to this knowledge base fail while it runs.
+    """
+    vectorstore = get_vectorstore_service()
+    if not vectorstore.is_ready():
+        raise HTTPException(status_code=503, detail="Vector store is still warming up")
+    if knowledge_base_id not in await vectorstore.list_collections():
+        raise HTTPException(status_code=404, detail=f"Knowledge base {knowledge_base_id} not found")
+    try:
+        return await vectorstore.rebuild_collection(knowledge_base_id, index.model_dump(), batch_size)
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post(
+    "/knowledge-bases/{knowledge_base_id}/document-index",
+    response_model=KnowledgeBaseIndexResponse,
+    dependencies=[Depends(require_admin)]
+)
+async def build_document_index(
+    knowledge_base_id: str,
+    batch_size: int = Query(default=1000, ge=1, le=10000, description="Chunks read per batch")
+):
+    """
+    Recompute the document vectors of a knowledge base created with a
+    document index from its stored chunk embeddings (nothing is re-encoded).
+    Uploads to this knowledge base fail while it runs.
+    """
+    vectorstore = get_vectorstore_service()
+    if not vectorstore.is_ready():
+        raise HTTPException(status_code=503, detail="Vector store is still warming up")
+    if knowledge_base_id not in await vectorstore.list_collections():
+        raise HTTPException(status_code=404, detail=f"Knowledge base {knowledge_base_id} not found")
+    try:
+        return await vectorstore.build_document_index(knowledge_base_id, batch_size)
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def get_snapshot_service():
+    """Dependency to get the knowledge base snapshot service"""
+    return SnapshotService(get_vectorstore_service(), batch_size=int(os.getenv("SNAPSHOT_BATCH_SIZE", "5000")))
+
+@router.post("/knowledge-bases/{knowledge_base_id}/export", dependencies=[Depends(require_admin)])
+async def export_knowledge_base(
+    knowledge_base_id: str,
+    snapshots: SnapshotService = Depends(get_snapshot_service)
+):
+    """
+    Download a knowledge base as a snapshot tar (manifest.json,
+    records.parquet and embeddings.npy) for POST /knowledge-bases/import.
+    Writes to the knowledge base fail while it is being exported.
+    """
+    if not snapshots.vectorstore.is_ready():
+        raise HTTPException(status_code=503, detail="Vector store is still warming up")
+    workdir = tempfile.mkdtemp(prefix="kb-export-")
+    ready = False
+    try:
+        snapshot_dir = os.path.join(workdir, "snapshot")
+        await snapshots.export(knowledge_base_id, snapshot_dir)
+        archive = os.path.join(workdir, f"{knowledge_base_id}.tar")
+        await asyncio.to_thread(pack, snapshot_dir, archive)
+        # Only the tar is sent; it is removed once the response is done
+        shutil.rmtree(snapshot_dir)
+        ready = True
+    except SnapshotError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not ready:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return FileResponse(
+        archive,
+        media_type="application/x-tar",
+        filename=f"{knowledge_base_id}.tar",
+        background=BackgroundTask(shutil.rmtree, workdir, ignore_errors=True)
+    )
+
+@router.post(
+    "/knowledge-bases/import",
+    response_model=KnowledgeBaseImportResponse,
+    dependencies=[Depends(require_admin)]
+)
+async def import_knowledge_base(
+    file: UploadFile = File(..., description="Snapshot tar from the export endpoint"),
+    knowledge_base_id: Optional[str] = Form(default=None, description="Target (default: the exported name)"),
+    replace: bool = Form(default=False, description="Replace the knowledge base if it exists"),
+    snapshots: SnapshotService = Depends(get_snapshot_service)
+):
+    """
+    Bulk-load a snapshot: stored embeddings are written as they are, in
+    large batches, nothing is re-encoded. The snapshot's embedding model
+    must be allowed here and match the target knowledge base.
+    """
+    if not snapshots.vectorstore.is_ready():
+        raise HTTPException(status_code=503, detail="Vector store is still warming up")
+    workdir = tempfile.mkdtemp(prefix="kb-import-")
+    try:
+        await asyncio.to_thread(unpack, file.file, workdir)
+        return await snapshots.import_(workdir, knowledge_base_id, replace=replace)
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
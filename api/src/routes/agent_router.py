@@ -1,37 +1,110 @@
-from fastapi import APIRouter, HTTPException, Depends
-from models.schemas import AgentTaskRequest, AgentTaskResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from models.schemas import AgentTaskRequest, AgentTaskResponse, AgentJobRequest, AgentJobResponse
 from services.agent_service import AgentService
-from services.vectorstore_service import VectorStoreService
-from services.claude_service import ClaudeService
+from services.job_service import JobService, JobQueueFullError, WebhookURLError
+import dependencies
+from monitoring.tracing import RequestTrace, trace_requested
+from core.rate_limit import RateLimitExceededError
+import math
 
 router = APIRouter()
 
 def get_agent_service():
     """Dependency to get Agent service instance"""
-    vectorstore = VectorStoreService()
-    claude = ClaudeService()
-    return AgentService(vectorstore, claude)
+    return dependencies.get_agent_service()
 
-@router.post("/execute", response_model=AgentTaskResponse)
+def get_job_service():
+    """Dependency to get the agent job service"""
+    return dependencies.get_job_service()
+
+@router.post(
+    "/execute",
+    response_model=AgentTaskResponse,
+    dependencies=[Depends(dependencies.admission("agent"))]
+)
 async def execute_agent_task(
     request: AgentTaskRequest,
+    http_request: Request,
+    http_response: Response,
     agent_service: AgentService = Depends(get_agent_service)
 ):
     """
     Execute an agentic task using Claude with tool use capabilities.
     The agent can iteratively use tools to complete complex tasks.
+    Set `debug` (or the X-Debug-Trace header) to get a per-stage timing trace.
     """
     try:
-        response = await agent_service.execute_task(
-            task=request.task,
-            model=request.model,
-            max_iterations=request.max_iterations,
-            knowledge_base_id=request.knowledge_base_id,
-            tools=request.tools
-        )
+        enabled = trace_requested(request.debug, http_request.headers)
+        with RequestTrace("agent.execute", enabled=enabled) as trace:
+            response = await agent_service.execute_task(
+                task=request.task,
+                model=request.model,
+                max_iterations=request.max_iterations,
+                knowledge_base_id=request.knowledge_base_id,
+                tools=request.tools,
+                prefetch=request.prefetch
+            )
+        if trace.enabled:
+            response.trace = trace.to_dict()
+            http_response.headers["Server-Timing"] = trace.server_timing()
         return response
+    except RateLimitExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/jobs", response_model=AgentJobResponse, status_code=202)
+async def submit_agent_job(
+    request: AgentJobRequest,
+    http_response: Response,
+    job_service: JobService = Depends(get_job_service)
+):
+    """
+    Queue an agentic task and return its job id immediately.
+    Poll GET /jobs/{job_id} for status and steps, or pass webhook_url to
+    receive the final state.
+    """
+    try:
+        job = await job_service.submit(request)
+        http_response.headers["Location"] = f"/api/agent/jobs/{job['job_id']}"
+        return job
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except WebhookURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}", response_model=AgentJobResponse)
+async def get_agent_job(
+    job_id: str,
+    include_steps: bool = True,
+    job_service: JobService = Depends(get_job_service)
+):
+    """Get the status, steps so far and (once finished) the result of a job"""
+    try:
+        job = await job_service.get(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if not include_steps:
+        job = dict(job, steps=[])
+    return job
+
+@router.delete("/jobs/{job_id}", response_model=AgentJobResponse)
+async def cancel_agent_job(
+    job_id: str,
+    job_service: JobService = Depends(get_job_service)
+):
+    """Cancel a queued or running job"""
+    try:
+        job = await job_service.cancel(job_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
 
 @router.get("/tools")
 async def list_available_tools(
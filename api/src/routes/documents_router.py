@@ -2,14 +2,16 @@ from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
 from typing import Optional, List
 from models.schemas import DocumentInput, DocumentUploadResponse
 from services.document_service import DocumentService
-from services.vectorstore_service import VectorStoreService
+from core.extraction_pool import ExtractionTimeoutError
+from services.extractors import RecordTooLargeError
+from services.vectorstore_service import KnowledgeBaseBusyError
+from dependencies import get_vectorstore_service, get_extraction_pool
 
 router = APIRouter()
 
 def get_document_service():
     """Dependency to get Document service instance"""
-    vectorstore = VectorStoreService()
-    return DocumentService(vectorstore)
+    return DocumentService(get_vectorstore_service(), get_extraction_pool())
 
 @router.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(
@@ -20,20 +22,26 @@ async def upload_document(
 ):
     """
     Upload a document to the knowledge base.
-    Supports: txt, pdf, md, json, csv
+    Supports: txt, pdf, md, json, jsonl, csv
     """
     try:
         import json
         metadata_dict = json.loads(metadata) if metadata else {}
 
-        content = await file.read()
+        # Pass the spooled file itself so CSV/JSON uploads are streamed
         response = await doc_service.upload_file(
-            file_content=content,
+            file_content=file.file,
             filename=file.filename,
             knowledge_base_id=knowledge_base_id,
             metadata=metadata_dict
         )
         return response
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ExtractionTimeoutError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RecordTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -52,6 +60,8 @@ async def add_text_document(
             metadata=document.metadata
         )
         return response
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -67,9 +77,8 @@ async def batch_upload_documents(
     try:
         results = []
         for file in files:
-            content = await file.read()
             response = await doc_service.upload_file(
-                file_content=content,
+                file_content=file.file,
                 filename=file.filename,
                 knowledge_base_id=knowledge_base_id,
                 metadata={}
@@ -80,6 +89,12 @@ async def batch_upload_documents(
             "total_uploaded": len(results),
             "results": results
         }
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ExtractionTimeoutError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RecordTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -93,6 +108,8 @@ async def delete_document(
     try:
         await doc_service.delete_document(document_id, knowledge_base_id)
         return {"status": "success", "message": f"Document {document_id} deleted"}
+    except KnowledgeBaseBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,40 +1,105 @@
-from fastapi import APIRouter, HTTPException, Depends
-from models.schemas import RAGQueryRequest, RAGQueryResponse, SearchRequest, SearchResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from models.schemas import (
+    RAGQueryRequest, RAGQueryResponse, RAGBatchQueryRequest, SearchRequest, SearchResponse,
+    KnowledgeBaseCreateRequest, KnowledgeBaseIndexResponse
+)
 from services.rag_service import RAGService
-from services.vectorstore_service import VectorStoreService
-from services.claude_service import ClaudeService
+from services.embedding_service import UnknownEmbeddingModelError
+import dependencies
+from monitoring.tracing import RequestTrace, trace_requested
+from core.rate_limit import RateLimitExceededError
+from core.admission import AdmissionRejectedError, tenant_of
+import json
+import math
 
 router = APIRouter()
 
 def get_rag_service():
     """Dependency to get RAG service instance"""
-    vectorstore = VectorStoreService()
-    claude = ClaudeService()
-    return RAGService(vectorstore, claude)
+    return dependencies.get_rag_service()
 
-@router.post("/query", response_model=RAGQueryResponse)
+def mmr_options(request):
+    """MMR settings of a query or search request, or None if MMR is off"""
+    if not request.mmr:
+        return None
+    return {"mmr_lambda": request.mmr_lambda, "fetch_k": request.fetch_k}
+
+@router.post(
+    "/query",
+    response_model=RAGQueryResponse,
+    dependencies=[Depends(dependencies.admission("rag"))]
+)
 async def query_rag(
     request: RAGQueryRequest,
+    http_request: Request,
+    http_response: Response,
     rag_service: RAGService = Depends(get_rag_service)
 ):
     """
     Query the RAG system with a question.
     Returns an answer generated by Claude with context from the knowledge base.
+    Set `debug` (or the X-Debug-Trace header) to get a per-stage timing trace.
     """
     try:
-        response = await rag_service.query(
-            query=request.query,
-            knowledge_base_id=request.knowledge_base_id,
-            top_k=request.top_k,
-            model=request.model,
-            temperature=request.temperature,
-            include_sources=request.include_sources
-        )
+        enabled = trace_requested(request.debug, http_request.headers)
+        with RequestTrace("rag.query", enabled=enabled) as trace:
+            response = await rag_service.query(
+                query=request.query,
+                knowledge_base_id=request.knowledge_base_id,
+                top_k=request.top_k,
+                model=request.model,
+                temperature=request.temperature,
+                include_sources=request.include_sources,
+                filter=request.filter,
+                mmr=mmr_options(request)
+            )
+        if trace.enabled:
+            response.trace = trace.to_dict()
+            http_response.headers["Server-Timing"] = trace.server_timing()
         return response
+    except RateLimitExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/search", response_model=SearchResponse)
+@router.post(
+    "/query/batch",
+    dependencies=[Depends(dependencies.admission("batch"))]
+)
+async def query_rag_batch(
+    request: RAGBatchQueryRequest,
+    http_request: Request,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """
+    Answer a list of RAG queries in one call.
+    Retrieval runs as one batched pass and generations run concurrently,
+    each one admitted as a `rag` request of the same tenant.
+    Each answer is streamed as an NDJSON line as soon as it completes:
+    {"index": 0, "status": "ok", "result": {...}} or
+    {"index": 1, "status": "error", "error": "..."}.
+    """
+    limiter = dependencies.get_admission_controller().limiter("rag")
+    tenant = tenant_of(http_request.headers, None)
+
+    async def lines():
+        async for index, result in rag_service.query_batch(request.queries, request.concurrency, limiter, tenant):
+            if isinstance(result, Exception):
+                item = {"index": index, "status": "error", "error": str(result)}
+                if isinstance(result, (RateLimitExceededError, AdmissionRejectedError)):
+                    item["retry_after"] = math.ceil(result.retry_after)
+            else:
+                item = {"index": index, "status": "ok", "result": result.model_dump()}
+            yield json.dumps(item, default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.post(
+    "/search",
+    response_model=SearchResponse,
+    dependencies=[Depends(dependencies.admission("search"))]
+)
 async def search_documents(
     request: SearchRequest,
     rag_service: RAGService = Depends(get_rag_service)
@@ -48,7 +113,8 @@ async def search_documents(
             query=request.query,
             knowledge_base_id=request.knowledge_base_id,
             top_k=request.top_k,
-            filter=request.filter
+            filter=request.filter,
+            mmr=mmr_options(request)
         )
         return results
     except Exception as e:
@@ -64,3 +130,40 @@ async def list_knowledge_bases(
         return {"knowledge_bases": knowledge_bases}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/knowledge-bases", response_model=KnowledgeBaseIndexResponse, status_code=201)
+async def create_knowledge_base(
+    request: KnowledgeBaseCreateRequest,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """
+    Create a knowledge base with its own HNSW index settings and embedding model.
+    Knowledge bases created implicitly (e.g. by an upload) use the defaults.
+    """
+    try:
+        return await rag_service.vectorstore.create_collection(
+            request.knowledge_base_id,
+            request.index.model_dump(),
+            request.embedding_model,
+            document_index=request.document_index,
+            top_documents=request.top_documents
+        )
+    except UnknownEmbeddingModelError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/knowledge-bases/{knowledge_base_id}/index", response_model=KnowledgeBaseIndexResponse)
+async def get_knowledge_base_index(
+    knowledge_base_id: str,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """Get the HNSW index settings and size of a knowledge base"""
+    if knowledge_base_id not in await rag_service.list_knowledge_bases():
+        raise HTTPException(status_code=404, detail=f"Knowledge base {knowledge_base_id} not found")
+    try:
+        return await rag_service.vectorstore.get_index_info(knowledge_base_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
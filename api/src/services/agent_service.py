@@ -1,8 +1,15 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Awaitable
 from services.vectorstore_service import VectorStoreService
 from services.claude_service import ClaudeService
 from models.schemas import AgentTaskResponse
+from monitoring.metrics import track_stage, get_cache_stats
+from monitoring.tracing import annotate
+from core.singleflight import make_key
+from core.ttl_cache import TTLCache
+import asyncio
 import json
+import os
+import uuid
 
 class AgentService:
     """Service for agentic task execution with tool use"""
@@ -11,6 +18,20 @@ class AgentService:
         self.vectorstore = vectorstore
         self.claude = claude
         self.available_tools = self._define_tools()
+        self.cache_policies = self._define_cache_policies()
+        self.tool_cache = TTLCache(
+            max_entries=int(os.getenv("AGENT_TOOL_CACHE_SIZE", "1024")),
+            stats=get_cache_stats("agent_tool_results")
+        )
+        # Speculative knowledge base prefetch: fetch up to max_hits, drop hits
+        # below min_score and stop once the kept scores add up to the budget,
+        # so a few strong hits are enough while weak ones are padded out
+        self.prefetch_max_hits = int(os.getenv("AGENT_PREFETCH_MAX_HITS", "5"))
+        self.prefetch_min_score = float(os.getenv("AGENT_PREFETCH_MIN_SCORE", "0.2"))
+        self.prefetch_score_budget = float(os.getenv("AGENT_PREFETCH_SCORE_BUDGET", "1.5"))
+        # Stream Claude's turns and start each tool as soon as its call is
+        # complete, instead of after the whole message
+        self.stream_tools = os.getenv("AGENT_STREAM_TOOLS", "true").lower() == "true"
 
     def _define_tools(self) -> List[Dict[str, Any]]:
         """Define available tools for the agent"""
@@ -32,6 +53,14 @@ class AgentService:
                         "top_k": {
                             "type": "integer",
                             "description": "Number of results to return (default: 5)"
+                        },
+                        "mmr": {
+                            "type": "boolean",
+                            "description": "Diversify the results so near-duplicate passages are not returned together (default: false)"
+                        },
+                        "mmr_lambda": {
+                            "type": "number",
+                            "description": "With mmr, trade-off between relevance (1) and diversity (0) (default: 0.5)"
                         }
                     },
                     "required": ["query"]
@@ -67,17 +96,55 @@ class AgentService:
             }
         ]
 
+    def _define_cache_policies(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Tools whose results can be memoized, and how.
+        Kept apart from the tool schemas, which are sent to Claude as-is.
+          ttl: seconds a result stays valid (AGENT_TOOL_CACHE_TTL_<TOOL> overrides it)
+          defaults: parameter defaults, so omitted and explicit values share an entry
+          knowledge_base_scoped: results depend on the knowledge base, so the
+            key includes it and its version (any write invalidates the entry)
+          task_scoped: results are only reused within the task that produced
+            them, never handed to another task (or tenant)
+        A ttl of 0 turns memoization off for the tool.
+        """
+        policies = {
+            "search_knowledge_base": {
+                "ttl": 300.0,
+                "defaults": {"top_k": 5, "mmr": False},
+                "knowledge_base_scoped": True,
+                "task_scoped": False
+            },
+            "python_repl": {
+                # Off by default: code output is the caller's data, and code
+                # may not be deterministic
+                "ttl": 0.0,
+                "defaults": {},
+                "knowledge_base_scoped": False,
+                "task_scoped": True
+            }
+        }
+        for name, policy in policies.items():
+            policy["ttl"] = float(os.getenv(f"AGENT_TOOL_CACHE_TTL_{name.upper()}", policy["ttl"]))
+        return policies
+
     async def execute_task(
         self,
         task: str,
         model: str = "claude-3-5-sonnet-20241022",
         max_iterations: int = 5,
         knowledge_base_id: Optional[str] = None,
-        tools: Optional[List[str]] = None
+        tools: Optional[List[str]] = None,
+        prefetch: bool = False,
+        on_step: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
     ) -> AgentTaskResponse:
         """
         Execute an agentic task with iterative tool use.
         The agent will use tools as needed to complete the task.
+        With prefetch, the knowledge base is searched for the task before the
+        first turn and the top hits are given to it, which saves the round
+        trip of a first turn that only asks for that search.
+        on_step is awaited with each step as soon as it is recorded.
         """
 
         # Filter tools if specific ones are requested
@@ -94,97 +161,143 @@ Think step by step about what you need to do.
 Use the available tools when necessary to gather information or perform actions.
 Always provide a clear final answer to the user's request."""
 
+        steps = []
+        first_turn = task
+        # Cache key -> id of the tool_use that already returned that result
+        answered_calls: Dict[tuple, str] = {}
+        # Scope of the tool results only this task may reuse
+        task_id = uuid.uuid4().hex
+
+        if prefetch and knowledge_base_id and any(
+            tool["name"] == "search_knowledge_base" for tool in available_tools
+        ):
+            prefetch_step, context = await self._prefetch(task, knowledge_base_id)
+            steps.append(prefetch_step)
+            if on_step is not None:
+                await on_step(prefetch_step)
+            if context:
+                first_turn = f"""{task}
+
+Relevant excerpts from the knowledge base "{knowledge_base_id}", already retrieved for this task. Search again only if they are not enough:
+
+{context}"""
+
         # Initialize conversation
         messages = [
-            {"role": "user", "content": task}
+            {"role": "user", "content": first_turn}
         ]
 
-        steps = []
         total_usage = {"input_tokens": 0, "output_tokens": 0}
         iteration = 0
 
         while iteration < max_iterations:
             iteration += 1
 
-            # Get response from Claude with tools
-            response = await self.claude.generate_with_tools(
-                messages=messages,
-                tools=available_tools,
-                system_prompt=system_prompt,
-                model=model
-            )
-
-            # Track usage
-            total_usage["input_tokens"] += response["usage"]["input_tokens"]
-            total_usage["output_tokens"] += response["usage"]["output_tokens"]
-
-            # Add assistant response to messages
-            assistant_content = []
-            if response["text"]:
-                assistant_content.append({
-                    "type": "text",
-                    "text": response["text"]
-                })
-
-            # Record step
-            step = {
-                "iteration": iteration,
-                "thought": response["text"],
-                "tool_uses": []
-            }
-
-            # Process tool uses
-            if response["tool_uses"]:
-                for tool_use in response["tool_uses"]:
+            with track_stage("agent", "iteration"):
+                annotate(iteration=iteration)
+                dispatcher = None
+                if self.stream_tools:
+                    dispatcher = _ToolDispatcher(self, knowledge_base_id, answered_calls, task_id)
+
+                # Get response from Claude with tools
+                try:
+                    response = await self.claude.generate_with_tools(
+                        messages=messages,
+                        tools=available_tools,
+                        system_prompt=system_prompt,
+                        model=model,
+                        on_tool_use=dispatcher.start if dispatcher is not None else None
+                    )
+                except BaseException:
+                    if dispatcher is not None:
+                        dispatcher.cancel()
+                    raise
+
+                # Track usage
+                total_usage["input_tokens"] += response["usage"]["input_tokens"]
+                total_usage["output_tokens"] += response["usage"]["output_tokens"]
+
+                # Add assistant response to messages
+                assistant_content = []
+                if response["text"]:
                     assistant_content.append({
-                        "type": "tool_use",
-                        "id": tool_use["id"],
-                        "name": tool_use["name"],
-                        "input": tool_use["input"]
+                        "type": "text",
+                        "text": response["text"]
                     })
 
-                    # Execute tool
-                    tool_result = await self._execute_tool(
-                        tool_use["name"],
-                        tool_use["input"],
-                        knowledge_base_id
-                    )
+                # Record step
+                step = {
+                    "iteration": iteration,
+                    "thought": response["text"],
+                    "tool_uses": []
+                }
 
-                    step["tool_uses"].append({
-                        "tool": tool_use["name"],
-                        "input": tool_use["input"],
-                        "result": tool_result
+                # Process tool uses
+                if response["tool_uses"]:
+                    for tool_use in response["tool_uses"]:
+                        assistant_content.append({
+                            "type": "tool_use",
+                            "id": tool_use["id"],
+                            "name": tool_use["name"],
+                            "input": tool_use["input"]
+                        })
+
+                        # Execute tool (or collect the result of the one started while streaming)
+                        if dispatcher is not None:
+                            try:
+                                tool_result = await dispatcher.result(tool_use)
+                            except BaseException:
+                                dispatcher.cancel()
+                                raise
+                        else:
+                            tool_result = await self._execute_tool(
+                                tool_use["name"],
+                                tool_use["input"],
+                                knowledge_base_id,
+                                answered_calls=answered_calls,
+                                tool_use_id=tool_use["id"],
+                                task_id=task_id
+                            )
+
+                        step["tool_uses"].append({
+                            "tool": tool_use["name"],
+                            "input": tool_use["input"],
+                            "result": tool_result
+                        })
+
+                    # Add assistant message with tool uses
+                    messages.append({
+                        "role": "assistant",
+                        "content": assistant_content
                     })
 
-                # Add assistant message with tool uses
-                messages.append({
-                    "role": "assistant",
-                    "content": assistant_content
-                })
-
-                # Add tool results
-                tool_result_content = []
-                for tool_use, step_tool in zip(response["tool_uses"], step["tool_uses"]):
-                    tool_result_content.append({
-                        "type": "tool_result",
-                        "tool_use_id": tool_use["id"],
-                        "content": json.dumps(step_tool["result"])
+                    # Add tool results
+                    tool_result_content = []
+                    for tool_use, step_tool in zip(response["tool_uses"], step["tool_uses"]):
+                        tool_result_content.append({
+                            "type": "tool_result",
+                            "tool_use_id": tool_use["id"],
+                            "content": json.dumps(step_tool["result"])
+                        })
+
+                    messages.append({
+                        "role": "user",
+                        "content": tool_result_content
                     })
 
-                messages.append({
-                    "role": "user",
-                    "content": tool_result_content
-                })
+                    steps.append(step)
+                    if on_step is not None:
+                        await on_step(step)
+                else:
+                    # No more tool uses, task is complete
+                    steps.append(step)
+                    if on_step is not None:
+                        await on_step(step)
+                    break
 
-                steps.append(step)
-            else:
-                # No more tool uses, task is complete
-                steps.append(step)
-                break
-
-            # Check stop reason
-            if response["stop_reason"] == "end_turn":
-                break
+                # Check stop reason
+                if response["stop_reason"] == "end_turn":
+                    break
 
         # Determine success
         success = response["stop_reason"] in ["end_turn", "stop_sequence"]
@@ -196,23 +309,149 @@ Always provide a clear final answer to the user's request."""
             success=success
         )
 
+    async def _prefetch(self, task: str, knowledge_base_id: str):
+        """
+        Search the knowledge base with the task text.
+        Returns the step to record (iteration 0) and the context to inject,
+        which is empty when nothing relevant was found.
+        """
+        tool_input = {
+            "query": task,
+            "knowledge_base_id": knowledge_base_id,
+            "top_k": self.prefetch_max_hits
+        }
+        step = {
+            "iteration": 0,
+            "thought": "Prefetched knowledge base context for the task",
+            "tool_uses": [],
+            "prefetch": {"used": False, "hits": 0}
+        }
+
+        with track_stage("agent", "prefetch"):
+            try:
+                result = await self._execute_tool("search_knowledge_base", tool_input, knowledge_base_id)
+            except Exception as e:
+                # The agent can still search by itself
+                step["prefetch"]["error"] = str(e)
+                return step, ""
+
+            hits = []
+            total_score = 0.0
+            for hit in result["results"]:
+                if hit["score"] < self.prefetch_min_score or total_score >= self.prefetch_score_budget:
+                    break
+                hits.append(hit)
+                total_score += hit["score"]
+            annotate(hits=len(hits))
+
+        step["tool_uses"].append({
+            "tool": "search_knowledge_base",
+            "input": tool_input,
+            "result": {"results": hits}
+        })
+        step["prefetch"] = {"used": bool(hits), "hits": len(hits)}
+
+        context_parts = []
+        for i, hit in enumerate(hits, 1):
+            source_info = ""
+            if "source" in hit["metadata"]:
+                source_info = f" (Source: {hit['metadata']['source']})"
+            context_parts.append(f"[{i}]{source_info}\n{hit['content']}\n")
+
+        return step, "\n".join(context_parts)
+
     async def _execute_tool(
+        self,
+        tool_name: str,
+        parameters: Dict[str, Any],
+        knowledge_base_id: Optional[str] = None,
+        answered_calls: Optional[Dict[tuple, str]] = None,
+        tool_use_id: Optional[str] = None,
+        task_id: Optional[str] = None
+    ) -> Any:
+        """
+        Execute a tool and return the result.
+        Results of cacheable tools are memoized across iterations and tasks
+        (only across the iterations of task_id for task-scoped tools).
+        With answered_calls (one task's calls so far), an exact repeat gets a
+        short reference to the earlier tool_use instead of the full payload.
+        """
+        # Tool names come from the model; keep the metric label set bounded
+        known_tools = {tool["name"] for tool in self.available_tools}
+        stage = tool_name if tool_name in known_tools else "unknown"
+
+        with track_stage("agent_tool", stage):
+            annotate(tool=tool_name)
+            key = self._cache_key(tool_name, parameters, knowledge_base_id, task_id)
+            if key is None:
+                return await self._run_tool(tool_name, parameters, knowledge_base_id)
+
+            if answered_calls is not None and key in answered_calls:
+                annotate(cache="repeat")
+                return {
+                    "same_as_tool_use_id": answered_calls[key],
+                    "note": "Identical call already made in this task; its result is unchanged, see that tool_result."
+                }
+
+            result = self.tool_cache.get(key)
+            annotate(cache="hit" if result is not None else "miss")
+            if result is None:
+                result = await self._run_tool(tool_name, parameters, knowledge_base_id)
+                if isinstance(result, dict) and "error" in result:
+                    # Errors are neither cached nor referenced, so a retry runs again
+                    return result
+                self.tool_cache.put(key, result, self.cache_policies[tool_name]["ttl"])
+
+            if answered_calls is not None and tool_use_id:
+                answered_calls[key] = tool_use_id
+            return result
+
+    def _cache_key(
+        self,
+        tool_name: str,
+        parameters: Dict[str, Any],
+        knowledge_base_id: Optional[str],
+        task_id: Optional[str] = None
+    ) -> Optional[tuple]:
+        """Memoization key for a tool call, or None if the tool is not cacheable"""
+        policy = self.cache_policies.get(tool_name)
+        if policy is None or policy["ttl"] <= 0 or not isinstance(parameters, dict):
+            return None
+        if policy["task_scoped"] and task_id is None:
+            return None
+
+        canonical = dict(policy["defaults"])
+        canonical.update(parameters)
+        version = None
+        if policy["knowledge_base_scoped"]:
+            kb_id = parameters.get("knowledge_base_id", knowledge_base_id or "default")
+            canonical["knowledge_base_id"] = kb_id
+            version = self.vectorstore.get_kb_version(kb_id)
+
+        scope = task_id if policy["task_scoped"] else None
+        return make_key(tool_name, canonical, version, scope)
+
+    async def _run_tool(
         self,
         tool_name: str,
         parameters: Dict[str, Any],
         knowledge_base_id: Optional[str] = None
     ) -> Any:
-        """Execute a tool and return the result"""
+        """Dispatch a tool call to its implementation"""
 
         if tool_name == "search_knowledge_base":
             kb_id = parameters.get("knowledge_base_id", knowledge_base_id or "default")
             query = parameters["query"]
             top_k = parameters.get("top_k", 5)
+            mmr = {}
+            if parameters.get("mmr"):
+                mmr = {"mmr": True, "mmr_lambda": float(parameters.get("mmr_lambda", 0.5))}
 
             results = await self.vectorstore.search(
                 query=query,
                 knowledge_base_id=kb_id,
-                top_k=top_k
+                top_k=top_k,
+                **mmr
             )
 
             return {
@@ -261,3 +500,65 @@ Always provide a clear final answer to the user's request."""
             }
             for tool in self.available_tools
         ]
+
+
+class _ToolDispatcher:
+    """
+    Runs one turn's tool calls as they arrive from the stream.
+
+    Calls run concurrently, except that a call identical to an earlier one
+    of the turn waits for it first, so it is answered exactly as it would
+    be one after the other (a reference to the earlier tool_use). Results
+    are collected in the order of the message.
+    """
+
+    def __init__(
+        self,
+        agent: AgentService,
+        knowledge_base_id: Optional[str],
+        answered_calls: Dict[tuple, str],
+        task_id: Optional[str] = None
+    ):
+        self.agent = agent
+        self.knowledge_base_id = knowledge_base_id
+        self.answered_calls = answered_calls
+        self.task_id = task_id
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._by_key: Dict[tuple, asyncio.Task] = {}
+
+    def start(self, tool_use: Dict[str, Any]):
+        """Start a tool call (no-op if it is already running)"""
+        if tool_use["id"] in self._tasks:
+            return
+        key = self.agent._cache_key(tool_use["name"], tool_use["input"], self.knowledge_base_id, self.task_id)
+        previous = self._by_key.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(tool_use, previous))
+        self._tasks[tool_use["id"]] = task
+        if key is not None:
+            self._by_key[key] = task
+
+    async def result(self, tool_use: Dict[str, Any]) -> Any:
+        self.start(tool_use)
+        return await self._tasks[tool_use["id"]]
+
+    def cancel(self):
+        """Stop calls that are still running, e.g. after another one failed"""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Mark a failure as retrieved; the first one is already being raised
+                task.exception()
+
+    async def _run(self, tool_use: Dict[str, Any], previous: Optional[asyncio.Task]) -> Any:
+        if previous is not None:
+            # Its outcome is reported by its own result()
+            await asyncio.wait([previous])
+        return await self.agent._execute_tool(
+            tool_use["name"],
+            tool_use["input"],
+            self.knowledge_base_id,
+            answered_calls=self.answered_calls,
+            tool_use_id=tool_use["id"],
+            task_id=self.task_id
+        )
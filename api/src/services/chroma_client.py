@@ -0,0 +1,206 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import os
+
+# Chroma client construction for the two deployment modes.
+#
+# CHROMA_MODE=embedded (default): PersistentClient on CHROMA_PERSIST_DIR, in
+# this process. Each API replica has its own index.
+# CHROMA_MODE=server: HttpClient to a Chroma server that every replica
+# shares. Embedding still happens in the API (or its sidecar); only vectors
+# travel. The client's requests.Session gets a pooled adapter with a
+# default timeout and retries for failures where the request never reached
+# Chroma, and small concurrent writes are merged by WriteBatcher.
+
+EMBEDDED = "embedded"
+SERVER = "server"
+
+
+def chroma_mode() -> str:
+    mode = os.getenv("CHROMA_MODE", EMBEDDED).lower()
+    if mode not in (EMBEDDED, SERVER):
+        raise ValueError(f"Unknown CHROMA_MODE: {mode}")
+    return mode
+
+
+def create_chroma_client(persist_directory: str):
+    """Chroma client for CHROMA_MODE"""
+    import chromadb
+    from chromadb.config import Settings
+
+    if chroma_mode() == EMBEDDED:
+        return chromadb.PersistentClient(
+            path=persist_directory,
+            settings=Settings(anonymized_telemetry=False)
+        )
+
+    headers = {}
+    if os.getenv("CHROMA_AUTH_TOKEN"):
+        headers["Authorization"] = f"Bearer {os.getenv('CHROMA_AUTH_TOKEN')}"
+    client = chromadb.HttpClient(
+        host=os.getenv("CHROMA_HOST", "localhost"),
+        port=os.getenv("CHROMA_PORT", "8000"),
+        ssl=os.getenv("CHROMA_SSL", "false").lower() == "true",
+        headers=headers,
+        settings=Settings(anonymized_telemetry=False)
+    )
+    tune_http_session(
+        client,
+        pool_size=int(os.getenv("CHROMA_HTTP_POOL_SIZE", "32")),
+        connect_timeout=float(os.getenv("CHROMA_HTTP_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("CHROMA_HTTP_TIMEOUT", "30")),
+        retries=int(os.getenv("CHROMA_HTTP_RETRIES", "3")),
+        backoff=float(os.getenv("CHROMA_HTTP_RETRY_BACKOFF", "0.5"))
+    )
+    return client
+
+
+def tune_http_session(
+    client,
+    pool_size: int,
+    connect_timeout: float,
+    read_timeout: float,
+    retries: int,
+    backoff: float
+) -> bool:
+    """
+    Give the HttpClient's requests.Session a connection pool of pool_size,
+    a default (connect, read) timeout and retries. Returns False when the
+    session cannot be found (other chromadb versions keep their defaults).
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    server = getattr(client, "_server", client)
+    session = getattr(server, "_session", None)
+    if session is None:
+        print("Chroma HTTP session not found; pool, timeout and retry settings not applied")
+        return False
+
+    class TimeoutHTTPAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = (connect_timeout, read_timeout)
+            return super().send(request, **kwargs)
+
+    # Only retry failures where the request never reached Chroma: connection
+    # errors, and 502/503/504 from a proxy in front of it. A request that
+    # timed out may still be running on the server; replaying it only adds load
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=None,
+        backoff_factor=backoff,
+        raise_on_status=False
+    )
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return True
+
+
+class _PendingWrite:
+    __slots__ = ("collection", "items", "size", "timer")
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.items: List[tuple] = []
+        self.size = 0
+        self.timer: Optional[asyncio.Task] = None
+
+
+class WriteBatcher:
+    """
+    Merges concurrent add() calls to the same collection into one request.
+
+    A write waits up to max_wait_ms for others to the same collection and
+    goes out with them once max_batch records are queued or the wait is
+    over. If the merged request fails, each caller's records are retried on
+    their own so one bad write (e.g. invalid metadata) only fails its caller.
+    Writes of max_batch records or more skip the queue.
+    """
+
+    def __init__(self, run: Callable[..., Awaitable[Any]], max_batch: int = 500, max_wait_ms: float = 5.0):
+        self.run = run
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._flushing: set = set()
+        self.stats = {"writes": 0, "requests": 0}
+
+    async def add(self, collection, ids: List[str], embeddings, documents, metadatas):
+        self.stats["writes"] += 1
+        if len(ids) >= self.max_batch or self.max_wait <= 0:
+            self.stats["requests"] += 1
+            await self.run(collection.add, ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+            return
+
+        pending = self._pending.get(collection.name)
+        if pending is None:
+            pending = _PendingWrite(collection)
+            self._pending[collection.name] = pending
+            pending.timer = asyncio.create_task(self._flush_later(collection.name, pending))
+
+        future = asyncio.get_running_loop().create_future()
+        pending.items.append((ids, embeddings, documents, metadatas, future))
+        pending.size += len(ids)
+        if pending.size >= self.max_batch:
+            self._take(collection.name, pending)
+            pending.timer.cancel()
+            task = asyncio.create_task(self._flush(pending))
+            # The loop only keeps weak references to tasks
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+        await future
+
+    def _take(self, name: str, pending: _PendingWrite):
+        if self._pending.get(name) is pending:
+            del self._pending[name]
+
+    async def _flush_later(self, name: str, pending: _PendingWrite):
+        await asyncio.sleep(self.max_wait)
+        self._take(name, pending)
+        await self._flush(pending)
+
+    async def _flush(self, pending: _PendingWrite):
+        items = pending.items
+        try:
+            self.stats["requests"] += 1
+            await self.run(
+                pending.collection.add,
+                ids=[i for item in items for i in item[0]],
+                embeddings=[e for item in items for e in item[1]],
+                documents=[d for item in items for d in item[2]],
+                metadatas=[m for item in items for m in item[3]]
+            )
+        except Exception as error:
+            if len(items) == 1:
+                _settle(items[0][4], error)
+                return
+            for ids, embeddings, documents, metadatas, future in items:
+                try:
+                    self.stats["requests"] += 1
+                    await self.run(
+                        pending.collection.add,
+                        ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas
+                    )
+                    _settle(future)
+                except Exception as item_error:
+                    _settle(future, item_error)
+            return
+
+        for item in items:
+            _settle(item[4])
+
+
+def _settle(future: asyncio.Future, error: Optional[BaseException] = None):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
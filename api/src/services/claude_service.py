@@ -1,6 +1,9 @@
-from anthropic import Anthropic
 import os
-from typing import List, Dict, Any, Optional
+import json
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from monitoring.metrics import track_stage, record_claude_usage
+from monitoring.tracing import annotate
+from core.rate_limit import ClaudeScheduler, Priority
 
 class ClaudeService:
     """Service for interacting with Claude API"""
@@ -10,7 +13,13 @@ class ClaudeService:
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable not set")
 
-        self.client = Anthropic(api_key=api_key)
+        # Imported here so that importing the app does not pay for the SDK
+        from anthropic import AsyncAnthropic
+
+        # Retries are done by the scheduler so they respect our rate limit
+        # buckets and priorities instead of the SDK's own backoff
+        self.client = AsyncAnthropic(api_key=api_key, max_retries=0)
+        self.scheduler = ClaudeScheduler.from_env()
         self._initialized = True
 
     def is_ready(self) -> bool:
@@ -24,7 +33,8 @@ class ClaudeService:
         model: str = "claude-3-5-sonnet-20241022",
         max_tokens: int = 4096,
         temperature: float = 1.0,
-        messages: Optional[List[Dict[str, str]]] = None
+        messages: Optional[List[Dict[str, str]]] = None,
+        priority: Priority = Priority.INTERACTIVE
     ) -> Dict[str, Any]:
         """Generate a response from Claude"""
 
@@ -33,11 +43,13 @@ class ClaudeService:
             messages = [{"role": "user", "content": prompt}]
 
         # Create message
-        response = self.client.messages.create(
+        response = await self._create(
+            "generate",
+            priority,
             model=model,
             max_tokens=max_tokens,
             temperature=temperature,
-            system=system_prompt if system_prompt else None,
+            system=system_prompt,
             messages=messages
         )
 
@@ -47,12 +59,15 @@ class ClaudeService:
             if content_block.type == "text":
                 text_response += content_block.text
 
+        usage = {
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens
+        }
+        record_claude_usage(model, usage)
+
         return {
             "response": text_response,
-            "usage": {
-                "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens
-            },
+            "usage": usage,
             "model": response.model,
             "stop_reason": response.stop_reason
         }
@@ -63,14 +78,26 @@ class ClaudeService:
         tools: List[Dict[str, Any]],
         system_prompt: Optional[str] = None,
         model: str = "claude-3-5-sonnet-20241022",
-        max_tokens: int = 4096
+        max_tokens: int = 4096,
+        priority: Priority = Priority.AGENT,
+        on_tool_use: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> Dict[str, Any]:
-        """Generate a response with tool use capabilities"""
+        """
+        Generate a response with tool use capabilities.
+        With on_tool_use, the response is streamed and on_tool_use is called
+        with each tool call as soon as its input is complete, while the rest
+        of the message is still being generated. The result is the same.
+        """
+
+        on_block = _tool_use_forwarder(on_tool_use) if on_tool_use is not None else None
 
-        response = self.client.messages.create(
+        response = await self._create(
+            "generate_with_tools",
+            priority,
+            on_block=on_block,
             model=model,
             max_tokens=max_tokens,
-            system=system_prompt if system_prompt else None,
+            system=system_prompt,
             messages=messages,
             tools=tools
         )
@@ -83,23 +110,119 @@ class ClaudeService:
             if content_block.type == "text":
                 text_responses.append(content_block.text)
             elif content_block.type == "tool_use":
-                tool_uses.append({
-                    "id": content_block.id,
-                    "name": content_block.name,
-                    "input": content_block.input
-                })
+                tool_uses.append(_tool_use_of(content_block))
+
+        usage = {
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens
+        }
+        record_claude_usage(model, usage)
 
         return {
             "text": "\n".join(text_responses) if text_responses else "",
             "tool_uses": tool_uses,
             "stop_reason": response.stop_reason,
-            "usage": {
-                "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens
-            }
+            "usage": usage
         }
 
+    async def _create(
+        self,
+        stage: str,
+        priority: Priority,
+        on_block: Optional[Callable[[Any], None]] = None,
+        **params
+    ) -> Any:
+        """
+        Send a Messages API request through the rate limit scheduler.
+        With on_block, the response is streamed and on_block is called with
+        each content block as soon as it is complete.
+        """
+        if not params.get("system"):
+            params.pop("system", None)
+
+        estimated_input = self.estimate_input_tokens(
+            params["messages"], params.get("system"), params.get("tools")
+        )
+
+        delivered = []
+
+        async def call():
+            with track_stage("claude", stage):
+                if on_block is None:
+                    response = await self.client.messages.create(**params)
+                else:
+                    async with self.client.messages.stream(**params) as stream:
+                        async for event in stream:
+                            if event.type == "content_block_stop":
+                                delivered.append(event.index)
+                                on_block(event.content_block)
+                        response = await stream.get_final_message()
+                annotate(
+                    model=params["model"],
+                    input_tokens=response.usage.input_tokens,
+                    output_tokens=response.usage.output_tokens,
+                    stop_reason=response.stop_reason
+                )
+                return response
+
+        return await self.scheduler.run(
+            call,
+            input_tokens=estimated_input,
+            output_tokens=params["max_tokens"],
+            priority=priority,
+            usage_of=_usage_of,
+            # Blocks already handed to on_block may have been acted upon:
+            # a failure after that is not replayed
+            retry_after_of=lambda error: None if delivered else _retry_after_of(error)
+        )
+
+    def estimate_input_tokens(
+        self,
+        messages: List[Dict[str, Any]],
+        system_prompt: Optional[str] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
+    ) -> int:
+        """Estimate the prompt size of a request (messages, system prompt and tool schemas)"""
+        size = len(json.dumps(messages, ensure_ascii=False, default=str))
+        if system_prompt:
+            size += len(system_prompt)
+        if tools:
+            size += len(json.dumps(tools, ensure_ascii=False))
+        return _estimate_tokens(size)
+
     async def count_tokens(self, text: str) -> int:
         """Estimate token count for text"""
-        # Rough estimation: 1 token ≈ 4 characters
-        return len(text) // 4
+        return _estimate_tokens(len(text))
+
+def _estimate_tokens(chars: int) -> int:
+    # Rough estimation: 1 token ≈ 4 characters
+    return chars // 4
+
+def _tool_use_of(content_block) -> Dict[str, Any]:
+    return {
+        "id": content_block.id,
+        "name": content_block.name,
+        "input": content_block.input
+    }
+
+def _tool_use_forwarder(on_tool_use: Callable[[Dict[str, Any]], None]) -> Callable[[Any], None]:
+    """on_block callback passing each finished tool_use block to on_tool_use"""
+    def on_block(content_block):
+        if content_block.type == "tool_use":
+            on_tool_use(_tool_use_of(content_block))
+    return on_block
+
+def _usage_of(response) -> Tuple[int, int]:
+    return response.usage.input_tokens, response.usage.output_tokens
+
+def _retry_after_of(error: BaseException) -> Optional[float]:
+    """Seconds suggested by a 429/529 response (0 if no header), None if not retryable"""
+    status = getattr(error, "status_code", None)
+    if status not in (429, 529):
+        return None
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(header) if header else 0.0
+    except ValueError:
+        return 0.0
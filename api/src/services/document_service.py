@@ -1,29 +1,43 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Union, BinaryIO
 from services.vectorstore_service import VectorStoreService
+from services.extractors import (
+    STREAMING_TYPES, extract_segments, pdf_page_count, pdf_extract_pages, page_ranges
+)
+from core.centroid import Centroid
+from core.extraction_pool import ExtractionPool
 from models.schemas import DocumentUploadResponse
+from monitoring.metrics import track_stage
+import asyncio
+import importlib.util
+import itertools
+import shutil
+import tempfile
+import time
 import uuid
 import io
+import os
 
 class DocumentService:
     """Service for document management and processing"""
 
-    def __init__(self, vectorstore: VectorStoreService):
+    def __init__(self, vectorstore: VectorStoreService, extraction_pool: Optional[ExtractionPool] = None):
         self.vectorstore = vectorstore
+        self.extraction_pool = extraction_pool or ExtractionPool.from_env()
+        # Token budget of a CSV/JSON chunk (~1000 characters, like _chunk_text)
+        self.structured_chunk_tokens = int(os.getenv("INGEST_CHUNK_TOKENS", "250"))
+        # Chunks embedded and written per vector store call while streaming
+        self.ingest_batch_size = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+        # Largest single JSON/JSONL record accepted (held in memory while parsed)
+        self.max_record_chars = int(float(os.getenv("INGEST_MAX_RECORD_MB", "16")) * (1 << 20))
 
     async def upload_file(
         self,
-        file_content: bytes,
+        file_content: Union[bytes, BinaryIO],
         filename: str,
         knowledge_base_id: str = "default",
         metadata: Optional[Dict[str, Any]] = None
     ) -> DocumentUploadResponse:
-        """Upload and process a file"""
-
-        # Extract text from file based on type
-        text_content = await self._extract_text(file_content, filename)
-
-        # Chunk the content
-        chunks = self._chunk_text(text_content)
+        """Upload and process a file (raw bytes or a binary file object)"""
 
         # Add metadata
         if metadata is None:
@@ -32,28 +46,152 @@ class DocumentService:
         metadata["source"] = filename
         metadata["type"] = self._get_file_type(filename)
 
-        # Create metadata for each chunk
+        if metadata["type"] in STREAMING_TYPES:
+            if isinstance(file_content, (bytes, bytearray)):
+                file_content = io.BytesIO(file_content)
+            return await self._upload_structured(file_content, knowledge_base_id, metadata)
+
+        # Extract text from file based on type, as (text, metadata) sections
+        # (one per page for PDFs, a single one otherwise)
+        with track_stage("ingestion", "extract"):
+            if metadata["type"] == "pdf":
+                sections = await self._extract_pdf_pages(file_content)
+            else:
+                if not isinstance(file_content, (bytes, bytearray)):
+                    file_content = await asyncio.to_thread(file_content.read)
+                sections = [(self._extract_text(file_content, metadata["type"]), {})]
+
+        # Chunk the content, section by section so chunks keep their page
+        document_id = str(uuid.uuid4())
+        chunks = []
         chunk_metadatas = []
-        for i, chunk in enumerate(chunks):
-            chunk_meta = metadata.copy()
-            chunk_meta["chunk_index"] = i
-            chunk_metadatas.append(chunk_meta)
+        with track_stage("ingestion", "chunk"):
+            for text, section_meta in sections:
+                for chunk in self._chunk_text(text):
+                    chunk_meta = metadata.copy()
+                    chunk_meta.update(section_meta)
+                    chunk_meta["chunk_index"] = len(chunks)
+                    chunk_meta["document_id"] = document_id
+                    chunks.append(chunk)
+                    chunk_metadatas.append(chunk_meta)
 
         # Add to vector store
-        document_id = str(uuid.uuid4())
         chunk_ids = [f"{document_id}_chunk_{i}" for i in range(len(chunks))]
+        centroid = await self._new_centroid(knowledge_base_id)
+
+        with track_stage("ingestion", "index"):
+            await self.vectorstore.add_documents(
+                documents=chunks,
+                metadatas=chunk_metadatas,
+                knowledge_base_id=knowledge_base_id,
+                ids=chunk_ids,
+                on_embeddings=centroid.add if centroid else None
+            )
+            await self._index_document(knowledge_base_id, document_id, centroid, metadata)
 
-        await self.vectorstore.add_documents(
-            documents=chunks,
-            metadatas=chunk_metadatas,
+        return DocumentUploadResponse(
+            document_id=document_id,
             knowledge_base_id=knowledge_base_id,
-            ids=chunk_ids
+            chunks_created=len(chunks),
+            status="success"
+        )
+
+    async def _extract_pdf_pages(self, file_content: Union[bytes, BinaryIO]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Extract PDF text in the extraction process pool.
+        Page ranges are parsed in parallel by several workers and returned in
+        page order with their 1-based page number. The whole document shares
+        one deadline (EXTRACTION_TIMEOUT).
+        """
+        if importlib.util.find_spec("PyPDF2") is None:
+            return [("PDF processing not available. Install PyPDF2.", {})]
+
+        pool = self.extraction_pool
+        deadline = time.monotonic() + pool.timeout
+
+        # Workers read the document from a temp file rather than each task
+        # receiving a pickled copy of it
+        path = await asyncio.to_thread(_spill_to_file, file_content)
+        try:
+            (page_count,) = await pool.map_ordered(pdf_page_count, [(path,)], deadline)
+            ranges = page_ranges(page_count, pool.max_workers)
+            results = await pool.map_ordered(
+                pdf_extract_pages,
+                [(path, start, end) for start, end in ranges],
+                deadline
+            )
+        finally:
+            os.unlink(path)
+
+        pages = []
+        for (start, _), texts in zip(ranges, results):
+            for offset, text in enumerate(texts):
+                pages.append((text, {"page": start + offset + 1}))
+        return pages
+
+    async def _upload_structured(
+        self,
+        file: BinaryIO,
+        knowledge_base_id: str,
+        metadata: Dict[str, Any]
+    ) -> DocumentUploadResponse:
+        """
+        Stream a CSV/JSON/JSONL file into the vector store.
+        Rows or records are grouped into chunks by the extractor and flushed
+        in batches, so only one batch is held in memory at a time.
+        """
+        document_id = str(uuid.uuid4())
+        segments = extract_segments(
+            file, metadata["type"], self.structured_chunk_tokens, self.max_record_chars
         )
+        chunk_count = 0
+        centroid = await self._new_centroid(knowledge_base_id)
+
+        try:
+            while True:
+                # Parsing is CPU-bound; keep it off the event loop
+                with track_stage("ingestion", "extract"):
+                    batch = await asyncio.to_thread(
+                        lambda: list(itertools.islice(segments, self.ingest_batch_size))
+                    )
+                if not batch:
+                    break
+
+                chunks = []
+                chunk_metadatas = []
+                chunk_ids = []
+                for text, segment_meta in batch:
+                    chunk_meta = metadata.copy()
+                    chunk_meta.update(segment_meta)
+                    chunk_meta["chunk_index"] = chunk_count
+                    chunk_meta["document_id"] = document_id
+                    chunks.append(text)
+                    chunk_metadatas.append(chunk_meta)
+                    chunk_ids.append(f"{document_id}_chunk_{chunk_count}")
+                    chunk_count += 1
+
+                with track_stage("ingestion", "index"):
+                    await self.vectorstore.add_documents(
+                        documents=chunks,
+                        metadatas=chunk_metadatas,
+                        knowledge_base_id=knowledge_base_id,
+                        ids=chunk_ids,
+                        on_embeddings=centroid.add if centroid else None
+                    )
+
+            with track_stage("ingestion", "index"):
+                await self._index_document(knowledge_base_id, document_id, centroid, metadata)
+        except BaseException:
+            # Earlier batches are already in the knowledge base: do not leave
+            # a partial document (without its document vector) behind
+            if chunk_count:
+                await self._discard_document(document_id, knowledge_base_id)
+            raise
 
         return DocumentUploadResponse(
             document_id=document_id,
             knowledge_base_id=knowledge_base_id,
-            chunks_created=len(chunks),
+            chunks_created=chunk_count,
             status="success"
         )
 
@@ -66,31 +204,37 @@ class DocumentService:
         """Add text content directly"""
 
         # Chunk the content
-        chunks = self._chunk_text(content)
+        with track_stage("ingestion", "chunk"):
+            chunks = self._chunk_text(content)
 
         # Add metadata
         if metadata is None:
             metadata = {}
 
         metadata["type"] = "text"
+        document_id = str(uuid.uuid4())
 
         # Create metadata for each chunk
         chunk_metadatas = []
         for i, chunk in enumerate(chunks):
             chunk_meta = metadata.copy()
             chunk_meta["chunk_index"] = i
+            chunk_meta["document_id"] = document_id
             chunk_metadatas.append(chunk_meta)
 
         # Add to vector store
-        document_id = str(uuid.uuid4())
         chunk_ids = [f"{document_id}_chunk_{i}" for i in range(len(chunks))]
-
-        await self.vectorstore.add_documents(
-            documents=chunks,
-            metadatas=chunk_metadatas,
-            knowledge_base_id=knowledge_base_id,
-            ids=chunk_ids
-        )
+        centroid = await self._new_centroid(knowledge_base_id)
+
+        with track_stage("ingestion", "index"):
+            await self.vectorstore.add_documents(
+                documents=chunks,
+                metadatas=chunk_metadatas,
+                knowledge_base_id=knowledge_base_id,
+                ids=chunk_ids,
+                on_embeddings=centroid.add if centroid else None
+            )
+            await self._index_document(knowledge_base_id, document_id, centroid, metadata)
 
         return DocumentUploadResponse(
             document_id=document_id,
@@ -99,10 +243,38 @@ class DocumentService:
             status="success"
         )
 
+    async def _new_centroid(self, knowledge_base_id: str) -> Optional[Centroid]:
+        """Accumulator for the document's vector if the knowledge base has a document index"""
+        if await self.vectorstore.has_document_index(knowledge_base_id):
+            return Centroid()
+        return None
+
+    async def _index_document(
+        self,
+        knowledge_base_id: str,
+        document_id: str,
+        centroid: Optional[Centroid],
+        metadata: Dict[str, Any]
+    ):
+        """Store the document's vector (centroid of its chunks) with its document-level metadata"""
+        if centroid is None or not centroid.count:
+            return
+        await self.vectorstore.add_document_vector(
+            knowledge_base_id,
+            document_id,
+            centroid.vector(),
+            dict(metadata, document_id=document_id, chunks=centroid.count)
+        )
+
+    async def _discard_document(self, document_id: str, knowledge_base_id: str):
+        """Remove a partially written document, keeping the error that interrupted it"""
+        try:
+            await self.vectorstore.delete_document(document_id, knowledge_base_id)
+        except Exception as e:
+            print(f"Could not remove partial document {document_id}: {e}")
+
     async def delete_document(self, document_id: str, knowledge_base_id: str = "default"):
         """Delete a document and all its chunks"""
-        # Note: This is a simplified version
-        # In production, you'd want to query for all chunk IDs first
         await self.vectorstore.delete_document(document_id, knowledge_base_id)
 
     async def list_documents(
@@ -116,37 +288,12 @@ class DocumentService:
         count = await self.vectorstore.get_collection_count(knowledge_base_id)
         return [{"knowledge_base_id": knowledge_base_id, "document_count": count}]
 
-    async def _extract_text(self, file_content: bytes, filename: str) -> str:
-        """Extract text from various file formats"""
-        file_type = self._get_file_type(filename)
-
-        if file_type in ["txt", "md"]:
-            return file_content.decode("utf-8")
-
-        elif file_type == "pdf":
-            # Placeholder - integrate with PyPDF2 or similar
-            try:
-                import PyPDF2
-                pdf_file = io.BytesIO(file_content)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-                return text
-            except ImportError:
-                return "PDF processing not available. Install PyPDF2."
-
-        elif file_type == "json":
-            import json
-            data = json.loads(file_content.decode("utf-8"))
-            return json.dumps(data, indent=2)
-
-        elif file_type == "csv":
-            # Placeholder - integrate with pandas or csv module
-            return file_content.decode("utf-8")
-
-        else:
-            return file_content.decode("utf-8", errors="ignore")
+    def _extract_text(self, file_content: bytes, file_type: str) -> str:
+        """
+        Decode a plain text upload (PDF and CSV/JSON have their own extractors).
+        txt/md must be valid UTF-8; other types drop undecodable bytes.
+        """
+        return file_content.decode("utf-8", errors="strict" if file_type in ("txt", "md") else "ignore")
 
     def _chunk_text(
         self,
@@ -180,3 +327,13 @@ class DocumentService:
     def _get_file_type(self, filename: str) -> str:
         """Get file type from filename"""
         return filename.split(".")[-1].lower() if "." in filename else "unknown"
+
+
+def _spill_to_file(file_content: Union[bytes, BinaryIO]) -> str:
+    """Write an upload to a named temp file and return its path (the caller deletes it)"""
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        if isinstance(file_content, (bytes, bytearray)):
+            f.write(file_content)
+        else:
+            shutil.copyfileobj(file_content, f)
+    return f.name
@@ -0,0 +1,146 @@
+"""
+Shared embedding server (sidecar) for the API workers.
+
+One process loads the sentence-transformers model(s) and serves every
+uvicorn worker over a Unix socket. Models other than the default are
+loaded on first use and evicted least-recently-used first once
+EMBEDDING_MODELS_MAX or EMBEDDING_MODELS_MAX_MEMORY_MB is exceeded. Requests that arrive within a short
+window are merged into one model.encode call, so batching happens across
+workers instead of per worker, and memory does not grow with the number
+of workers.
+
+Usage (from api/src):
+    python -m services.embedding_server --socket /tmp/agentic-rag-embeddings.sock
+
+Then start the API with EMBEDDING_BACKEND=sidecar and the same
+EMBEDDING_SIDECAR_SOCKET.
+"""
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import os
+import time
+
+from services.embedding_service import EncoderRegistry, LocalEncoder, read_frame, write_frame
+
+
+class EmbeddingServer:
+    """Micro-batching encoder shared by every client connection"""
+
+    def __init__(self, default_model: str, max_batch: int = 256, max_wait_ms: float = 5.0):
+        self.default_model = default_model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.encoders = EncoderRegistry.from_env(LocalEncoder, pinned=(default_model,))
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests on one persistent client connection"""
+        try:
+            while True:
+                try:
+                    header, _ = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                future = asyncio.get_running_loop().create_future()
+                model = header.get("model") or self.default_model
+                await self.queue.put((model, header.get("texts", []), future))
+                self.stats["requests"] += 1
+
+                try:
+                    vectors = await future
+                except Exception as e:
+                    await write_frame(writer, {"error": str(e)})
+                    continue
+
+                payload = vectors.astype("<f4", copy=False).tobytes()
+                await write_frame(
+                    writer,
+                    {"rows": vectors.shape[0], "dim": vectors.shape[1], "dtype": "float32", "nbytes": len(payload)},
+                    payload
+                )
+        finally:
+            writer.close()
+
+    async def batcher(self):
+        """Collect queued requests for up to max_wait and encode them together"""
+        while True:
+            pending: List[Tuple[str, List[str], asyncio.Future]] = [await self.queue.get()]
+            size = len(pending[0][1])
+            deadline = time.monotonic() + self.max_wait
+
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[1])
+
+            by_model: Dict[str, List[Tuple[List[str], asyncio.Future]]] = {}
+            for model, texts, future in pending:
+                by_model.setdefault(model, []).append((texts, future))
+
+            for model, items in by_model.items():
+                await self._encode_group(model, items)
+
+    async def _encode_group(self, model: str, items: List[Tuple[List[str], asyncio.Future]]):
+        texts = [text for item_texts, _ in items for text in item_texts]
+        try:
+            encoder = await self.encoders.get(model)
+            vectors = await encoder.encode(texts)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["texts"] += len(texts)
+
+        offset = 0
+        for item_texts, future in items:
+            rows = vectors[offset:offset + len(item_texts)]
+            offset += len(item_texts)
+            if not future.done():
+                future.set_result(rows)
+
+
+async def serve(socket_path: str, model: str, max_batch: int, max_wait_ms: float):
+    server = EmbeddingServer(model, max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    # Load the default model before accepting connections
+    await server.encoders.get(model)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    unix_server = await asyncio.start_unix_server(server.handle, path=socket_path)
+    os.chmod(socket_path, 0o660)
+
+    batcher = asyncio.create_task(server.batcher())
+    print(f"Embedding server listening on {socket_path} (model: {model})")
+    try:
+        async with unix_server:
+            await unix_server.serve_forever()
+    finally:
+        batcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding server for the API workers")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SIDECAR_SOCKET", "/tmp/agentic-rag-embeddings.sock"))
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+    parser.add_argument("--max-batch", type=int, default=int(os.getenv("EMBEDDING_SIDECAR_MAX_BATCH", "256")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.getenv("EMBEDDING_SIDECAR_MAX_WAIT_MS", "5")))
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.socket, args.model, args.max_batch, args.max_wait_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+from collections import OrderedDict
+from typing import Callable, List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from core.singleflight import SingleFlight
+from monitoring.metrics import get_cache_stats
+
+# Text encoders used by the vector store.
+#
+# LocalEncoder runs sentence-transformers inside the API process.
+# SidecarEncoder sends texts to services/embedding_server.py over a Unix
+# socket, so N uvicorn workers share one copy of the model (and one torch
+# runtime) and their requests get batched together.
+#
+# Wire format, both directions: 4-byte big-endian header length, a JSON
+# header, then an optional binary payload whose size is given by the
+# header. Vectors travel as raw little-endian float32 rows.
+
+_LENGTH = struct.Struct(">I")
+
+
+async def write_frame(writer: asyncio.StreamWriter, header: Dict[str, Any], payload: bytes = b""):
+    data = json.dumps(header).encode("utf-8")
+    writer.write(_LENGTH.pack(len(data)) + data)
+    if payload:
+        writer.write(payload)
+    await writer.drain()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytearray]:
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    header = json.loads(await reader.readexactly(length))
+    nbytes = header.get("nbytes", 0)
+    # readexactly returns bytes; read straight into a bytearray instead so
+    # np.frombuffer gets a writable buffer without another copy
+    payload = bytearray(nbytes)
+    view = memoryview(payload)
+    received = 0
+    while received < nbytes:
+        chunk = await reader.read(min(nbytes - received, 1 << 20))
+        if not chunk:
+            raise asyncio.IncompleteReadError(bytes(view[:received]), nbytes)
+        view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+    return header, payload
+
+
+class LocalEncoder:
+    """sentence-transformers model loaded in this process"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        # torch releases the GIL, so encoding in a thread keeps the event
+        # loop serving other requests
+        return await asyncio.to_thread(self.encode_sync, texts)
+
+    def encode_sync(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts), dtype=np.float32)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Size of the model's weights and buffers"""
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    async def close(self):
+        pass
+
+
+class SidecarEncoder:
+    """Client for the shared embedding server, with a small connection pool"""
+
+    def __init__(self, model_name: str, socket_path: str, pool_size: int = 4, timeout: float = 60.0):
+        self.model_name = model_name
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(pool_size)
+        self._dimension: Optional[int] = None
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    @property
+    def memory_bytes(self) -> int:
+        # The model lives in the sidecar, which keeps its own LRU
+        return 0
+
+    async def wait_ready(self, timeout: float = 120.0):
+        """Retry until the sidecar answers (it may still be loading its model)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await self.encode(["warm-up"])
+                return
+            except (ConnectionError, FileNotFoundError, asyncio.IncompleteReadError):
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(1.0)
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self._dimension or 0), dtype=np.float32)
+
+        async with self._slots:
+            reader, writer = await self._checkout()
+            try:
+                await write_frame(writer, {"model": self.model_name, "texts": texts})
+                header, payload = await asyncio.wait_for(read_frame(reader), self.timeout)
+            except BaseException:
+                # The stream is in an unknown state; never reuse it
+                writer.close()
+                raise
+            self._idle.put_nowait((reader, writer))
+
+        if "error" in header:
+            raise RuntimeError(f"Embedding sidecar error: {header['error']}")
+
+        vectors = np.frombuffer(payload, dtype="<f4").reshape(header["rows"], header["dim"])
+        self._dimension = header["dim"]
+        return vectors
+
+    async def _checkout(self):
+        while not self._idle.empty():
+            reader, writer = self._idle.get_nowait()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+        return await asyncio.open_unix_connection(self.socket_path)
+
+    async def close(self):
+        while not self._idle.empty():
+            _, writer = self._idle.get_nowait()
+            writer.close()
+
+
+def create_encoder(model_name: str):
+    """Build the encoder selected by EMBEDDING_BACKEND (local or sidecar)"""
+    backend = os.getenv("EMBEDDING_BACKEND", "local").lower()
+    if backend == "sidecar":
+        return SidecarEncoder(
+            model_name,
+            socket_path=os.getenv("EMBEDDING_SIDECAR_SOCKET", "/tmp/agentic-rag-embeddings.sock"),
+            pool_size=int(os.getenv("EMBEDDING_SIDECAR_POOL_SIZE", "4")),
+            timeout=float(os.getenv("EMBEDDING_SIDECAR_TIMEOUT", "60"))
+        )
+    if backend != "local":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    return LocalEncoder(model_name)
+
+
+class UnknownEmbeddingModelError(ValueError):
+    """Raised for a model that is not in EMBEDDING_MODELS_ALLOWED"""
+
+
+class EncoderRegistry:
+    """
+    Encoders by model name, loaded on demand and kept in an LRU.
+
+    Loading is coalesced (concurrent requests for the same model share one
+    load) and runs in a thread. Once the resident models use more than
+    max_memory_bytes, or there are more than max_models of them, the least
+    recently used ones are closed, except pinned models and the one just
+    used. An evicted encoder still finishes the calls it is serving.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Any],
+        max_models: int = 4,
+        max_memory_bytes: int = 4 << 30,
+        pinned: Tuple[str, ...] = ()
+    ):
+        self.factory = factory
+        self.max_models = max_models
+        self.max_memory_bytes = max_memory_bytes
+        self.pinned = set(pinned)
+        self._encoders: "OrderedDict[str, Any]" = OrderedDict()
+        self._loads = SingleFlight(stats=get_cache_stats("embedding_models"))
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, factory: Callable[[str], Any], pinned: Tuple[str, ...] = ()) -> "EncoderRegistry":
+        return cls(
+            factory,
+            max_models=int(os.getenv("EMBEDDING_MODELS_MAX", "4")),
+            max_memory_bytes=int(float(os.getenv("EMBEDDING_MODELS_MAX_MEMORY_MB", "4096")) * (1 << 20)),
+            pinned=pinned
+        )
+
+    async def get(self, model_name: str):
+        """The encoder for model_name, loading it if it is not resident"""
+        encoder = self._encoders.get(model_name)
+        if encoder is not None:
+            self._encoders.move_to_end(model_name)
+            return encoder
+        return await self._loads.do(model_name, lambda: self._load(model_name))
+
+    async def _load(self, model_name: str):
+        encoder = await asyncio.to_thread(self.factory, model_name)
+        self._encoders[model_name] = encoder
+        await self._evict(keep=model_name)
+        return encoder
+
+    async def _evict(self, keep: str):
+        for name in list(self._encoders):
+            if len(self._encoders) <= self.max_models and self.memory_bytes() <= self.max_memory_bytes:
+                return
+            if name == keep or name in self.pinned:
+                continue
+            encoder = self._encoders.pop(name)
+            self.evictions += 1
+            print(f"Evicted embedding model {name} ({encoder.memory_bytes / (1 << 20):.0f} MB)")
+            await encoder.close()
+
+    def memory_bytes(self) -> int:
+        return sum(encoder.memory_bytes for encoder in self._encoders.values())
+
+    def status(self) -> Dict[str, Any]:
+        """Resident models (least recently used first) and their sizes"""
+        return {
+            "resident": [
+                {"model": name, "dimension": encoder.dimension, "memory_mb": round(encoder.memory_bytes / (1 << 20), 1)}
+                for name, encoder in self._encoders.items()
+            ],
+            "memory_mb": round(self.memory_bytes() / (1 << 20), 1),
+            "max_memory_mb": round(self.max_memory_bytes / (1 << 20), 1),
+            "max_models": self.max_models,
+            "evictions": self.evictions
+        }
+
+    async def close(self):
+        for encoder in self._encoders.values():
+            await encoder.close()
+        self._encoders.clear()
+
+
+def allowed_models(default_model: str) -> List[str]:
+    """Models knowledge bases may be created with (EMBEDDING_MODELS_ALLOWED plus the default)"""
+    names = [name.strip() for name in os.getenv("EMBEDDING_MODELS_ALLOWED", "").split(",") if name.strip()]
+    return [default_model] + [name for name in names if name != default_model]
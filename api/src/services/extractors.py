@@ -0,0 +1,289 @@
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import json
+
+# Format-aware extractors for structured uploads.
+#
+# Each extractor reads a binary file object incrementally and yields
+# (text, metadata) segments that are already chunk-sized: whole CSV rows or
+# JSON records are grouped until the token budget is reached, so a chunk
+# never cuts a row in half. Only the current group is held in memory, which
+# keeps ingestion of multi-GB exports flat.
+
+Segment = Tuple[str, Dict[str, Any]]
+
+STREAMING_TYPES = {"csv", "json", "jsonl", "ndjson"}
+
+_READ_SIZE = 1 << 16
+
+# Largest single JSON value (record) held in memory, in characters
+MAX_RECORD_CHARS = 16 << 20
+
+
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
+class RecordTooLargeError(ValueError):
+    """A single JSON record is larger than the per-record limit"""
+
+
+def extract_segments(
+    file: BinaryIO,
+    file_type: str,
+    max_tokens: int = 250,
+    max_record_chars: int = MAX_RECORD_CHARS
+) -> Iterator[Segment]:
+    """Dispatch to the streaming extractor for file_type"""
+    text_stream = io.TextIOWrapper(file, encoding="utf-8", errors="replace", newline="")
+    try:
+        if file_type == "csv":
+            yield from csv_segments(text_stream, max_tokens)
+        elif file_type in ("jsonl", "ndjson"):
+            yield from jsonl_segments(text_stream, max_tokens, max_record_chars)
+        elif file_type == "json":
+            yield from json_segments(text_stream, max_tokens, max_record_chars)
+        else:
+            raise ValueError(f"No streaming extractor for {file_type}")
+    finally:
+        # Leave the caller's file open
+        text_stream.detach()
+
+
+def csv_segments(stream: io.TextIOBase, max_tokens: int) -> Iterator[Segment]:
+    """Group CSV rows into chunks, repeating the header line in each chunk"""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    header_line = _csv_line(header)
+    # Same rough 1 token ≈ 4 characters rule used for Claude requests
+    budget = max_tokens * 4 - len(header_line)
+    lines: List[str] = []
+    size = 0
+    row_start = 1
+
+    for row_number, row in enumerate(reader, start=1):
+        if not row:
+            continue
+        line = _csv_line(row)
+        if lines and size + len(line) > budget:
+            yield header_line + "".join(lines), {"row_start": row_start, "row_end": row_number - 1}
+            lines, size, row_start = [], 0, row_number
+        lines.append(line)
+        size += len(line)
+
+    if lines:
+        yield header_line + "".join(lines), {"row_start": row_start, "row_end": row_number}
+
+
+def _csv_line(row: List[str]) -> str:
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow(row)
+    return out.getvalue()
+
+
+def jsonl_segments(
+    stream: io.TextIOBase,
+    max_tokens: int,
+    max_record_chars: int = MAX_RECORD_CHARS
+) -> Iterator[Segment]:
+    """Group JSON Lines records into chunks of compact JSON, one record per line"""
+    def records() -> Iterator[Any]:
+        while True:
+            line = stream.readline(max_record_chars + 1)
+            if not line:
+                return
+            if len(line) > max_record_chars:
+                raise RecordTooLargeError(f"JSON Lines record larger than {max_record_chars} characters")
+            if line.strip():
+                yield json.loads(line)
+
+    yield from _group_records(records(), max_tokens)
+
+
+def json_segments(
+    stream: io.TextIOBase,
+    max_tokens: int,
+    max_record_chars: int = MAX_RECORD_CHARS
+) -> Iterator[Segment]:
+    """
+    Group the records of a JSON document into chunks.
+    A top-level array is streamed element by element and a top-level object
+    member by member (array members are streamed element by element too);
+    any other value becomes a single record, up to max_record_chars.
+    """
+    yield from _group_records(_iter_json_records(_JsonScanner(stream, max_record_chars)), max_tokens)
+
+
+def _group_records(records: Iterator[Any], max_tokens: int) -> Iterator[Segment]:
+    budget = max_tokens * 4
+    lines: List[str] = []
+    size = 0
+    row_start = 1
+    row_number = 0
+
+    for row_number, record in enumerate(records, start=1):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        if lines and size + len(line) > budget:
+            yield "".join(lines).rstrip("\n"), {"row_start": row_start, "row_end": row_number - 1}
+            lines, size, row_start = [], 0, row_number
+        lines.append(line)
+        size += len(line)
+
+    if lines:
+        yield "".join(lines).rstrip("\n"), {"row_start": row_start, "row_end": row_number}
+
+
+class _JsonScanner:
+    """Incremental reader over a text stream for raw_decode-based parsing"""
+
+    def __init__(self, stream: io.TextIOBase, max_value_chars: int = MAX_RECORD_CHARS):
+        self.stream = stream
+        self.max_value_chars = max_value_chars
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self) -> str:
+        if self.eof:
+            return ""
+        data = self.stream.read(_READ_SIZE)
+        if not data:
+            self.eof = True
+        return data
+
+    def _fill(self, data: Optional[str] = None) -> bool:
+        data = self._read() if data is None else data
+        if not data:
+            return False
+        # Drop what was consumed so the buffer only holds the current value
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> Optional[str]:
+        """Next non-whitespace character, without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next JSON value, reading more input until it is complete"""
+        self.peek()
+        # An incomplete value is only decoded again once its buffered part
+        # has doubled, so a value spanning many reads costs O(size) rather
+        # than one full re-parse per read
+        tried = 0
+        # Reads not yet appended to the buffer (joined only before a decode)
+        pending: List[str] = []
+        pending_size = 0
+        while True:
+            size = len(self.buffer) - self.pos + pending_size
+            too_large = size > self.max_value_chars
+            if self.eof or too_large or size >= 2 * tried:
+                if pending:
+                    self._fill("".join(pending))
+                    pending, pending_size = [], 0
+                try:
+                    value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                    if self.eof or not self._may_continue(value, end):
+                        too_large = end - self.pos > self.max_value_chars
+                        if not too_large:
+                            self.pos = end
+                            return value
+                except json.JSONDecodeError:
+                    if self.eof:
+                        raise
+                tried = size
+            if too_large:
+                raise RecordTooLargeError(f"JSON record larger than {self.max_value_chars} characters")
+            data = self._read()
+            pending.append(data)
+            pending_size += len(data)
+
+    def _may_continue(self, value: Any, end: int) -> bool:
+        """A number cut by the end of a read (1, -2.5, 3e) may continue in the next one"""
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+        return end >= len(self.buffer) or self.buffer[end] in _NUMBER_CHARS
+
+
+def _iter_json_records(scanner: _JsonScanner) -> Iterator[Any]:
+    first = scanner.peek()
+    if first is None:
+        return
+
+    if first == "[":
+        yield from _iter_array(scanner)
+        return
+
+    if first == "{":
+        scanner.expect("{")
+        if scanner.peek() == "}":
+            return
+        while True:
+            key = scanner.value()
+            scanner.expect(":")
+            # Exports are often {"data": [...]}: stream nested arrays too
+            if scanner.peek() == "[":
+                yield from _iter_array(scanner)
+            else:
+                yield {key: scanner.value()}
+            if scanner.peek() == ",":
+                scanner.expect(",")
+                continue
+            scanner.expect("}")
+            return
+
+    yield scanner.value()
+
+
+def _iter_array(scanner: _JsonScanner) -> Iterator[Any]:
+    scanner.expect("[")
+    if scanner.peek() == "]":
+        scanner.expect("]")
+        return
+    while True:
+        yield scanner.value()
+        if scanner.peek() == ",":
+            scanner.expect(",")
+            continue
+        scanner.expect("]")
+        return
+
+
+# PDF helpers. They run inside ExtractionPool worker processes, so they take
+# and return plain picklable values. The document is passed as a file path:
+# every page-range task opens the same temp file instead of receiving its own
+# pickled copy of the bytes.
+
+def pdf_page_count(path: str) -> int:
+    import PyPDF2
+
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def pdf_extract_pages(path: str, start: int, end: int) -> List[str]:
+    """Text of pages [start, end) (0-based)"""
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def page_ranges(page_count: int, workers: int, min_pages: int = 4) -> List[Tuple[int, int]]:
+    """Split pages into about two ranges per worker (for load balancing)"""
+    size = max(min_pages, -(-page_count // (workers * 2)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
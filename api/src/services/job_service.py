@@ -0,0 +1,419 @@
+from typing import List, Dict, Any, Optional, Set
+from urllib.parse import urlsplit
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import time
+import uuid
+
+from services.agent_service import AgentService
+from models.schemas import AgentJobRequest
+from monitoring.metrics import track_stage
+
+# Asynchronous agent jobs.
+#
+# POST /api/agent/jobs only enqueues the task; a fixed number of worker
+# coroutines run AgentService.execute_task in the background, recording
+# each step as it happens, and the result can be polled or delivered to a
+# webhook. Job records live in this process or in Redis (AGENT_JOB_STORE),
+# so with Redis any API worker can answer status requests.
+#
+# Cancellation requests are stored apart from the record: the worker keeps
+# rewriting the record with each step, and a copy it read before a
+# DELETE /jobs/{id} would otherwise overwrite cancel_requested. Stores
+# report the flag as the record's "cancel_requested" and never save it.
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class JobCancelledError(Exception):
+    """Raised inside a running job once cancellation was requested"""
+
+
+class WebhookURLError(ValueError):
+    """Raised for a webhook URL the server is not allowed to call"""
+
+
+class WebhookPolicy:
+    """
+    Which webhook URLs jobs may POST to, so callers cannot make the server
+    reach internal services. Only http(s), only allowed_hosts when set
+    (exact names or "*.domain"), and unless allow_private, only hosts that
+    resolve to public addresses (no loopback, private, link-local, ...).
+    """
+
+    def __init__(self, allowed_hosts: Optional[List[str]] = None, allow_private: bool = False):
+        self.allowed_hosts = [h.lower() for h in allowed_hosts or []]
+        self.allow_private = allow_private
+
+    @classmethod
+    def from_env(cls) -> "WebhookPolicy":
+        hosts = os.getenv("AGENT_JOB_WEBHOOK_ALLOWED_HOSTS", "")
+        return cls(
+            allowed_hosts=[h.strip() for h in hosts.split(",") if h.strip()],
+            allow_private=os.getenv("AGENT_JOB_WEBHOOK_ALLOW_PRIVATE", "false").lower() == "true"
+        )
+
+    def check(self, url: str) -> str:
+        """Validate the URL itself; returns its host"""
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        try:
+            parts.port
+        except ValueError:
+            raise WebhookURLError("Webhook URL has an invalid port") from None
+        if parts.scheme not in ("http", "https") or not host:
+            raise WebhookURLError("Webhook URL must be an http(s) URL with a host")
+        if self.allowed_hosts and not any(
+            host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:]))
+            for allowed in self.allowed_hosts
+        ):
+            raise WebhookURLError(f"Webhook host {host} is not in AGENT_JOB_WEBHOOK_ALLOWED_HOSTS")
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            # A name: its addresses are checked when it is resolved
+            return host
+        self._check_address(address)
+        return host
+
+    async def resolve(self, url: str) -> Optional[str]:
+        """
+        Validate the URL and every address its host resolves to (right before
+        calling it). Returns the checked address the request must connect to,
+        or None when no lookup is involved (an IP literal, or allow_private).
+        """
+        host = self.check(url)
+        if self.allow_private:
+            return None
+        try:
+            ipaddress.ip_address(host)
+            return None
+        except ValueError:
+            pass
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise WebhookURLError(f"Webhook host {host} does not resolve: {e}") from None
+        addresses = [info[4][0].split("%")[0] for info in infos]
+        for address in addresses:
+            self._check_address(ipaddress.ip_address(address))
+        return addresses[0]
+
+    def _check_address(self, address):
+        if self.allow_private:
+            return
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise WebhookURLError(f"Webhook address {address} is not public")
+
+
+def _pinned_request(url: str, address: Optional[str]) -> Dict[str, Any]:
+    """
+    Request arguments that connect to the already checked address instead of
+    letting the HTTP client resolve the host again, which a DNS rebinding
+    answer could point at an internal service. The Host header and the TLS
+    server name (SNI and certificate check) still use the original host.
+    """
+    import httpx
+
+    if address is None:
+        return {"url": url}
+    original = httpx.URL(url)
+    return {
+        "url": original.copy_with(host=address),
+        "headers": {"Host": original.netloc.decode("ascii")},
+        "extensions": {"sni_hostname": original.host}
+    }
+
+
+class InMemoryJobStore:
+    """Job records held in this process; finished jobs expire after ttl seconds"""
+
+    def __init__(self, ttl: float = 86400):
+        self.ttl = ttl
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._cancel_requests: Set[str] = set()
+
+    async def save(self, job: Dict[str, Any]):
+        self._purge()
+        self._jobs[job["job_id"]] = _without_cancel_flag(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return dict(job, cancel_requested=job_id in self._cancel_requests)
+
+    async def request_cancel(self, job_id: str):
+        self._cancel_requests.add(job_id)
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        return job_id in self._cancel_requests
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._cancel_requests.discard(job_id)
+
+
+class RedisJobStore:
+    """Job records stored in Redis as JSON, shared by every API worker"""
+
+    def __init__(self, url: str, ttl: float = 86400, prefix: str = "agentic-rag:job:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    async def save(self, job: Dict[str, Any]):
+        await self.client.set(
+            self.prefix + job["job_id"],
+            json.dumps(_without_cancel_flag(job), default=str),
+            ex=self.ttl
+        )
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        data, cancel = await self.client.mget(self.prefix + job_id, self._cancel_key(job_id))
+        if not data:
+            return None
+        return dict(json.loads(data), cancel_requested=bool(cancel))
+
+    async def request_cancel(self, job_id: str):
+        await self.client.set(self._cancel_key(job_id), 1, ex=self.ttl)
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        return bool(await self.client.exists(self._cancel_key(job_id)))
+
+    def _cancel_key(self, job_id: str) -> str:
+        return self.prefix + job_id + ":cancel"
+
+
+def _without_cancel_flag(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in job.items() if k != "cancel_requested"}
+
+
+class JobService:
+    """Queue and bounded worker pool for background agent tasks"""
+
+    def __init__(
+        self,
+        agent: AgentService,
+        store=None,
+        max_workers: int = 4,
+        max_queue: int = 100,
+        webhook_timeout: float = 10.0,
+        webhook_retries: int = 3,
+        webhook_policy: Optional[WebhookPolicy] = None
+    ):
+        self.agent = agent
+        self.webhook_policy = webhook_policy or WebhookPolicy()
+        self.store = store or InMemoryJobStore()
+        self.max_workers = max_workers
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def from_env(cls, agent: AgentService) -> "JobService":
+        ttl = float(os.getenv("AGENT_JOB_TTL", "86400"))
+        if os.getenv("AGENT_JOB_STORE", "memory").lower() == "redis":
+            store = RedisJobStore(os.getenv("REDIS_URL", "redis://localhost:6379"), ttl=ttl)
+        else:
+            store = InMemoryJobStore(ttl=ttl)
+        return cls(
+            agent,
+            store=store,
+            max_workers=int(os.getenv("AGENT_JOB_WORKERS", "4")),
+            max_queue=int(os.getenv("AGENT_JOB_QUEUE_SIZE", "100")),
+            webhook_timeout=float(os.getenv("AGENT_JOB_WEBHOOK_TIMEOUT", "10")),
+            webhook_retries=int(os.getenv("AGENT_JOB_WEBHOOK_RETRIES", "3")),
+            webhook_policy=WebhookPolicy.from_env()
+        )
+
+    def _ensure_workers(self):
+        # Started on first use, inside the server's event loop
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def submit(self, request: AgentJobRequest) -> Dict[str, Any]:
+        """Queue a task and return its job record (WebhookURLError for a disallowed webhook_url)"""
+        if request.webhook_url:
+            self.webhook_policy.check(request.webhook_url)
+        if self._queue.full():
+            raise JobQueueFullError(f"Agent job queue is full ({self._queue.maxsize} jobs)")
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "cancel_requested": False,
+            "request": request.model_dump(),
+            "steps": [],
+            "result": None,
+            "error": None,
+            "webhook": None
+        }
+        await self.store.save(job)
+        self._queue.put_nowait(job["job_id"])
+        self._ensure_workers()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.store.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Request cancellation; returns the job record, or None if unknown"""
+        job = await self.store.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return job
+
+        await self.store.request_cancel(job_id)
+        job["cancel_requested"] = True
+        if job["status"] == "queued":
+            self._finish(job, "cancelled")
+            await self.store.save(job)
+
+        # Running here: stop it now. Running in another process: its next
+        # step sees cancel_requested and stops there.
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        return job
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def shutdown(self):
+        for task in list(self._running.values()) + self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Agent job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await self.store.get(job_id)
+        if job is None or job["status"] != "queued" or job["cancel_requested"]:
+            # Cancelled (or expired) while waiting in the queue
+            return
+
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        await self.store.save(job)
+
+        request = AgentJobRequest(**job["request"])
+
+        async def on_step(step: Dict[str, Any]):
+            # Also catches a cancel that raced with the job leaving the queue
+            if await self.store.cancel_requested(job_id):
+                raise JobCancelledError()
+            job["steps"].append(step)
+            await self.store.save(job)
+
+        task = asyncio.create_task(self.agent.execute_task(
+            task=request.task,
+            model=request.model,
+            max_iterations=request.max_iterations,
+            knowledge_base_id=request.knowledge_base_id,
+            tools=request.tools,
+            prefetch=request.prefetch,
+            on_step=on_step
+        ))
+        self._running[job_id] = task
+
+        try:
+            with track_stage("agent", "job"):
+                response = await task
+            job["result"] = response.model_dump()
+            self._finish(job, "succeeded")
+        except (asyncio.CancelledError, JobCancelledError):
+            if not task.cancelled() and not task.done():
+                task.cancel()
+            # A worker being shut down also lands here; only a requested
+            # cancellation counts as cancelled
+            job["cancel_requested"] = await self.store.cancel_requested(job_id)
+            if job["cancel_requested"]:
+                self._finish(job, "cancelled")
+            else:
+                job["error"] = "Server shut down while the job was running"
+                self._finish(job, "failed")
+                await self.store.save(job)
+                raise
+        except Exception as e:
+            job["error"] = str(e)
+            self._finish(job, "failed")
+        finally:
+            self._running.pop(job_id, None)
+
+        await self.store.save(job)
+
+        if request.webhook_url:
+            job["webhook"] = await self._deliver_webhook(request.webhook_url, job)
+            await self.store.save(job)
+
+    def _finish(self, job: Dict[str, Any], status: str):
+        job["status"] = status
+        job["finished_at"] = time.time()
+
+    async def _deliver_webhook(self, url: str, job: Dict[str, Any]) -> Dict[str, Any]:
+        """POST the final job state, retrying with backoff; returns the delivery outcome"""
+        import httpx
+
+        payload = {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "result": job["result"],
+            "error": job["error"]
+        }
+        last_error = None
+        # Redirects are not followed (httpx default), so they cannot lead elsewhere
+        async with httpx.AsyncClient(timeout=self.webhook_timeout) as client:
+            for attempt in range(self.webhook_retries + 1):
+                if attempt:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                try:
+                    # Resolved again per attempt: DNS may have changed since submit
+                    address = await self.webhook_policy.resolve(url)
+                except WebhookURLError as e:
+                    return {"delivered": False, "error": str(e), "attempts": attempt}
+                try:
+                    with track_stage("agent", "job_webhook"):
+                        response = await client.post(json=payload, **_pinned_request(url, address))
+                    if response.status_code < 400:
+                        return {"delivered": True, "status_code": response.status_code, "attempts": attempt + 1}
+                    last_error = f"HTTP {response.status_code}"
+                except httpx.HTTPError as e:
+                    last_error = str(e) or type(e).__name__
+
+        return {"delivered": False, "error": last_error, "attempts": self.webhook_retries + 1}
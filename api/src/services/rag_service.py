@@ -1,7 +1,15 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Union
+import asyncio
+import os
+import time
 from services.vectorstore_service import VectorStoreService
 from services.claude_service import ClaudeService
-from models.schemas import RAGQueryResponse, SearchResponse, SearchResult
+from models.schemas import RAGQueryRequest, RAGQueryResponse, SearchResponse, SearchResult
+from monitoring.metrics import track_stage, get_cache_stats
+from monitoring.tracing import annotate, tracing
+from core.singleflight import SingleFlight, make_key
+from core.rate_limit import Priority
+from core.admission import AdmissionRejectedError, RouteClassLimiter
 
 class RAGService:
     """Service for RAG (Retrieval-Augmented Generation) operations"""
@@ -10,6 +18,15 @@ class RAGService:
         self.vectorstore = vectorstore
         self.claude = claude
 
+        # Identical requests arriving while one is in flight share its
+        # retrieval and generation instead of each calling Claude
+        self.coalesce = os.getenv("RAG_COALESCE_REQUESTS", "true").lower() == "true"
+        self._query_flights = SingleFlight(get_cache_stats("rag_query_coalescing"))
+        self._search_flights = SingleFlight(get_cache_stats("rag_search_coalescing"))
+
+        # Claude generations in flight per bulk query request
+        self.batch_concurrency = int(os.getenv("RAG_BATCH_CONCURRENCY", "8"))
+
     async def query(
         self,
         query: str,
@@ -17,22 +34,79 @@ class RAGService:
         top_k: int = 5,
         model: str = "claude-3-5-sonnet-20241022",
         temperature: float = 0.7,
-        include_sources: bool = True
+        include_sources: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        mmr: Optional[Dict[str, Any]] = None
     ) -> RAGQueryResponse:
         """
         Query the RAG system.
         Retrieves relevant documents and generates an answer using Claude.
+        mmr, if given, holds mmr_lambda and fetch_k for diversified retrieval.
         """
+        # A traced request runs on its own: spans are recorded in the task
+        # that does the work, so a follower's trace would come back empty
+        if not self.coalesce or tracing():
+            return await self._query(
+                query, knowledge_base_id, top_k, model, temperature, include_sources, filter, priority, mmr
+            )
+
+        # Priority is part of the key so a request never waits on a leader
+        # queued at a lower priority in the Claude scheduler
+        key = make_key(knowledge_base_id, query, top_k, model, temperature, filter, mmr, int(priority))
+        shared = await self._query_flights.do(
+            key,
+            lambda: self._query(query, knowledge_base_id, top_k, model, temperature, True, filter, priority, mmr)
+        )
+
+        # Each caller gets its own copy: routers attach per-request fields
+        # (e.g. the debug trace) to the response object
+        return shared.model_copy(update={"sources": shared.sources if include_sources else None})
+
+    async def _query(
+        self,
+        query: str,
+        knowledge_base_id: str,
+        top_k: int,
+        model: str,
+        temperature: float,
+        include_sources: bool,
+        filter: Optional[Dict[str, Any]],
+        priority: Priority,
+        mmr: Optional[Dict[str, Any]] = None
+    ) -> RAGQueryResponse:
+        """Run retrieval and generation for one query"""
 
         # Retrieve relevant documents
-        search_results = await self.vectorstore.search(
-            query=query,
-            knowledge_base_id=knowledge_base_id,
-            top_k=top_k
+        with track_stage("rag", "retrieval"):
+            search_results = await self.vectorstore.search(
+                query=query,
+                knowledge_base_id=knowledge_base_id,
+                top_k=top_k,
+                filter=filter,
+                **self._mmr_kwargs(mmr)
+            )
+            annotate(knowledge_base_id=knowledge_base_id, results=len(search_results))
+
+        return await self._answer(
+            query, search_results, model, temperature, include_sources, priority
         )
 
+    async def _answer(
+        self,
+        query: str,
+        search_results: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        include_sources: bool,
+        priority: Priority
+    ) -> RAGQueryResponse:
+        """Generate an answer for a query from already retrieved results"""
+
         # Build context from retrieved documents
-        context = self._build_context(search_results)
+        with track_stage("rag", "build_context"):
+            context = self._build_context(search_results)
+            annotate(context_chars=len(context))
 
         # Build prompt
         system_prompt = """You are a helpful AI assistant that answers questions based on the provided context.
@@ -47,13 +121,15 @@ Question: {query}
 Please provide a comprehensive answer based on the context above."""
 
         # Generate response with Claude
-        claude_response = await self.claude.generate(
-            prompt=prompt,
-            system_prompt=system_prompt,
-            model=model,
-            temperature=temperature,
-            max_tokens=4096
-        )
+        with track_stage("rag", "generation"):
+            claude_response = await self.claude.generate(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=4096,
+                priority=priority
+            )
 
         # Prepare sources if requested
         sources = None
@@ -74,21 +150,118 @@ Please provide a comprehensive answer based on the context above."""
             model=claude_response["model"]
         )
 
+    async def query_batch(
+        self,
+        requests: List[RAGQueryRequest],
+        concurrency: Optional[int] = None,
+        limiter: Optional[RouteClassLimiter] = None,
+        tenant: str = "anonymous"
+    ) -> AsyncIterator[Tuple[int, Union[RAGQueryResponse, Exception]]]:
+        """
+        Answer many queries at once.
+        Retrieval for the whole batch runs as one batched embed/query pass,
+        then generations fan out to Claude with at most `concurrency` in
+        flight (at batch priority). With a limiter, every generation holds
+        its own slot for `tenant`, like a single query would. Yields
+        (index, response or exception) in completion order; a failing item
+        never fails the batch.
+        """
+        concurrency = concurrency or self.batch_concurrency
+
+        try:
+            with track_stage("rag", "batch_retrieval"):
+                retrieved = await self.vectorstore.search_batch([
+                    {
+                        "query": request.query,
+                        "knowledge_base_id": request.knowledge_base_id,
+                        "top_k": request.top_k,
+                        "filter": request.filter,
+                        "mmr": request.mmr,
+                        "mmr_lambda": request.mmr_lambda,
+                        "fetch_k": request.fetch_k
+                    }
+                    for request in requests
+                ])
+                annotate(queries=len(requests))
+        except Exception as e:
+            # Surface it per item: the response stream may already be open
+            retrieved = [e] * len(requests)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def answer(index: int, request: RAGQueryRequest):
+            results = retrieved[index]
+            if isinstance(results, Exception):
+                return index, results
+            async with semaphore:
+                if limiter is not None:
+                    try:
+                        await limiter.acquire(tenant)
+                    except AdmissionRejectedError as e:
+                        return index, e
+                start = time.monotonic()
+                try:
+                    response = await self._answer(
+                        request.query,
+                        results,
+                        request.model,
+                        request.temperature,
+                        request.include_sources,
+                        Priority.BATCH
+                    )
+                    return index, response
+                except Exception as e:
+                    return index, e
+                finally:
+                    if limiter is not None:
+                        limiter.release(time.monotonic() - start)
+
+        tasks = [asyncio.ensure_future(answer(i, r)) for i, r in enumerate(requests)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The client went away (or the consumer stopped early)
+            for task in tasks:
+                task.cancel()
+
     async def search(
         self,
         query: str,
         knowledge_base_id: str = "default",
         top_k: int = 5,
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        mmr: Optional[Dict[str, Any]] = None
     ) -> SearchResponse:
         """Search for documents without generation"""
+        if not self.coalesce or tracing():
+            return await self._search(query, knowledge_base_id, top_k, filter, mmr)
 
-        search_results = await self.vectorstore.search(
-            query=query,
-            knowledge_base_id=knowledge_base_id,
-            top_k=top_k,
-            filter=filter
+        key = make_key(knowledge_base_id, query, top_k, filter, mmr)
+        shared = await self._search_flights.do(
+            key,
+            lambda: self._search(query, knowledge_base_id, top_k, filter, mmr)
         )
+        return shared.model_copy()
+
+    async def _search(
+        self,
+        query: str,
+        knowledge_base_id: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+        mmr: Optional[Dict[str, Any]] = None
+    ) -> SearchResponse:
+        """Run one similarity search"""
+
+        with track_stage("rag", "search"):
+            search_results = await self.vectorstore.search(
+                query=query,
+                knowledge_base_id=knowledge_base_id,
+                top_k=top_k,
+                filter=filter,
+                **self._mmr_kwargs(mmr)
+            )
 
         results = [
             SearchResult(
@@ -105,6 +278,12 @@ Please provide a comprehensive answer based on the context above."""
             query=query
         )
 
+    def _mmr_kwargs(self, mmr: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Vector store search arguments for an optional MMR setting"""
+        if mmr is None:
+            return {}
+        return {"mmr": True, "mmr_lambda": mmr.get("mmr_lambda", 0.5), "fetch_k": mmr.get("fetch_k")}
+
     async def list_knowledge_bases(self) -> List[str]:
         """List all available knowledge bases"""
         return await self.vectorstore.list_collections()
@@ -0,0 +1,338 @@
+"""
+Export and import of whole knowledge bases, without re-embedding.
+
+A snapshot is a directory with:
+    manifest.json    knowledge base, embedding model and dimension, HNSW
+                     settings, record count and the files below
+    records.parquet  id, document and metadata (JSON) columns
+    embeddings.npy   float32 array of shape (count, dim), row i belongs to
+                     record i; np.load(..., mmap_mode="r") maps it in place
+
+Usage (from api/src, with the API stopped: Chroma's on-disk store is not
+safe to open from two processes):
+    python -m services.snapshot_service export --knowledge-base docs --output /backups/docs
+    python -m services.snapshot_service import --input /backups/docs [--knowledge-base docs-copy] [--replace]
+
+Running services use POST /api/admin/knowledge-bases/{id}/export and
+/api/admin/knowledge-bases/import instead.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tarfile
+import time
+
+import numpy as np
+
+from monitoring.metrics import track_stage
+from services.vectorstore_service import VectorStoreService
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+RECORDS = "records.parquet"
+EMBEDDINGS = "embeddings.npy"
+SNAPSHOT_FILES = (MANIFEST, RECORDS, EMBEDDINGS)
+
+
+class SnapshotError(ValueError):
+    """Raised for a snapshot that is malformed or does not fit the target"""
+
+
+class SnapshotService:
+    """Writes knowledge bases to snapshot directories and bulk-loads them back"""
+
+    def __init__(self, vectorstore: VectorStoreService, batch_size: int = 5000):
+        self.vectorstore = vectorstore
+        self.batch_size = batch_size
+
+    async def export(self, knowledge_base_id: str, directory: str) -> Dict[str, Any]:
+        """Write a knowledge base to a snapshot directory; returns the manifest"""
+        vectorstore = self.vectorstore
+        if knowledge_base_id not in await vectorstore.list_collections():
+            raise SnapshotError(f"Knowledge base {knowledge_base_id} not found")
+
+        os.makedirs(directory, exist_ok=True)
+        start = time.perf_counter()
+
+        # Writes are held off so the count, records and embeddings agree
+        with vectorstore.exclusive(knowledge_base_id, "exported"):
+            collection = await asyncio.to_thread(vectorstore.client.get_collection, name=knowledge_base_id)
+            metadata = dict(collection.metadata or {})
+            count = await asyncio.to_thread(collection.count)
+            embeddings: Optional[np.ndarray] = None
+            records = _RecordWriter(directory)
+            written = 0
+
+            try:
+                with track_stage("snapshot", "export"):
+                    async for batch in vectorstore.iter_records(
+                        collection, self.batch_size, ["embeddings", "documents", "metadatas"]
+                    ):
+                        vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+                        if embeddings is None:
+                            embeddings = np.lib.format.open_memmap(
+                                os.path.join(directory, EMBEDDINGS),
+                                mode="w+", dtype=np.float32, shape=(count, vectors.shape[1])
+                            )
+                        embeddings[written:written + len(vectors)] = vectors
+                        records.write(batch["ids"], batch["documents"], batch["metadatas"])
+                        written += len(vectors)
+            finally:
+                records.close()
+
+            if embeddings is None:
+                dimension = metadata.get("embedding_dim") or 0
+                np.save(os.path.join(directory, EMBEDDINGS), np.zeros((0, dimension), dtype=np.float32))
+            else:
+                embeddings.flush()
+                dimension = embeddings.shape[1]
+                del embeddings
+
+        if written != count:
+            raise SnapshotError(f"Expected {count} records but read {written}")
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "knowledge_base_id": knowledge_base_id,
+            "embedding_model": vectorstore.embedding_model_of(collection),
+            "embedding_dim": int(dimension),
+            "dtype": "float32",
+            "count": written,
+            "collection_metadata": metadata,
+            "records": RECORDS,
+            "embeddings": EMBEDDINGS,
+            "created_at": time.time(),
+            "export_seconds": round(time.perf_counter() - start, 3)
+        }
+        with open(os.path.join(directory, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    async def import_(
+        self,
+        directory: str,
+        knowledge_base_id: Optional[str] = None,
+        replace: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Bulk-load a snapshot directory (into knowledge_base_id, default: the
+        exported name). A new knowledge base is created with the snapshot's
+        model and HNSW settings; an existing one must use the same model and
+        dimension and receives the records as upserts, unless replace, which
+        loads them into a fresh collection that then takes its place.
+        """
+        vectorstore = self.vectorstore
+        manifest = read_manifest(directory)
+        knowledge_base_id = knowledge_base_id or manifest["knowledge_base_id"]
+        model, dimension = manifest["embedding_model"], manifest["embedding_dim"]
+
+        embeddings = np.load(os.path.join(directory, manifest["embeddings"]), mmap_mode="r")
+        if embeddings.dtype != np.float32 or embeddings.shape != (manifest["count"], dimension):
+            raise SnapshotError(
+                f"{manifest['embeddings']} is {embeddings.dtype}{embeddings.shape}, "
+                f"manifest says float32({manifest['count']}, {dimension})"
+            )
+        await self._check_model(model, dimension)
+
+        # Chroma rejects larger add() calls
+        batch_size = min(self.batch_size, getattr(vectorstore.client, "max_batch_size", self.batch_size))
+
+        start = time.perf_counter()
+        with vectorstore.exclusive(knowledge_base_id, "imported"):
+            exists = knowledge_base_id in await vectorstore.list_collections()
+            staging = not exists or replace
+            if not staging:
+                target = await asyncio.to_thread(vectorstore.client.get_collection, name=knowledge_base_id)
+                target_model = vectorstore.embedding_model_of(target)
+                target_dim = (target.metadata or {}).get("embedding_dim")
+                if target_model != model or (target_dim and target_dim != dimension):
+                    raise SnapshotError(
+                        f"Knowledge base {knowledge_base_id} uses {target_model} ({target_dim} dims), "
+                        f"the snapshot {model} ({dimension} dims); import into a new knowledge base or use replace"
+                    )
+            else:
+                metadata = dict(manifest.get("collection_metadata") or {})
+                metadata.update(
+                    description=f"Knowledge base: {knowledge_base_id}",
+                    embedding_model=model,
+                    embedding_dim=dimension
+                )
+                target = await vectorstore.new_staging_collection(knowledge_base_id, metadata)
+            # Upserts keep re-importing into an existing knowledge base idempotent
+            write = target.add if staging else target.upsert
+
+            imported = 0
+            try:
+                with track_stage("snapshot", "import"):
+                    for ids, documents, metadatas in iter_records(directory, manifest["records"], batch_size):
+                        vectors = embeddings[imported:imported + len(ids)]
+                        await asyncio.to_thread(
+                            write,
+                            ids=ids,
+                            embeddings=vectors.tolist(),
+                            documents=documents,
+                            metadatas=metadatas
+                        )
+                        imported += len(ids)
+                if imported != manifest["count"]:
+                    raise SnapshotError(f"Manifest lists {manifest['count']} records, found {imported}")
+            except BaseException:
+                if staging:
+                    await asyncio.to_thread(vectorstore.client.delete_collection, name=target.name)
+                raise
+
+            if staging:
+                await vectorstore.swap_collection(knowledge_base_id, target)
+            else:
+                vectorstore.bump_kb_version(knowledge_base_id)
+            if vectorstore.document_index_of(target):
+                # Document vectors are not part of the snapshot; derive them from the chunks
+                await vectorstore.refill_document_index(knowledge_base_id, target, batch_size)
+
+        return {
+            "knowledge_base_id": knowledge_base_id,
+            "embedding_model": model,
+            "embedding_dim": dimension,
+            "imported": imported,
+            "replaced": exists and replace,
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+
+    async def _check_model(self, model: str, dimension: int):
+        """The snapshot's model must be usable here, so its knowledge base can be queried"""
+        vectorstore = self.vectorstore
+        if model not in vectorstore.allowed_models:
+            raise SnapshotError(
+                f"Snapshot was embedded with {model}, which is not allowed here "
+                f"(EMBEDDING_MODELS_ALLOWED: {', '.join(vectorstore.allowed_models)})"
+            )
+        if vectorstore.encoders is None:
+            # Offline import (CLI): the model is not loaded
+            return
+        encoder = await vectorstore.encoders.get(model)
+        actual = encoder.dimension or (await encoder.encode(["dimension probe"])).shape[1]
+        if actual != dimension:
+            raise SnapshotError(f"{model} produces {actual}-dimensional embeddings here, the snapshot has {dimension}")
+
+
+class _RecordWriter:
+    """Appends record batches to records.parquet"""
+
+    def __init__(self, directory: str):
+        # Imported here like the other heavy dependencies, so importing the app stays cheap
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa, self.pq = pa, pq
+        self.path = os.path.join(directory, RECORDS)
+        self.schema = pa.schema([("id", pa.string()), ("document", pa.string()), ("metadata", pa.string())])
+        self._writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+
+    def write(self, ids: List[str], documents: List[Optional[str]], metadatas: List[Optional[Dict]]):
+        pa = self.pa
+        metadata_json = [json.dumps(m) if m is not None else None for m in metadatas]
+        self._writer.write_table(pa.table({
+            "id": pa.array(ids, pa.string()),
+            "document": pa.array(documents, pa.string()),
+            "metadata": pa.array(metadata_json, pa.string())
+        }, schema=self.schema))
+
+    def close(self):
+        # An empty knowledge base still gets a valid (empty) file
+        self._writer.close()
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"Cannot read {MANIFEST}: {e}")
+
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version: {manifest.get('format_version')}")
+    missing = [
+        key for key in ("knowledge_base_id", "embedding_model", "embedding_dim", "count", "records", "embeddings")
+        if key not in manifest
+    ]
+    if missing:
+        raise SnapshotError(f"{MANIFEST} is missing {', '.join(missing)}")
+    if manifest["records"] != RECORDS or manifest["embeddings"] != EMBEDDINGS:
+        raise SnapshotError("Unexpected file names in the manifest")
+    return manifest
+
+
+def iter_records(
+    directory: str,
+    filename: str,
+    batch_size: int
+) -> Iterator[Tuple[List[str], List[Optional[str]], List[Optional[Dict]]]]:
+    """(ids, documents, metadatas) batches in file order"""
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(os.path.join(directory, filename)).iter_batches(batch_size=batch_size):
+        columns = batch.to_pydict()
+        metadatas = [json.loads(value) if value is not None else None for value in columns["metadata"]]
+        yield columns["id"], columns["document"], metadatas
+
+
+def pack(directory: str, archive_path: str):
+    """Bundle a snapshot directory into an uncompressed tar (embeddings barely compress)"""
+    with tarfile.open(archive_path, "w") as tar:
+        for name in SNAPSHOT_FILES:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                tar.add(path, arcname=name)
+
+
+def unpack(fileobj, directory: str):
+    """Extract the snapshot files of a tar stream; any other member is ignored"""
+    os.makedirs(directory, exist_ok=True)
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            for member in tar:
+                # Only the known flat file names are written, so member paths
+                # can never escape the directory
+                if member.name not in SNAPSHOT_FILES or not member.isfile():
+                    continue
+                with tar.extractfile(member) as source, open(os.path.join(directory, member.name), "wb") as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+    except tarfile.TarError as e:
+        raise SnapshotError(f"Not a snapshot archive: {e}")
+
+
+async def _main(args):
+    vectorstore = VectorStoreService()
+    # Bulk copies need the vector store only, not the embedding models
+    await vectorstore.initialize(load_encoders=False)
+    service = SnapshotService(vectorstore, batch_size=args.batch_size)
+
+    if args.command == "export":
+        result = await service.export(args.knowledge_base, args.output)
+    else:
+        result = await service.import_(args.input, args.knowledge_base, replace=args.replace)
+    print(json.dumps(result, indent=2, default=str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import a knowledge base snapshot")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("SNAPSHOT_BATCH_SIZE", "5000")))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write a knowledge base to a snapshot directory")
+    export.add_argument("--knowledge-base", required=True)
+    export.add_argument("--output", required=True, help="Snapshot directory (created if missing)")
+
+    load = commands.add_parser("import", help="Bulk-load a snapshot directory")
+    load.add_argument("--input", required=True, help="Snapshot directory")
+    load.add_argument("--knowledge-base", help="Target knowledge base (default: the exported one)")
+    load.add_argument("--replace", action="store_true", help="Replace the knowledge base if it exists")
+
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,612 @@
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
 import uuid
+from monitoring.metrics import track_stage
+from monitoring.tracing import annotate
+from core.centroid import Centroid
+from core.mmr import mmr_select
+from core.ttl_cache import TTLCache
+from services.chroma_client import create_chroma_client, chroma_mode, SERVER, WriteBatcher
+from services.embedding_service import (
+    create_encoder, allowed_models, EncoderRegistry, SidecarEncoder, UnknownEmbeddingModelError
+)
+
+# Index settings a knowledge base can choose, and their Chroma metadata keys.
+# Chroma reads them when the collection is created (search_ef when the index
+# is loaded), so changing them means rebuilding the collection.
+HNSW_PARAMS = {
+    "space": "hnsw:space",
+    "M": "hnsw:M",
+    "construction_ef": "hnsw:construction_ef",
+    "search_ef": "hnsw:search_ef"
+}
+
+# Optional two-level index. A knowledge base created with a document index
+# ("document_index_top" in its metadata) has a companion collection
+# "<id>__documents" (see document_index_name) with one vector per document
+# (the centroid of its chunk embeddings, written at ingest). A search then first picks the nearest
+# documents there and queries only their chunks (where document_id $in ...),
+# so it touches a few documents' chunks instead of the whole chunk index.
+DOCUMENT_INDEX_SUFFIX = "__documents"
+
+# Chroma's limit on collection names
+MAX_COLLECTION_NAME = 63
+
+
+def document_index_name(knowledge_base_id: str) -> str:
+    """Name of a knowledge base's document index collection"""
+    name = knowledge_base_id + DOCUMENT_INDEX_SUFFIX
+    if len(name) <= MAX_COLLECTION_NAME:
+        return name
+    # Too long for Chroma: shorten like staging names, with a hash of the
+    # full id so two long ids sharing a prefix still get their own index
+    digest = hashlib.sha1(knowledge_base_id.encode("utf-8")).hexdigest()[:8]
+    return f"{knowledge_base_id[:40]}-{digest}{DOCUMENT_INDEX_SUFFIX}"
+
+
+# Collections filled by rebuild_collection and snapshot imports before they
+# take a knowledge base's place: "<id[:40]>-staging-<8 hex>"
+STAGING_PATTERN = re.compile(r"-staging-[0-9a-f]{8}$")
+
+
+class KnowledgeBaseBusyError(RuntimeError):
+    """Raised when writing to a knowledge base that is being rebuilt, exported or imported"""
+
+
+class EmbeddingModelMismatchError(RuntimeError):
+    """Raised when a model's output does not match its collection's dimension"""
+
+
+# chromadb and sentence_transformers pull in torch, onnxruntime and friends.
+# They are imported inside the loaders (and LocalEncoder) so importing this
+# module (and therefore the whole app) stays cheap; the cost is paid by the
+# background warm-up instead of by process start. With EMBEDDING_BACKEND=sidecar
+# the model is not loaded in this process at all.
+#
+# Each collection records the model it was embedded with ("embedding_model"
+# and "embedding_dim" in its metadata) and every ingest and search encodes
+# with that model. Collections created before this was recorded have no
+# such key and keep using EMBEDDING_MODEL.
+#
+# With CHROMA_MODE=server every Chroma call is a blocking HTTP request, so
+# they run on a thread pool sized like the HTTP connection pool, collection
+# handles are cached for CHROMA_COLLECTION_CACHE_TTL seconds instead of being
+# looked up per request, and small concurrent writes are merged
+# (services/chroma_client.py). Embedded mode keeps calling Chroma inline.
 
 class VectorStoreService:
     """Service for managing vector store operations with ChromaDB"""
 
     def __init__(self):
         self.client = None
-        self.embedding_model = None
+        self.encoders: Optional[EncoderRegistry] = None
+        self.persist_directory = os.getenv("CHROMA_PERSIST_DIR", "./data/chroma")
+        self.mode = chroma_mode()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.writes: Optional[WriteBatcher] = None
+        self._collections = TTLCache(max_entries=1024)
+        self.collection_cache_ttl = 0.0
+        if self.mode == SERVER:
+            self._executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("CHROMA_HTTP_POOL_SIZE", "32")),
+                thread_name_prefix="chroma"
+            )
+            self.writes = WriteBatcher(
+                self._call,
+                max_batch=int(os.getenv("CHROMA_WRITE_BATCH_SIZE", "500")),
+                max_wait_ms=float(os.getenv("CHROMA_WRITE_BATCH_WAIT_MS", "5"))
+            )
+            self.collection_cache_ttl = float(os.getenv("CHROMA_COLLECTION_CACHE_TTL", "30"))
+        self.embedding_model_name = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self.allowed_models = allowed_models(self.embedding_model_name)
+        self.embedding_dim: Optional[int] = None
+        self.document_index_top = int(os.getenv("DOCUMENT_INDEX_TOP_DOCUMENTS", "20"))
         self._initialized = False
+        self._init_lock = asyncio.Lock()
+        # MMR candidates fetched per requested result when fetch_k is not given
+        self.mmr_fetch_factor = int(os.getenv("MMR_FETCH_FACTOR", "4"))
+        # Bumped on every write to a knowledge base, so caches can key on it
+        self._kb_versions: Dict[str, int] = {}
+        # Index settings for knowledge bases created implicitly (CHROMA_HNSW_SPACE, ...)
+        self.default_index_params = {
+            name: os.getenv(f"CHROMA_HNSW_{name.upper()}")
+            for name in HNSW_PARAMS
+            if os.getenv(f"CHROMA_HNSW_{name.upper()}")
+        }
+        # Knowledge bases under a bulk operation -> what is being done to them
+        self._busy: Dict[str, str] = {}
+        self.warmup_status = {
+            "stage": "pending",
+            "completed_stages": [],
+            "collections_warmed": 0,
+            "collections_total": 0,
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "attempts": 0
+        }
 
-    async def initialize(self):
-        """Initialize the vector store and embedding model"""
-        if self._initialized:
-            return
+    async def initialize(self, load_encoders: bool = True):
+        """Initialize the vector store and embedding model (load_encoders=False: storage only, for bulk tools)"""
+        async with self._init_lock:
+            if self._initialized:
+                return
 
-        # Initialize ChromaDB client
-        self.client = chromadb.Client(Settings(
-            chroma_db_impl="duckdb+parquet",
-            persist_directory="./data/chroma"
-        ))
+            # A failed warm-up is retried from scratch (see main.warm_up_services)
+            self.warmup_status.update(
+                started_at=time.time(), finished_at=None, error=None,
+                completed_stages=[], collections_warmed=0, collections_total=0
+            )
+            self.warmup_status["attempts"] += 1
 
-        # Initialize embedding model
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            try:
+                # Blocking loaders run in a thread so liveness probes and
+                # other requests keep being served while we warm up
+                self._set_stage("loading_vector_store")
+                self.client = await asyncio.to_thread(self._load_client)
 
-        self._initialized = True
+                if load_encoders:
+                    self._set_stage("loading_embedding_model")
+                    self.encoders = EncoderRegistry.from_env(create_encoder, pinned=(self.embedding_model_name,))
+                    encoder = await self.encoders.get(self.embedding_model_name)
+                    if isinstance(encoder, SidecarEncoder):
+                        # The shared server may still be loading its model
+                        await encoder.wait_ready()
+
+                self._set_stage("warming_collections")
+                await asyncio.to_thread(self._warm_collections)
+                if load_encoders:
+                    # First inference allocates buffers and builds kernels
+                    await encoder.encode(["warm-up"])
+                    self.embedding_dim = encoder.dimension
+            except Exception as e:
+                self.warmup_status["stage"] = "failed"
+                self.warmup_status["error"] = str(e)
+                self.warmup_status["finished_at"] = time.time()
+                raise
+
+            self._initialized = True
+            self._set_stage("ready")
+            self.warmup_status["finished_at"] = time.time()
+
+    def _set_stage(self, stage: str):
+        """Record warm-up progress, marking the previous stage as completed"""
+        previous = self.warmup_status["stage"]
+        if previous not in ("pending", "failed"):
+            self.warmup_status["completed_stages"].append(previous)
+        self.warmup_status["stage"] = stage
+
+    def _load_client(self):
+        """Create the ChromaDB client (embedded or HTTP, see CHROMA_MODE)"""
+        return create_chroma_client(self.persist_directory)
+
+    async def _call(self, fn: Callable, **kwargs) -> Any:
+        """Run a Chroma call: inline when embedded, on the HTTP thread pool in server mode"""
+        if self._executor is None:
+            return fn(**kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, **kwargs))
+
+    def _warm_collections(self):
+        """Open every existing collection so its index is loaded"""
+        collections = self.client.list_collections()
+        self.warmup_status["collections_total"] = len(collections)
+
+        for col in collections:
+            self.client.get_collection(name=col.name).count()
+            self.warmup_status["collections_warmed"] += 1
 
     def is_ready(self) -> bool:
         """Check if the service is ready"""
         return self._initialized
 
-    def get_or_create_collection(self, knowledge_base_id: str):
+    def get_warmup_status(self) -> Dict[str, Any]:
+        """Get a snapshot of the warm-up progress"""
+        status = dict(self.warmup_status)
+        status["completed_stages"] = list(self.warmup_status["completed_stages"])
+        if status["started_at"] is not None:
+            end = status["finished_at"] or time.time()
+            status["elapsed_seconds"] = round(end - status["started_at"], 3)
+        if self.encoders is not None:
+            status["embedding_models"] = self.encoders.status()
+        status["chroma_mode"] = self.mode
+        if self.writes is not None:
+            status["write_batching"] = dict(self.writes.stats)
+        return status
+
+    def get_kb_version(self, knowledge_base_id: str) -> int:
+        """Version of a knowledge base's contents in this process"""
+        return self._kb_versions.get(knowledge_base_id, 0)
+
+    def bump_kb_version(self, knowledge_base_id: str):
+        self._kb_versions[knowledge_base_id] = self._kb_versions.get(knowledge_base_id, 0) + 1
+
+    async def get_or_create_collection(self, knowledge_base_id: str):
         """Get or create a collection for a knowledge base"""
         if not self._initialized:
             raise RuntimeError("VectorStore not initialized")
 
-        return self.client.get_or_create_collection(
-            name=knowledge_base_id,
-            metadata={"description": f"Knowledge base: {knowledge_base_id}"}
+        collection = self._collections.get(knowledge_base_id)
+        if collection is None:
+            collection = await self._open_collection(
+                knowledge_base_id,
+                lambda: self._collection_metadata(
+                    knowledge_base_id,
+                    self.default_index_params,
+                    self.embedding_model_name,
+                    self.embedding_dim
+                )
+            )
+            self._collections.put(knowledge_base_id, collection, self.collection_cache_ttl)
+        return collection
+
+    async def _open_collection(self, name: str, metadata: Callable[[], Dict[str, Any]]):
+        """
+        An existing collection as it is, or a new one created with metadata().
+        Chroma's get_or_create_collection replaces an existing collection's
+        metadata with the one given, which would drop the model, HNSW and
+        document index settings it was created with.
+        """
+        try:
+            return await self._call(self.client.get_collection, name=name)
+        except Exception:
+            # Missing (or just created by another replica: get_or_create then
+            # only overwrites it with the same defaults)
+            return await self._call(self.client.get_or_create_collection, name=name, metadata=metadata())
+
+    def forget_collection(self, knowledge_base_id: str):
+        """Drop a cached collection handle (it was replaced, or failed)"""
+        self._collections.pop(knowledge_base_id)
+        self._collections.pop((knowledge_base_id, "documents"))
+
+    def document_index_of(self, collection) -> Optional[int]:
+        """Documents searched per query if the collection has a document index, else None"""
+        return (collection.metadata or {}).get("document_index_top")
+
+    async def has_document_index(self, knowledge_base_id: str) -> bool:
+        return self.document_index_of(await self.get_or_create_collection(knowledge_base_id)) is not None
+
+    async def _document_collection(self, knowledge_base_id: str, collection):
+        """Companion collection with the document vectors of a knowledge base"""
+        key = (knowledge_base_id, "documents")
+        documents = self._collections.get(key)
+        if documents is None:
+            # Same distance function and model as the chunks it points to
+            inherited = (*HNSW_PARAMS.values(), "embedding_model", "embedding_dim")
+
+            def metadata() -> Dict[str, Any]:
+                values = {k: v for k, v in (collection.metadata or {}).items() if k in inherited}
+                values["description"] = f"Document vectors of knowledge base: {knowledge_base_id}"
+                return values
+
+            documents = await self._open_collection(document_index_name(knowledge_base_id), metadata)
+            self._collections.put(key, documents, self.collection_cache_ttl)
+        return documents
+
+    def _collection_metadata(
+        self,
+        knowledge_base_id: str,
+        index_params: Dict[str, Any],
+        embedding_model: str,
+        embedding_dim: Optional[int]
+    ) -> Dict[str, Any]:
+        metadata = {"description": f"Knowledge base: {knowledge_base_id}", "embedding_model": embedding_model}
+        if embedding_dim:
+            metadata["embedding_dim"] = int(embedding_dim)
+        for name, value in index_params.items():
+            if value is not None:
+                metadata[HNSW_PARAMS[name]] = value if name == "space" else int(value)
+        return metadata
+
+    async def create_collection(
+        self,
+        knowledge_base_id: str,
+        index_params: Dict[str, Any],
+        embedding_model: Optional[str] = None,
+        document_index: bool = False,
+        top_documents: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Create a knowledge base with explicit HNSW settings and embedding model,
+        optionally with a document index searching top_documents documents per query.
+        ValueError if it exists, UnknownEmbeddingModelError if the model is not allowed.
+        """
+        if not self._initialized:
+            raise RuntimeError("VectorStore not initialized")
+        embedding_model = embedding_model or self.embedding_model_name
+        if embedding_model not in self.allowed_models:
+            raise UnknownEmbeddingModelError(
+                f"Embedding model {embedding_model} is not allowed (allowed: {', '.join(self.allowed_models)})"
+            )
+        if knowledge_base_id in await self.list_collections():
+            raise ValueError(f"Knowledge base {knowledge_base_id} already exists")
+
+        # Loads the model now, so a bad name fails here and not on first upload
+        with track_stage("vectorstore", "load_embedding_model"):
+            encoder = await self.encoders.get(embedding_model)
+        dimension = encoder.dimension or (await encoder.encode(["dimension probe"])).shape[1]
+
+        params = dict(self.default_index_params)
+        params.update({k: v for k, v in index_params.items() if v is not None})
+        metadata = self._collection_metadata(knowledge_base_id, params, embedding_model, dimension)
+        if document_index:
+            metadata["document_index_top"] = int(top_documents or self.document_index_top)
+        await self._call(self.client.create_collection, name=knowledge_base_id, metadata=metadata)
+        return await self.get_index_info(knowledge_base_id)
+
+    async def get_index_info(self, knowledge_base_id: str) -> Dict[str, Any]:
+        """HNSW settings and size of an existing knowledge base"""
+        if not self._initialized:
+            raise RuntimeError("VectorStore not initialized")
+
+        collection = await self._call(self.client.get_collection, name=knowledge_base_id)
+        metadata = collection.metadata or {}
+        document_index = None
+        if self.document_index_of(collection):
+            documents = await self._document_collection(knowledge_base_id, collection)
+            document_index = {
+                "top_documents": self.document_index_of(collection),
+                "documents": await self._call(documents.count)
+            }
+        return {
+            "knowledge_base_id": knowledge_base_id,
+            "index": {name: metadata.get(key) for name, key in HNSW_PARAMS.items()},
+            "embedding_model": self.embedding_model_of(collection),
+            "embedding_dim": metadata.get("embedding_dim"),
+            "count": await self._call(collection.count),
+            "document_index": document_index
+        }
+
+    def embedding_model_of(self, collection) -> str:
+        """Model a collection was embedded with"""
+        return (collection.metadata or {}).get("embedding_model", self.embedding_model_name)
+
+    def _check_dimension(self, collection, dimension: int):
+        expected = (collection.metadata or {}).get("embedding_dim")
+        if expected and dimension != expected:
+            raise EmbeddingModelMismatchError(
+                f"{self.embedding_model_of(collection)} produced {dimension}-dimensional embeddings, "
+                f"but {collection.name} holds {expected}-dimensional ones"
+            )
+
+    async def _encode(self, collection, texts: List[str]):
+        """Encode texts with the model the collection was built with"""
+        encoder = await self.encoders.get(self.embedding_model_of(collection))
+        vectors = await encoder.encode(texts)
+        self._check_dimension(collection, vectors.shape[1])
+        return vectors
+
+    @contextmanager
+    def exclusive(self, knowledge_base_id: str, activity: str):
+        """Reject writes to a knowledge base (and other bulk operations) while the block runs"""
+        if knowledge_base_id in self._busy:
+            raise KnowledgeBaseBusyError(
+                f"Knowledge base {knowledge_base_id} is already being {self._busy[knowledge_base_id]}"
+            )
+        self._busy[knowledge_base_id] = activity
+        try:
+            yield
+        finally:
+            self._busy.pop(knowledge_base_id, None)
+
+    def _check_writable(self, knowledge_base_id: str):
+        if knowledge_base_id in self._busy:
+            raise KnowledgeBaseBusyError(
+                f"Knowledge base {knowledge_base_id} is being {self._busy[knowledge_base_id]}; retry later"
+            )
+
+    async def iter_records(
+        self,
+        collection,
+        batch_size: int,
+        include: List[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Page through every record of a collection (reads run in a thread)"""
+        offset = 0
+        while True:
+            batch = await asyncio.to_thread(collection.get, limit=batch_size, offset=offset, include=include)
+            if not batch["ids"]:
+                return
+            yield batch
+            offset += len(batch["ids"])
+
+    async def new_staging_collection(self, knowledge_base_id: str, metadata: Dict[str, Any]):
+        """Empty collection to fill before swap_collection puts it in place"""
+        return await self._call(
+            self.client.create_collection,
+            name=f"{knowledge_base_id[:40]}-staging-{uuid.uuid4().hex[:8]}",
+            metadata=metadata
         )
 
+    async def swap_collection(self, knowledge_base_id: str, staging):
+        """Replace a knowledge base's collection (if any) with a filled staging collection"""
+        # Chroma has no atomic rename-over, so drop the old one first
+        if knowledge_base_id in await self._collection_names():
+            await self._call(self.client.delete_collection, name=knowledge_base_id)
+        await self._call(staging.modify, name=knowledge_base_id)
+        # Its document vectors described the old collection
+        await self._drop_document_index(knowledge_base_id)
+        self.bump_kb_version(knowledge_base_id)
+
+    async def rebuild_collection(
+        self,
+        knowledge_base_id: str,
+        index_params: Dict[str, Any],
+        batch_size: int = 1000
+    ) -> Dict[str, Any]:
+        """
+        Rebuild a knowledge base with new HNSW settings.
+        Copies every record (with its stored embedding) into a new collection
+        built with the new settings, then swaps it in under the same name.
+        Writes to the knowledge base are rejected while the copy runs.
+        """
+        if not self._initialized:
+            raise RuntimeError("VectorStore not initialized")
+
+        with self.exclusive(knowledge_base_id, "rebuilt"):
+            source = await self._call(self.client.get_collection, name=knowledge_base_id)
+            metadata = dict(source.metadata or {})
+            for name, value in index_params.items():
+                if value is not None:
+                    metadata[HNSW_PARAMS[name]] = value if name == "space" else int(value)
+
+            target = await self.new_staging_collection(knowledge_base_id, metadata)
+            copied = 0
+            try:
+                with track_stage("vectorstore", "rebuild_copy"):
+                    async for batch in self.iter_records(source, batch_size, ["embeddings", "documents", "metadatas"]):
+                        await asyncio.to_thread(
+                            target.add,
+                            ids=batch["ids"],
+                            embeddings=batch["embeddings"],
+                            documents=batch["documents"],
+                            metadatas=batch["metadatas"]
+                        )
+                        copied += len(batch["ids"])
+            except BaseException:
+                await self._call(self.client.delete_collection, name=target.name)
+                raise
+
+            await self.swap_collection(knowledge_base_id, target)
+            if self.document_index_of(target):
+                await self.refill_document_index(knowledge_base_id, target, batch_size)
+
+        info = await self.get_index_info(knowledge_base_id)
+        info["copied"] = copied
+        return info
+
+    async def build_document_index(self, knowledge_base_id: str, batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Recompute a knowledge base's document vectors from its stored chunk
+        embeddings (e.g. after an import, or a rebuild with another space).
+        Each document keeps the metadata all its chunks share. Chunks with
+        no document_id (ingested before it was recorded) are skipped.
+        Writes to the knowledge base are rejected while it runs.
+        """
+        if not self._initialized:
+            raise RuntimeError("VectorStore not initialized")
+
+        with self.exclusive(knowledge_base_id, "indexed"):
+            collection = await self._call(self.client.get_collection, name=knowledge_base_id)
+            if not self.document_index_of(collection):
+                raise ValueError(f"Knowledge base {knowledge_base_id} was not created with a document index")
+            skipped = await self.refill_document_index(knowledge_base_id, collection, batch_size)
+            self.bump_kb_version(knowledge_base_id)
+
+        info = await self.get_index_info(knowledge_base_id)
+        info["document_index"]["skipped_chunks"] = skipped
+        return info
+
+    async def refill_document_index(self, knowledge_base_id: str, collection, batch_size: int = 1000) -> int:
+        """
+        Replace the document vectors with ones computed from the collection's
+        chunks; the caller holds exclusive(). Returns the chunks skipped.
+        """
+        centroids: Dict[str, Centroid] = {}
+        shared: Dict[str, Dict[str, Any]] = {}
+        skipped = 0
+        with track_stage("vectorstore", "document_index_build"):
+            async for batch in self.iter_records(collection, batch_size, ["embeddings", "metadatas"]):
+                for embedding, metadata in zip(batch["embeddings"], batch["metadatas"]):
+                    document_id = (metadata or {}).get("document_id")
+                    if not document_id:
+                        skipped += 1
+                        continue
+                    if document_id not in centroids:
+                        centroids[document_id] = Centroid()
+                        shared[document_id] = dict(metadata)
+                    else:
+                        common = shared[document_id]
+                        for key in [k for k, v in common.items() if metadata.get(k) != v]:
+                            del common[key]
+                    centroids[document_id].add(embedding)
+
+            await self._drop_document_index(knowledge_base_id)
+            documents = await self._document_collection(knowledge_base_id, collection)
+            document_ids = list(centroids)
+            for offset in range(0, len(document_ids), batch_size):
+                ids = document_ids[offset:offset + batch_size]
+                await asyncio.to_thread(
+                    documents.add,
+                    ids=ids,
+                    embeddings=[centroids[i].vector() for i in ids],
+                    metadatas=[dict(shared[i], chunks=centroids[i].count) for i in ids]
+                )
+        return skipped
+
+    async def _drop_document_index(self, knowledge_base_id: str):
+        name = document_index_name(knowledge_base_id)
+        if name in await self._collection_names():
+            await self._call(self.client.delete_collection, name=name)
+        self.forget_collection(knowledge_base_id)
+
+    async def add_document_vector(
+        self,
+        knowledge_base_id: str,
+        document_id: str,
+        vector: List[float],
+        metadata: Dict[str, Any]
+    ):
+        """Store (or replace) a document's vector in the knowledge base's document index"""
+        self._check_writable(knowledge_base_id)
+        collection = await self.get_or_create_collection(knowledge_base_id)
+        documents = await self._document_collection(knowledge_base_id, collection)
+        with track_stage("vectorstore", "document_index_add"):
+            await self._call(documents.upsert, ids=[document_id], embeddings=[vector], metadatas=[metadata])
+
     async def add_documents(
         self,
         documents: List[str],
         metadatas: List[Dict[str, Any]],
         knowledge_base_id: str = "default",
-        ids: Optional[List[str]] = None
+        ids: Optional[List[str]] = None,
+        on_embeddings: Optional[Callable[[Any], None]] = None
     ) -> List[str]:
-        """Add documents to the vector store"""
+        """
+        Add documents to the vector store.
+        on_embeddings, if given, is called with their embeddings once stored.
+        """
         if not documents:
             return []
 
-        collection = self.get_or_create_collection(knowledge_base_id)
+        self._check_writable(knowledge_base_id)
+
+        collection = await self.get_or_create_collection(knowledge_base_id)
 
         # Generate IDs if not provided
         if ids is None:
             ids = [str(uuid.uuid4()) for _ in documents]
 
         # Generate embeddings
-        embeddings = self.embedding_model.encode(documents).tolist()
+        with track_stage("vectorstore", "encode_documents"):
+            vectors = await self._encode(collection, documents)
+            embeddings = vectors.tolist()
 
         # Add to collection
-        collection.add(
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
+        with track_stage("vectorstore", "collection_add"):
+            try:
+                if self.writes is not None:
+                    await self.writes.add(collection, ids, embeddings, documents, metadatas)
+                else:
+                    collection.add(
+                        embeddings=embeddings,
+                        documents=documents,
+                        metadatas=metadatas,
+                        ids=ids
+                    )
+            except Exception:
+                self.forget_collection(knowledge_base_id)
+                raise
+        self.bump_kb_version(knowledge_base_id)
+        if on_embeddings is not None:
+            on_embeddings(vectors)
 
         return ids
 
@@ -77,45 +615,267 @@ class VectorStoreService:
         query: str,
         knowledge_base_id: str = "default",
         top_k: int = 5,
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        mmr: bool = False,
+        mmr_lambda: float = 0.5,
+        fetch_k: Optional[int] = None,
+        two_stage: Optional[bool] = None
     ) -> List[Dict[str, Any]]:
-        """Search for similar documents"""
-        collection = self.get_or_create_collection(knowledge_base_id)
+        """
+        Search for similar documents.
+        With mmr, fetch_k candidates (default 4 * top_k) are fetched with
+        their embeddings and a diverse top_k is picked from them.
+        Knowledge bases with a document index are searched in two stages
+        unless two_stage is False.
+        """
+        collection = await self.get_or_create_collection(knowledge_base_id)
 
         # Generate query embedding
-        query_embedding = self.embedding_model.encode([query]).tolist()[0]
+        with track_stage("vectorstore", "encode"):
+            query_embedding = (await self._encode(collection, [query])).tolist()[0]
+
+        where = filter
+        top_documents = self.document_index_of(collection)
+        if top_documents and two_stage is not False:
+            (where,) = await self._scope_to_documents(
+                knowledge_base_id, collection, [query_embedding], filter, top_documents
+            )
 
         # Search
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            where=filter
-        )
+        with track_stage("vectorstore", "collection_query"):
+            try:
+                results = await self._call(
+                    collection.query,
+                    query_embeddings=[query_embedding],
+                    n_results=self._fetch_k(top_k, mmr, fetch_k),
+                    where=where,
+                    include=self._include(mmr)
+                )
+            except Exception:
+                # Possibly replaced by another replica: look it up again next time
+                self.forget_collection(knowledge_base_id)
+                raise
 
         # Format results
+        if mmr:
+            return self._select_mmr(results, 0, query_embedding, top_k, mmr_lambda)
+        return self._format_results(results, 0)
+
+    async def search_batch(self, queries: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Search many queries in one pass.
+        Each item has query, knowledge_base_id, top_k and filter (and
+        optionally mmr, mmr_lambda, fetch_k and two_stage). The query texts
+        are embedded with one encode call per embedding model and each
+        (knowledge base, filter) group is answered by a single
+        collection.query (one per query when it is searched in two stages).
+        Returns, per item and in order, its results or the exception that
+        hit its group.
+        """
+        if not queries:
+            return []
+        if not self._initialized:
+            raise RuntimeError("VectorStore not initialized")
+
+        collections: Dict[str, Any] = {}
+        by_model: Dict[str, List[int]] = {}
+        for index, q in enumerate(queries):
+            knowledge_base_id = q.get("knowledge_base_id", "default")
+            if knowledge_base_id not in collections:
+                collections[knowledge_base_id] = await self.get_or_create_collection(knowledge_base_id)
+            by_model.setdefault(self.embedding_model_of(collections[knowledge_base_id]), []).append(index)
+
+        embeddings: List[Any] = [None] * len(queries)
+        with track_stage("vectorstore", "encode_batch"):
+            for model, indices in by_model.items():
+                encoder = await self.encoders.get(model)
+                vectors = (await encoder.encode([queries[i]["query"] for i in indices])).tolist()
+                for index, vector in zip(indices, vectors):
+                    embeddings[index] = vector
+
+        groups: Dict[tuple, List[int]] = {}
+        for index, q in enumerate(queries):
+            key = (
+                q.get("knowledge_base_id", "default"),
+                json.dumps(q.get("filter"), sort_keys=True),
+                q.get("two_stage") is not False
+            )
+            groups.setdefault(key, []).append(index)
+
+        output: List[Any] = [None] * len(queries)
+        for (knowledge_base_id, _, two_stage), indices in groups.items():
+            try:
+                collection = collections[knowledge_base_id]
+                self._check_dimension(collection, len(embeddings[indices[0]]))
+                n_results = max(
+                    self._fetch_k(queries[i].get("top_k", 5), queries[i].get("mmr", False), queries[i].get("fetch_k"))
+                    for i in indices
+                )
+                include = self._include(any(queries[i].get("mmr", False) for i in indices))
+                filter = queries[indices[0]].get("filter")
+                group_embeddings = [embeddings[i] for i in indices]
+
+                wheres = [filter] * len(indices)
+                top_documents = self.document_index_of(collection)
+                if top_documents and two_stage:
+                    wheres = await self._scope_to_documents(
+                        knowledge_base_id, collection, group_embeddings, filter, top_documents
+                    )
+
+                with track_stage("vectorstore", "collection_query_batch"):
+                    if all(where is filter for where in wheres):
+                        results = await self._call(
+                            collection.query,
+                            query_embeddings=group_embeddings,
+                            n_results=n_results,
+                            where=filter,
+                            include=include
+                        )
+                        rows = [(results, row) for row in range(len(indices))]
+                    else:
+                        # Each query is restricted to its own documents
+                        per_query = await asyncio.gather(*(
+                            self._call(
+                                collection.query,
+                                query_embeddings=[embedding],
+                                n_results=n_results,
+                                where=where,
+                                include=include
+                            )
+                            for embedding, where in zip(group_embeddings, wheres)
+                        ))
+                        rows = [(results, 0) for results in per_query]
+                for (results, row), index in zip(rows, indices):
+                    q = queries[index]
+                    top_k = q.get("top_k", 5)
+                    if q.get("mmr", False):
+                        fetch_k = self._fetch_k(top_k, True, q.get("fetch_k"))
+                        output[index] = self._select_mmr(
+                            results, row, embeddings[index], top_k, q.get("mmr_lambda", 0.5), fetch_k
+                        )
+                    else:
+                        output[index] = self._format_results(results, row)[:top_k]
+            except Exception as e:
+                self.forget_collection(knowledge_base_id)
+                for index in indices:
+                    output[index] = e
+
+        return output
+
+    async def _scope_to_documents(
+        self,
+        knowledge_base_id: str,
+        collection,
+        query_embeddings: List[List[float]],
+        filter: Optional[Dict[str, Any]],
+        top_documents: int
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Per query, the where clause limiting its chunk search to its
+        top_documents nearest documents (filter applies at both levels).
+        Falls back to filter alone when the document level finds nothing,
+        e.g. an empty document index or a filter on chunk-only keys.
+        """
+        with track_stage("vectorstore", "document_query"):
+            try:
+                documents = await self._document_collection(knowledge_base_id, collection)
+                results = await self._call(
+                    documents.query,
+                    query_embeddings=query_embeddings,
+                    n_results=top_documents,
+                    where=filter,
+                    include=[]
+                )
+            except Exception as e:
+                # The chunk index alone still gives the right answer, only slower
+                self.forget_collection(knowledge_base_id)
+                annotate(document_index_error=str(e))
+                return [filter] * len(query_embeddings)
+            annotate(documents=sum(len(ids) for ids in results["ids"]))
+
+        wheres = []
+        for ids in results["ids"]:
+            if not ids:
+                wheres.append(filter)
+                continue
+            scope = {"document_id": {"$in": list(ids)}}
+            wheres.append({"$and": [filter, scope]} if filter else scope)
+        return wheres
+
+    def _fetch_k(self, top_k: int, mmr: bool, fetch_k: Optional[int]) -> int:
+        """Number of candidates to fetch from the collection"""
+        if not mmr:
+            return top_k
+        return max(top_k, fetch_k or top_k * self.mmr_fetch_factor)
+
+    def _include(self, with_embeddings: bool) -> List[str]:
+        include = ["documents", "metadatas", "distances"]
+        if with_embeddings:
+            include.append("embeddings")
+        return include
+
+    def _select_mmr(
+        self,
+        results: Dict[str, Any],
+        row: int,
+        query_embedding: List[float],
+        top_k: int,
+        mmr_lambda: float,
+        fetch_k: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Pick a diverse top_k from one row of candidates fetched with embeddings"""
+        candidates = self._format_results(results, row)
+        row_embeddings = results["embeddings"][row] if results.get("embeddings") is not None else []
+        if fetch_k is not None:
+            candidates = candidates[:fetch_k]
+            row_embeddings = row_embeddings[:fetch_k]
+        if len(candidates) == 0:
+            return []
+
+        with track_stage("vectorstore", "mmr"):
+            selected = mmr_select(query_embedding, row_embeddings, top_k, mmr_lambda)
+            annotate(candidates=len(candidates), selected=len(selected))
+        return [candidates[i] for i in selected]
+
+    def _format_results(self, results: Dict[str, Any], row: int) -> List[Dict[str, Any]]:
+        """Format one query's row of a Chroma query result"""
         formatted_results = []
-        if results['documents'] and len(results['documents']) > 0:
-            for i in range(len(results['documents'][0])):
+        if results['documents'] and len(results['documents']) > row:
+            for i in range(len(results['documents'][row])):
                 formatted_results.append({
-                    'content': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                    'score': 1 - results['distances'][0][i] if results['distances'] else 0,
-                    'id': results['ids'][0][i] if results['ids'] else None
+                    'content': results['documents'][row][i],
+                    'metadata': results['metadatas'][row][i] if results['metadatas'] else {},
+                    'score': 1 - results['distances'][row][i] if results['distances'] else 0,
+                    'id': results['ids'][row][i] if results['ids'] else None
                 })
 
         return formatted_results
 
     async def delete_document(self, document_id: str, knowledge_base_id: str = "default"):
         """Delete a document from the vector store"""
-        collection = self.get_or_create_collection(knowledge_base_id)
-        collection.delete(ids=[document_id])
+        self._check_writable(knowledge_base_id)
+        collection = await self.get_or_create_collection(knowledge_base_id)
+        await self._call(collection.delete, ids=[document_id])
+        # Chunks carry their document_id (older ones do not and are only
+        # matched by the id above)
+        await self._call(collection.delete, where={"document_id": document_id})
+        if self.document_index_of(collection):
+            documents = await self._document_collection(knowledge_base_id, collection)
+            await self._call(documents.delete, ids=[document_id])
+        self.bump_kb_version(knowledge_base_id)
 
     async def list_collections(self) -> List[str]:
-        """List all knowledge bases (collections)"""
-        collections = self.client.list_collections()
-        return [col.name for col in collections]
+        """List all knowledge bases (collections), without document indexes and staging copies"""
+        return [
+            name for name in await self._collection_names()
+            if not name.endswith(DOCUMENT_INDEX_SUFFIX) and not STAGING_PATTERN.search(name)
+        ]
+
+    async def _collection_names(self) -> List[str]:
+        """Names of every Chroma collection"""
+        return [col.name for col in await self._call(self.client.list_collections)]
 
     async def get_collection_count(self, knowledge_base_id: str = "default") -> int:
         """Get the number of documents in a collection"""
-        collection = self.get_or_create_collection(knowledge_base_id)
-        return collection.count()
+        collection = await self.get_or_create_collection(knowledge_base_id)
+        return await self._call(collection.count)
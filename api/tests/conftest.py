@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# The API imports its packages from src/ (core, services, monitoring), and the
+# MMR test compares against the reference kept with the benchmarks
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(API_DIR, "src"))
+sys.path.insert(0, os.path.join(API_DIR, "benchmarks"))
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Embedded-mode vector store over the in-memory fake Chroma client"""
+    from fake_chroma import FakeClient, FakeEncoder
+    from services.embedding_service import EncoderRegistry
+    from services.vectorstore_service import VectorStoreService
+
+    monkeypatch.delenv("CHROMA_MODE", raising=False)
+    service = VectorStoreService()
+    service.client = FakeClient()
+    service.embedding_model_name = "small"
+    service.allowed_models = ["small", "big-model"]
+    service.embedding_dim = 4
+    service.encoders = EncoderRegistry(FakeEncoder, pinned=("small",))
+    service._initialized = True
+    return service
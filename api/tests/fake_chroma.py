@@ -0,0 +1,172 @@
+"""
+In-memory stand-in for the parts of the chromadb client API the services use.
+
+It follows chromadb 0.4.x semantics where they matter to the tests:
+collection names are limited to 63 characters, get_collection raises
+ValueError for an unknown name, and get_or_create_collection with metadata
+replaces an existing collection's metadata.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+MAX_NAME_LENGTH = 63
+
+# Words the fake encoder knows, one dimension each
+VOCABULARY = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+
+def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            [(operator, value)] = condition.items()
+            if operator == "$in" and metadata.get(key) not in value:
+                return False
+            if operator == "$eq" and metadata.get(key) != value:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, client: "FakeClient", name: str, metadata: Optional[Dict[str, Any]]):
+        self.client = client
+        self.name = name
+        self.metadata = metadata
+        self.rows: Dict[str, tuple] = {}
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        duplicates = set(ids) & set(self.rows)
+        if duplicates:
+            raise ValueError(f"IDs already exist: {sorted(duplicates)}")
+        self.upsert(ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        for id_, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.rows[id_] = (np.asarray(embedding, dtype=np.float32), document, metadata or {})
+
+    def get(self, ids=None, where=None, limit=None, offset=0, include=("documents", "metadatas")):
+        selected = [
+            (id_, row) for id_, row in self.rows.items()
+            if (ids is None or id_ in ids) and _matches(row[2], where)
+        ]
+        selected = selected[offset:None if limit is None else offset + limit]
+        result = {"ids": [id_ for id_, _ in selected]}
+        if "embeddings" in include:
+            result["embeddings"] = [row[0].tolist() for _, row in selected]
+        if "documents" in include:
+            result["documents"] = [row[1] for _, row in selected]
+        if "metadatas" in include:
+            result["metadatas"] = [row[2] for _, row in selected]
+        return result
+
+    def delete(self, ids=None, where=None):
+        for id_ in [i for i, row in self.rows.items() if (ids is None or i in ids) and _matches(row[2], where)]:
+            del self.rows[id_]
+
+    def query(self, query_embeddings, n_results, where=None, include=("documents", "metadatas", "distances")):
+        space = (self.metadata or {}).get("hnsw:space", "l2")
+        candidates = [(id_, row) for id_, row in self.rows.items() if _matches(row[2], where)]
+        result = {key: [] for key in ["ids", "documents", "metadatas", "distances", "embeddings"]}
+        for query in query_embeddings:
+            query = np.asarray(query, dtype=np.float32)
+            scored = sorted(
+                ((self._distance(space, query, row[0]), id_, row) for id_, row in candidates),
+                key=lambda item: (item[0], item[1])
+            )[:n_results]
+            result["ids"].append([id_ for _, id_, _ in scored])
+            result["documents"].append([row[1] for _, _, row in scored])
+            result["metadatas"].append([row[2] for _, _, row in scored])
+            result["distances"].append([distance for distance, _, _ in scored])
+            result["embeddings"].append([row[0].tolist() for _, _, row in scored])
+        for key in ["documents", "metadatas", "distances", "embeddings"]:
+            if key not in include:
+                result[key] = None
+        return result
+
+    @staticmethod
+    def _distance(space: str, a: np.ndarray, b: np.ndarray) -> float:
+        if space == "cosine":
+            return float(1 - a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+        if space == "ip":
+            return float(1 - a @ b)
+        return float(((a - b) ** 2).sum())
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+        if name is not None:
+            self.client._check_name(name)
+            self.client.collections[name] = self.client.collections.pop(self.name)
+            self.name = name
+        if metadata is not None:
+            self.metadata = metadata
+
+
+class FakeClient:
+    max_batch_size = 1000
+
+    def __init__(self):
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def _check_name(self, name: str):
+        if not 3 <= len(name) <= MAX_NAME_LENGTH:
+            raise ValueError(f"Expected collection name to be 3-{MAX_NAME_LENGTH} characters: {name}")
+        if name in self.collections:
+            raise ValueError(f"Collection {name} already exists")
+
+    def create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> FakeCollection:
+        self._check_name(name)
+        self.collections[name] = FakeCollection(self, name, dict(metadata) if metadata else None)
+        return self.collections[name]
+
+    def get_collection(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collections[name]
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> FakeCollection:
+        if name not in self.collections:
+            return self.create_collection(name, metadata)
+        collection = self.collections[name]
+        if metadata is not None and metadata != collection.metadata:
+            # chromadb 0.4.x updates the collection with the metadata given
+            collection.metadata = dict(metadata)
+        return collection
+
+    def delete_collection(self, name: str):
+        self.get_collection(name)
+        del self.collections[name]
+
+    def list_collections(self) -> List[FakeCollection]:
+        return list(self.collections.values())
+
+
+class FakeEncoder:
+    """Counts of VOCABULARY words; models named "*big*" have 8 dimensions, others 4"""
+
+    memory_bytes = 0
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.dimension = 8 if "big" in model_name else 4
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.full((len(texts), self.dimension), 1e-3, dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                if word in VOCABULARY[:self.dimension]:
+                    vectors[row, VOCABULARY.index(word)] += 1.0
+        return vectors
+
+    async def close(self):
+        pass
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from core.admission import AdmissionRejectedError, RouteClassLimiter
+
+
+def make_limiter(**overrides) -> RouteClassLimiter:
+    options = dict(max_in_flight=1, max_queue=10, max_queue_per_tenant=10, queue_timeout=5.0)
+    options.update(overrides)
+    return RouteClassLimiter("test", **options)
+
+
+async def settle():
+    """Let woken waiters run up to their next await"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def dispatch_order(limiter: RouteClassLimiter, tenants):
+    """Queue one request per tenant entry behind a held slot; return the order they are admitted in"""
+    order = []
+
+    async def request(tenant: str):
+        await limiter.acquire(tenant)
+        order.append(tenant)
+
+    await limiter.acquire("holder")
+    tasks = []
+    for tenant in tenants:
+        tasks.append(asyncio.ensure_future(request(tenant)))
+        await settle()
+    assert limiter.queued == len(tenants)
+
+    for _ in tenants:
+        limiter.release(0.0)
+        await settle()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_newcomer_is_not_stuck_behind_a_backlog():
+    order = asyncio.run(dispatch_order(make_limiter(), ["a", "a", "a", "b"]))
+    assert order == ["a", "b", "a", "a"]
+
+
+def test_weights_split_slots_proportionally():
+    limiter = make_limiter(weights={"a": 2.0})
+    order = asyncio.run(dispatch_order(limiter, ["a", "a", "a", "a", "b", "b"]))
+    assert order == ["a", "a", "b", "a", "a", "b"]
+
+
+def test_free_slot_is_taken_without_queueing():
+    async def scenario():
+        limiter = make_limiter(max_in_flight=2)
+        await limiter.acquire("a")
+        await limiter.acquire("b")
+        assert limiter.in_flight == 2
+        assert limiter.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_rejects_and_forgets_the_request():
+    async def scenario():
+        limiter = make_limiter(queue_timeout=0.01)
+        await limiter.acquire("holder")
+        with pytest.raises(AdmissionRejectedError) as info:
+            await limiter.acquire("a")
+        assert info.value.status_code == 503
+        assert info.value.retry_after >= 1
+        assert limiter.status()["queued"] == 0
+        assert limiter.status()["tenants_queued"] == 0
+
+        # The abandoned ticket is skipped: the slot goes back to idle
+        limiter.release(0.0)
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire("holder")
+        waiter = asyncio.ensure_future(limiter.acquire("a"))
+        await settle()
+        waiter.cancel()
+        await settle()
+        assert waiter.cancelled()
+        assert limiter.queued == 0
+
+        limiter.release(0.0)
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queues_reject_immediately():
+    async def scenario():
+        limiter = make_limiter(max_queue=2, max_queue_per_tenant=1)
+        await limiter.acquire("holder")
+        waiters = [asyncio.ensure_future(limiter.acquire("a"))]
+        await settle()
+
+        with pytest.raises(AdmissionRejectedError) as info:
+            await limiter.acquire("a")
+        assert info.value.status_code == 429
+
+        waiters.append(asyncio.ensure_future(limiter.acquire("b")))
+        await settle()
+        with pytest.raises(AdmissionRejectedError) as info:
+            await limiter.acquire("c")
+        assert info.value.status_code == 503
+
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_disabled_limiter_admits_everything():
+    async def scenario():
+        limiter = make_limiter(max_in_flight=0, max_queue=0)
+        for _ in range(5):
+            await limiter.acquire("a")
+        assert limiter.queued == 0
+
+    asyncio.run(scenario())
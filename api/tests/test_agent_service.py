@@ -0,0 +1,284 @@
+import asyncio
+import types
+
+import pytest
+
+from core import ttl_cache
+from services.agent_service import AgentService, _ToolDispatcher
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.searches = []
+        self.versions = {}
+
+    def get_kb_version(self, knowledge_base_id):
+        return self.versions.get(knowledge_base_id, 0)
+
+    async def search(self, query, knowledge_base_id, top_k, **kwargs):
+        self.searches.append((query, knowledge_base_id, top_k))
+        return [{"content": f"{query} in {knowledge_base_id}", "score": 0.9, "metadata": {}}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake clock for the tool cache TTLs"""
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(ttl_cache, "time", types.SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def agent(clock):
+    return AgentService(FakeVectorStore(), claude=None)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def search(agent, task_id=None, answered_calls=None, tool_use_id=None, **parameters):
+    parameters = {"query": "q", **parameters}
+    return run(agent._execute_tool(
+        "search_knowledge_base", parameters, "kb",
+        answered_calls=answered_calls, tool_use_id=tool_use_id, task_id=task_id
+    ))
+
+
+def test_search_results_are_shared_across_tasks(agent):
+    first = search(agent, task_id="task-1")
+    # Omitted parameters and their defaults share an entry
+    second = search(agent, task_id="task-2", top_k=5, mmr=False)
+    assert first == second
+    assert len(agent.vectorstore.searches) == 1
+
+    search(agent, top_k=3)
+    assert len(agent.vectorstore.searches) == 2
+
+
+def test_a_write_to_the_knowledge_base_invalidates_searches(agent):
+    search(agent)
+    agent.vectorstore.versions["kb"] = 1
+    search(agent)
+    assert len(agent.vectorstore.searches) == 2
+
+    # Other knowledge bases are keyed separately
+    search(agent, knowledge_base_id="other")
+    assert agent.vectorstore.searches[-1][1] == "other"
+
+
+def test_search_entries_expire_after_their_ttl(agent, clock):
+    search(agent)
+    clock.value += agent.cache_policies["search_knowledge_base"]["ttl"] - 1
+    search(agent)
+    assert len(agent.vectorstore.searches) == 1
+
+    clock.value += 2
+    search(agent)
+    assert len(agent.vectorstore.searches) == 2
+
+
+def test_repeat_within_a_task_gets_a_reference(agent):
+    answered = {}
+    search(agent, answered_calls=answered, tool_use_id="t1")
+    repeat = search(agent, answered_calls=answered, tool_use_id="t2")
+    assert repeat["same_as_tool_use_id"] == "t1"
+
+
+def test_errors_are_not_cached(agent):
+    async def failing(*args, **kwargs):
+        return {"error": "vector store down"}
+
+    agent._run_tool = failing
+    assert "error" in search(agent)
+    assert len(agent.tool_cache) == 0
+
+
+def repl(agent, task_id, code="result = 6 * 7", answered_calls=None, tool_use_id=None):
+    return run(agent._execute_tool(
+        "python_repl", {"code": code}, None,
+        answered_calls=answered_calls, tool_use_id=tool_use_id, task_id=task_id
+    ))
+
+
+def test_python_repl_is_not_cached_by_default(agent):
+    answered = {}
+    assert repl(agent, "task-1", answered_calls=answered, tool_use_id="t1") == {"output": "42"}
+    # Not even referenced within the task: the code runs again
+    assert repl(agent, "task-1", answered_calls=answered, tool_use_id="t2") == {"output": "42"}
+    assert len(agent.tool_cache) == 0
+    assert answered == {}
+
+
+def test_enabled_python_repl_cache_is_scoped_to_the_task(monkeypatch, clock):
+    monkeypatch.setenv("AGENT_TOOL_CACHE_TTL_PYTHON_REPL", "60")
+    agent = AgentService(FakeVectorStore(), claude=None)
+    runs = []
+    run_tool = agent._run_tool
+
+    async def counting(tool_name, parameters, knowledge_base_id=None):
+        runs.append(tool_name)
+        return await run_tool(tool_name, parameters, knowledge_base_id)
+
+    agent._run_tool = counting
+
+    repl(agent, "task-1")
+    repl(agent, "task-1")
+    assert len(runs) == 1
+
+    # Another task (or tenant) never gets task-1's output
+    repl(agent, "task-2")
+    assert len(runs) == 2
+
+    # Outside a task (direct tool invocation) nothing is cached
+    run(agent.invoke_tool("python_repl", {"code": "result = 1"}))
+    run(agent.invoke_tool("python_repl", {"code": "result = 1"}))
+    assert len(runs) == 4
+
+    clock.value += 61
+    repl(agent, "task-1")
+    assert len(runs) == 5
+
+
+def tool_use(id_, query):
+    return {"id": id_, "name": "search_knowledge_base", "input": {"query": query}}
+
+
+@pytest.fixture
+def gated(agent):
+    """Tool runs that wait until their query is released; log records start/finish"""
+    gates = {}
+    log = []
+
+    async def run_tool(tool_name, parameters, knowledge_base_id=None):
+        query = parameters["query"]
+        log.append(("start", query))
+        await gates.setdefault(query, asyncio.Event()).wait()
+        log.append(("finish", query))
+        return {"results": [query]}
+
+    agent._run_tool = run_tool
+    return types.SimpleNamespace(agent=agent, gates=gates, log=log)
+
+
+def test_dispatcher_runs_calls_concurrently_and_returns_them_in_order(gated):
+    async def scenario():
+        dispatcher = _ToolDispatcher(gated.agent, "kb", {}, task_id="task-1")
+        calls = [tool_use("t1", "slow"), tool_use("t2", "fast")]
+        for call in calls:
+            dispatcher.start(call)
+        await asyncio.sleep(0)
+        assert gated.log == [("start", "slow"), ("start", "fast")]
+
+        gated.gates["fast"].set()
+        await asyncio.sleep(0)
+        gated.gates["slow"].set()
+        results = [await dispatcher.result(call) for call in calls]
+        assert results == [{"results": ["slow"]}, {"results": ["fast"]}]
+        assert gated.log[2:] == [("finish", "fast"), ("finish", "slow")]
+
+    run(scenario())
+
+
+def test_dispatcher_answers_a_repeated_call_with_a_reference(gated):
+    async def scenario():
+        dispatcher = _ToolDispatcher(gated.agent, "kb", {}, task_id="task-1")
+        first, repeat = tool_use("t1", "q"), tool_use("t2", "q")
+        dispatcher.start(first)
+        dispatcher.start(repeat)
+        # Starting a call again does not run it twice
+        dispatcher.start(repeat)
+        await asyncio.sleep(0)
+        assert gated.log == [("start", "q")]
+
+        gated.gates["q"].set()
+        assert await dispatcher.result(first) == {"results": ["q"]}
+        assert (await dispatcher.result(repeat))["same_as_tool_use_id"] == "t1"
+        assert gated.log == [("start", "q"), ("finish", "q")]
+
+    run(scenario())
+
+
+def test_dispatcher_cancel_stops_running_calls(gated):
+    async def scenario():
+        dispatcher = _ToolDispatcher(gated.agent, "kb", {}, task_id="task-1")
+        call = tool_use("t1", "never")
+        dispatcher.start(call)
+        await asyncio.sleep(0)
+        dispatcher.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await dispatcher.result(call)
+        assert ("finish", "never") not in gated.log
+
+    run(scenario())
+
+
+class ScriptedClaude:
+    """Answers each turn from a script, reporting tool calls as a stream would"""
+
+    def __init__(self, *turns):
+        self.turns = list(turns)
+        self.requests = []
+
+    async def generate_with_tools(self, messages, tools, on_tool_use=None, **kwargs):
+        self.requests.append([dict(message) for message in messages])
+        tool_uses = self.turns.pop(0)
+        for call in tool_uses:
+            if on_tool_use is not None:
+                on_tool_use(call)
+        return {
+            "text": "" if tool_uses else "final answer",
+            "tool_uses": tool_uses,
+            "stop_reason": "tool_use" if tool_uses else "end_turn",
+            "usage": {"input_tokens": 1, "output_tokens": 1}
+        }
+
+
+class ScoredVectorStore(FakeVectorStore):
+    def __init__(self, scores):
+        super().__init__()
+        self.scores = scores
+
+    async def search(self, query, knowledge_base_id, top_k, **kwargs):
+        self.searches.append((query, knowledge_base_id, top_k))
+        return [
+            {"content": f"hit {i}", "score": score, "metadata": {"source": f"doc{i}.pdf"}}
+            for i, score in enumerate(self.scores[:top_k])
+        ]
+
+
+def prefetching_agent(clock, scores, *turns):
+    agent = AgentService(ScoredVectorStore(scores), claude=ScriptedClaude(*turns))
+    agent.prefetch_min_score, agent.prefetch_score_budget = 0.5, 1.5
+    return agent
+
+
+def test_prefetch_gives_the_first_turn_the_relevant_hits(clock):
+    # The agent searches for the task anyway: answered by the prefetch
+    search_call = {"id": "t1", "name": "search_knowledge_base", "input": {"query": "the task", "top_k": 5}}
+    agent = prefetching_agent(clock, [0.9, 0.7, 0.6, 0.3], [search_call], [])
+    response = run(agent.execute_task("the task", knowledge_base_id="kb", prefetch=True))
+
+    prefetch = response.steps[0]
+    assert (prefetch["iteration"], prefetch["prefetch"]) == (0, {"used": True, "hits": 2})
+    first_turn = agent.claude.requests[0][0]["content"]
+    # 0.9 + 0.7 reach the score budget; 0.3 would be below min_score anyway
+    assert "[1] (Source: doc0.pdf)\nhit 0" in first_turn and "hit 1" in first_turn
+    assert "hit 2" not in first_turn
+    assert len(agent.vectorstore.searches) == 1
+    assert response.result == "final answer"
+
+
+def test_prefetch_without_relevant_hits_leaves_the_task_alone(clock):
+    agent = prefetching_agent(clock, [0.3, 0.1], [])
+    response = run(agent.execute_task("the task", knowledge_base_id="kb", prefetch=True))
+    assert response.steps[0]["prefetch"] == {"used": False, "hits": 0}
+    assert agent.claude.requests[0][0]["content"] == "the task"
+
+
+def test_prefetch_needs_a_knowledge_base_and_the_search_tool(clock):
+    agent = prefetching_agent(clock, [0.9], [], [])
+    run(agent.execute_task("the task", prefetch=True))
+    run(agent.execute_task("the task", knowledge_base_id="kb", tools=["python_repl"], prefetch=True))
+    assert agent.vectorstore.searches == []
+    assert all(requests[0]["content"] == "the task" for requests in agent.claude.requests)
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from fake_chroma import FakeClient, FakeEncoder
+from services.chroma_client import WriteBatcher, chroma_mode
+from services.embedding_service import EncoderRegistry
+from services.vectorstore_service import VectorStoreService
+
+
+def test_chroma_mode_is_validated(monkeypatch):
+    monkeypatch.delenv("CHROMA_MODE", raising=False)
+    assert chroma_mode() == "embedded"
+    monkeypatch.setenv("CHROMA_MODE", "Server")
+    assert chroma_mode() == "server"
+    monkeypatch.setenv("CHROMA_MODE", "cluster")
+    with pytest.raises(ValueError):
+        chroma_mode()
+
+
+class RecordingCollection:
+    name = "docs"
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.requests = []
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self.requests.append(list(ids))
+        if self.rejected & set(ids):
+            raise ValueError(f"invalid record in {ids}")
+
+
+async def direct(fn, **kwargs):
+    return fn(**kwargs)
+
+
+def write(batcher, collection, *ids):
+    ids = list(ids)
+    return batcher.add(collection, ids, [[0.0]] * len(ids), ids, [{}] * len(ids))
+
+
+def test_concurrent_writes_are_merged():
+    async def scenario():
+        batcher = WriteBatcher(direct, max_batch=100, max_wait_ms=5)
+        collection = RecordingCollection()
+        await asyncio.gather(write(batcher, collection, "a"), write(batcher, collection, "b", "c"))
+        assert collection.requests == [["a", "b", "c"]]
+
+        # A write of max_batch records or more goes out on its own
+        await write(batcher, collection, *[str(i) for i in range(100)])
+        assert len(collection.requests) == 2
+        assert batcher.stats == {"writes": 3, "requests": 2}
+
+    asyncio.run(scenario())
+
+
+def test_full_batch_is_sent_without_waiting():
+    async def scenario():
+        batcher = WriteBatcher(direct, max_batch=3, max_wait_ms=60_000)
+        collection = RecordingCollection()
+        await asyncio.wait_for(
+            asyncio.gather(write(batcher, collection, "a", "b"), write(batcher, collection, "c")),
+            timeout=5
+        )
+        assert collection.requests == [["a", "b", "c"]]
+
+    asyncio.run(scenario())
+
+
+def test_a_bad_write_only_fails_its_caller():
+    async def scenario():
+        batcher = WriteBatcher(direct, max_batch=100, max_wait_ms=5)
+        collection = RecordingCollection(rejected={"bad"})
+        results = await asyncio.gather(
+            write(batcher, collection, "a"),
+            write(batcher, collection, "bad"),
+            write(batcher, collection, "c"),
+            return_exceptions=True
+        )
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], ValueError)
+        # The merged request, then each write on its own
+        assert collection.requests == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def server_store(monkeypatch):
+    """Vector store in server mode (thread pool, write batching) over the fake client"""
+    monkeypatch.setenv("CHROMA_MODE", "server")
+    monkeypatch.setenv("CHROMA_HTTP_POOL_SIZE", "4")
+    service = VectorStoreService()
+    service.client = FakeClient()
+    service.embedding_model_name = "small"
+    service.allowed_models = ["small"]
+    service.encoders = EncoderRegistry(FakeEncoder, pinned=("small",))
+    service._initialized = True
+    yield service
+    service._executor.shutdown()
+
+
+def test_server_mode_batches_writes_and_searches_off_the_loop(server_store):
+    async def scenario():
+        await asyncio.gather(*(
+            server_store.add_documents([text], [{"document_id": text}], "docs")
+            for text in ["alpha", "beta", "gamma"]
+        ))
+        hits = await server_store.search("beta", "docs", top_k=1)
+        return hits, await server_store.list_collections()
+
+    hits, collections = asyncio.run(scenario())
+    assert hits[0]["content"] == "beta"
+    assert server_store.writes.stats == {"writes": 3, "requests": 1}
+    assert server_store.get_warmup_status()["write_batching"]["requests"] == 1
+    assert collections == ["docs"]
+
+
+def test_list_collections_hides_staging_and_document_index_collections(server_store):
+    async def scenario():
+        await server_store.add_documents(["alpha"], [{}], "docs")
+        await server_store.new_staging_collection("docs", {})
+        server_store.client.create_collection("docs__documents")
+        return await server_store.list_collections()
+
+    assert asyncio.run(scenario()) == ["docs"]
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from core.extraction_pool import ExtractionPool
+from services.document_service import DocumentService
+
+INVALID_UTF8 = "café".encode("latin-1")
+
+
+class UnusedVectorStore:
+    def __getattr__(self, name):
+        raise AssertionError(f"vector store called: {name}")
+
+
+def make_service() -> DocumentService:
+    return DocumentService(UnusedVectorStore(), ExtractionPool(max_workers=1))
+
+
+@pytest.mark.parametrize("file_type", ["txt", "md"])
+def test_text_and_markdown_must_be_valid_utf8(file_type):
+    service = make_service()
+    assert service._extract_text("café".encode("utf-8"), file_type) == "café"
+    with pytest.raises(UnicodeDecodeError):
+        service._extract_text(INVALID_UTF8, file_type)
+
+
+def test_other_plain_types_drop_undecodable_bytes():
+    assert make_service()._extract_text(INVALID_UTF8, "html") == "caf"
+
+
+def test_invalid_text_upload_is_rejected_before_writing():
+    with pytest.raises(UnicodeDecodeError):
+        asyncio.run(make_service().upload_file(INVALID_UTF8, "notes.txt", "kb"))
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from services.embedding_server import EmbeddingServer
+from services.embedding_service import EncoderRegistry, SidecarEncoder, read_frame, write_frame
+
+
+class BufferWriter:
+    """Enough of asyncio.StreamWriter for write_frame"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+async def frame_bytes(header, payload=b"") -> bytes:
+    writer = BufferWriter()
+    await write_frame(writer, header, payload)
+    return bytes(writer.data)
+
+
+def reader_over(data: bytes, eof: bool = True) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+def test_frame_round_trip():
+    async def scenario():
+        vectors = np.arange(12, dtype="<f4").reshape(3, 4)
+        payload = vectors.tobytes()
+        data = await frame_bytes({"rows": 3, "dim": 4, "nbytes": len(payload)}, payload)
+        # Two frames back to back on one connection
+        data += await frame_bytes({"model": "m", "texts": ["a", "b"]})
+
+        reader = reader_over(data)
+        header, body = await read_frame(reader)
+        assert header == {"rows": 3, "dim": 4, "nbytes": 48}
+        decoded = np.frombuffer(body, dtype="<f4").reshape(3, 4)
+        assert np.array_equal(decoded, vectors)
+        # The payload is writable (no copy needed before handing it out)
+        decoded[0, 0] = 1.0
+
+        header, body = await read_frame(reader)
+        assert header == {"model": "m", "texts": ["a", "b"]}
+        assert body == bytearray()
+
+    asyncio.run(scenario())
+
+
+def test_truncated_frames_raise_incomplete_read():
+    async def scenario():
+        data = await frame_bytes({"nbytes": 16}, b"\0" * 16)
+        for cut in (2, 10, len(data) - 4):
+            with pytest.raises(asyncio.IncompleteReadError):
+                await read_frame(reader_over(data[:cut]))
+
+    asyncio.run(scenario())
+
+
+class FakeEncoder:
+    """Deterministic 3-dimensional vectors: (len(text), model number, 1)"""
+
+    memory_bytes = 0
+    dimension = 3
+
+    def __init__(self, model_name: str):
+        if model_name == "broken":
+            raise OSError("no such model")
+        self.model_name = model_name
+        self.calls = []
+
+    async def encode(self, texts):
+        self.calls.append(list(texts))
+        number = float(self.model_name.rsplit("-", 1)[-1])
+        return np.array([[len(text), number, 1.0] for text in texts], dtype=np.float32)
+
+    async def close(self):
+        pass
+
+
+def run_with_server(client_scenario, max_wait_ms: float = 50.0):
+    """Run client_scenario(socket_path, server) against an EmbeddingServer over a real Unix socket"""
+    async def scenario():
+        server = EmbeddingServer("model-1", max_batch=256, max_wait_ms=max_wait_ms)
+        server.encoders = EncoderRegistry(FakeEncoder, pinned=("model-1",))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings.sock")
+            unix_server = await asyncio.start_unix_server(server.handle, path=path)
+            batcher = asyncio.ensure_future(server.batcher())
+            try:
+                return await client_scenario(path, server)
+            finally:
+                batcher.cancel()
+                unix_server.close()
+                await unix_server.wait_closed()
+
+    return asyncio.run(scenario())
+
+
+def test_sidecar_encodes_over_the_socket():
+    async def client(path, server):
+        encoder = SidecarEncoder("model-1", path, pool_size=2)
+        vectors = await encoder.encode(["a", "bbb"])
+        assert vectors.tolist() == [[1.0, 1.0, 1.0], [3.0, 1.0, 1.0]]
+        assert encoder.dimension == 3
+
+        # The connection is reused for the next request
+        assert (await encoder.encode(["cc"])).tolist() == [[2.0, 1.0, 1.0]]
+        assert encoder._idle.qsize() == 1
+        await encoder.close()
+
+    run_with_server(client)
+
+
+def test_concurrent_requests_are_batched_per_model():
+    async def client(path, server):
+        default = SidecarEncoder("model-1", path, pool_size=4)
+        other = SidecarEncoder("model-2", path, pool_size=4)
+        results = await asyncio.gather(
+            default.encode(["a"]),
+            default.encode(["bb", "ccc"]),
+            other.encode(["dddd"])
+        )
+        # Each client gets exactly its own rows back
+        assert [r.tolist() for r in results] == [
+            [[1.0, 1.0, 1.0]],
+            [[2.0, 1.0, 1.0], [3.0, 1.0, 1.0]],
+            [[4.0, 2.0, 1.0]]
+        ]
+        assert server.stats["requests"] == 3
+        # One encode call per model for the whole window
+        assert server.stats["batches"] == 2
+        model_1 = await server.encoders.get("model-1")
+        assert sorted(map(sorted, model_1.calls)) == [["a", "bb", "ccc"]]
+        await default.close()
+        await other.close()
+
+    run_with_server(client)
+
+
+def test_encoder_errors_are_sent_back_and_the_connection_survives():
+    async def client(path, server):
+        broken = SidecarEncoder("broken", path, pool_size=1)
+        with pytest.raises(RuntimeError, match="no such model"):
+            await broken.encode(["x"])
+        # The error frame left the stream usable
+        assert broken._idle.qsize() == 1
+
+        broken.model_name = "model-1"
+        assert (await broken.encode(["xy"])).tolist() == [[2.0, 1.0, 1.0]]
+        await broken.close()
+
+    run_with_server(client)
+
+
+def test_empty_request_skips_the_server():
+    async def scenario():
+        encoder = SidecarEncoder("model-1", "/nonexistent.sock")
+        assert (await encoder.encode([])).shape == (0, 0)
+
+    asyncio.run(scenario())
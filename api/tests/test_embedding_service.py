@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+import pytest
+
+from services.embedding_service import EncoderRegistry, allowed_models
+
+# Resident size of each fake model, in bytes
+SIZES = {"small": 10, "medium": 30, "large": 60, "huge": 200}
+
+
+class SizedEncoder:
+    loads = []
+
+    def __init__(self, model_name: str):
+        SizedEncoder.loads.append(model_name)
+        self.model_name = model_name
+        self.memory_bytes = SIZES.get(model_name, 1)
+        self.dimension = 4
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def reset_loads():
+    SizedEncoder.loads = []
+
+
+def resident(registry: EncoderRegistry):
+    return [entry["model"] for entry in registry.status()["resident"]]
+
+
+def test_least_recently_used_model_is_evicted_first():
+    async def scenario():
+        registry = EncoderRegistry(SizedEncoder, max_models=2, max_memory_bytes=1000)
+        a = await registry.get("a")
+        await registry.get("b")
+        # Using "a" makes "b" the least recently used
+        assert await registry.get("a") is a
+        await registry.get("c")
+        assert resident(registry) == ["a", "c"]
+        assert registry.evictions == 1
+
+        # An evicted model is loaded again on its next use
+        await registry.get("b")
+        assert SizedEncoder.loads == ["a", "b", "c", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_memory_cap_evicts_until_models_fit():
+    async def scenario():
+        registry = EncoderRegistry(SizedEncoder, max_models=10, max_memory_bytes=100)
+        small = await registry.get("small")
+        await registry.get("medium")
+        await registry.get("large")
+        # 10 + 30 + 60 = 100 fits exactly
+        assert resident(registry) == ["small", "medium", "large"]
+
+        await registry.get("small")
+        await registry.get("medium")
+        await registry.get("large")
+        registry.max_memory_bytes = 90
+        await registry.get("tiny")
+        # small was least recently used: dropping it brings 101 down to 91,
+        # still over, so medium goes too
+        assert resident(registry) == ["large", "tiny"]
+        assert small.closed
+        assert registry.status()["memory_mb"] == round(61 / (1 << 20), 1)
+
+    asyncio.run(scenario())
+
+
+def test_pinned_and_just_loaded_models_stay_resident():
+    async def scenario():
+        registry = EncoderRegistry(SizedEncoder, max_models=1, max_memory_bytes=50, pinned=("medium",))
+        await registry.get("medium")
+        # Over both caps, but the pinned model and the one just asked for are kept
+        huge = await registry.get("huge")
+        assert resident(registry) == ["medium", "huge"]
+        assert not huge.closed
+
+        await registry.get("small")
+        assert resident(registry) == ["medium", "small"]
+        assert huge.closed
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_requests_share_one_load():
+    release = threading.Event()
+
+    def slow_factory(model_name):
+        release.wait(5)
+        return SizedEncoder(model_name)
+
+    async def scenario():
+        registry = EncoderRegistry(slow_factory)
+        tasks = [asyncio.ensure_future(registry.get("small")) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        encoders = await asyncio.gather(*tasks)
+        assert encoders[0] is encoders[1] is encoders[2]
+        assert SizedEncoder.loads == ["small"]
+
+    asyncio.run(scenario())
+
+
+def test_allowed_models_always_include_the_default(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MODELS_ALLOWED", " big , small,other ")
+    assert allowed_models("small") == ["small", "big", "other"]
+    monkeypatch.delenv("EMBEDDING_MODELS_ALLOWED")
+    assert allowed_models("small") == ["small"]
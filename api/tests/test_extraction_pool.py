@@ -0,0 +1,61 @@
+import asyncio
+import io
+import math
+import time
+
+import pytest
+
+from core.extraction_pool import ExtractionPool, ExtractionTimeoutError
+from services.document_service import DocumentService
+from services.extractors import page_ranges
+
+# Worker functions come from the standard library: the pool spawns fresh
+# interpreters that must be able to import them
+
+
+@pytest.mark.parametrize("page_count, workers, expected", [
+    (0, 4, []),
+    (3, 4, [(0, 3)]),
+    (10, 1, [(0, 5), (5, 10)]),
+    (10, 4, [(0, 4), (4, 8), (8, 10)]),
+    (100, 4, [(start, start + 13) for start in range(0, 91, 13)] + [(91, 100)]),
+])
+def test_page_ranges_cover_every_page_once(page_count, workers, expected):
+    assert page_ranges(page_count, workers) == expected
+
+
+def test_results_keep_task_order_and_a_timeout_only_fails_its_document():
+    async def scenario():
+        pool = ExtractionPool(max_workers=2, timeout=30)
+        try:
+            assert await pool.map_ordered(pow, [(2, 10), (3, 2), (5, 1)]) == [1024, 9, 5]
+            with pytest.raises(ValueError):
+                await pool.map_ordered(math.sqrt, [(4,), (-1,)])
+
+            with pytest.raises(ExtractionTimeoutError):
+                await pool.map_ordered(time.sleep, [(30,)], time.monotonic() + 0.5)
+            # The stuck workers were killed; the next document gets a fresh pool
+            assert await pool.map_ordered(pow, [(2, 2)]) == [4]
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_pdf_pages_are_extracted_in_order_with_their_numbers():
+    PyPDF2 = pytest.importorskip("PyPDF2")
+    writer = PyPDF2.PdfWriter()
+    for _ in range(5):
+        writer.add_blank_page(width=72, height=72)
+    content = io.BytesIO()
+    writer.write(content)
+
+    async def scenario():
+        pool = ExtractionPool(max_workers=2)
+        try:
+            return await DocumentService(None, pool)._extract_pdf_pages(content.getvalue())
+        finally:
+            pool.shutdown()
+
+    pages = asyncio.run(scenario())
+    assert [meta["page"] for _, meta in pages] == [1, 2, 3, 4, 5]
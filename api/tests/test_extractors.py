@@ -0,0 +1,123 @@
+import io
+import json
+
+import pytest
+
+from services import extractors
+from services.extractors import RecordTooLargeError, extract_segments
+
+
+def segments(data: str, file_type: str, **kwargs):
+    return list(extract_segments(io.BytesIO(data.encode("utf-8")), file_type, **kwargs))
+
+
+def records_of(segment_text: str):
+    return [json.loads(line) for line in segment_text.split("\n")]
+
+
+def test_csv_rows_are_grouped_under_the_header():
+    rows = "".join(f"{i},name {i}\n" for i in range(1, 41))
+    result = segments("id,name\n" + rows, "csv", max_tokens=25)
+
+    assert len(result) > 1
+    for text, metadata in result:
+        lines = text.rstrip("\n").split("\n")
+        assert lines[0] == "id,name"
+        assert len(text) <= 25 * 4
+        # Every row is whole and numbered as in the file
+        assert [line.split(",")[0] for line in lines[1:]] == [
+            str(i) for i in range(metadata["row_start"], metadata["row_end"] + 1)
+        ]
+    assert result[0][1]["row_start"] == 1
+    assert result[-1][1]["row_end"] == 40
+    assert all(a[1]["row_end"] + 1 == b[1]["row_start"] for a, b in zip(result, result[1:]))
+
+
+def test_csv_quoted_fields_stay_in_one_row():
+    data = 'id,text\n1,"line one\nline two, with comma"\n2,plain\n'
+    [(text, metadata)] = segments(data, "csv")
+    assert text == 'id,text\n1,"line one\nline two, with comma"\n2,plain\n'
+    assert metadata == {"row_start": 1, "row_end": 2}
+
+
+def test_csv_header_only_has_no_segments():
+    assert segments("id,name\n", "csv") == []
+    assert segments("", "csv") == []
+
+
+def test_csv_row_larger_than_budget_is_kept_whole():
+    data = "id,text\n1,short\n2," + "x" * 500 + "\n3,short\n"
+    result = segments(data, "csv", max_tokens=10)
+    assert [metadata for _, metadata in result] == [
+        {"row_start": 1, "row_end": 1},
+        {"row_start": 2, "row_end": 2},
+        {"row_start": 3, "row_end": 3}
+    ]
+    assert "x" * 500 in result[1][0]
+
+
+def test_json_array_records_are_grouped_in_order():
+    records = [{"id": i, "text": f"record {i}"} for i in range(30)]
+    result = segments(json.dumps(records, indent=2), "json", max_tokens=20)
+
+    assert len(result) > 1
+    flattened = []
+    for text, metadata in result:
+        group = records_of(text)
+        assert len(group) == metadata["row_end"] - metadata["row_start"] + 1
+        flattened.extend(group)
+    assert flattened == records
+
+
+def test_json_object_members_and_nested_arrays():
+    document = {"meta": {"source": "export"}, "data": [{"id": 1}, {"id": 2}], "count": 2}
+    [(text, metadata)] = segments(json.dumps(document), "json")
+    assert records_of(text) == [{"meta": {"source": "export"}}, {"id": 1}, {"id": 2}, {"count": 2}]
+    assert metadata == {"row_start": 1, "row_end": 4}
+
+
+def test_json_scalar_and_empty_documents():
+    assert records_of(segments("42", "json")[0][0]) == [42]
+    assert segments("[]", "json") == []
+    assert segments("{}", "json") == []
+    assert segments("   ", "json") == []
+
+
+@pytest.mark.parametrize("read_size", [1, 3, 7, 64])
+def test_json_is_independent_of_read_boundaries(monkeypatch, read_size):
+    document = [
+        {"id": 1, "value": -12.5e3, "tags": ["a", "b"], "text": "ü \"quoted\""},
+        123456789,
+        [1.25, 2, {"deep": [None, True, False]}],
+        "plain string"
+    ]
+    expected = segments(json.dumps(document), "json")
+
+    monkeypatch.setattr(extractors, "_READ_SIZE", read_size)
+    assert segments(json.dumps(document), "json") == expected
+    assert [record for text, _ in expected for record in records_of(text)] == document
+
+
+def test_jsonl_skips_blank_lines():
+    data = '{"id": 1}\n\n{"id": 2}\n   \n{"id": 3}'
+    [(text, metadata)] = segments(data, "jsonl")
+    assert records_of(text) == [{"id": 1}, {"id": 2}, {"id": 3}]
+    assert metadata == {"row_start": 1, "row_end": 3}
+
+
+def test_oversized_records_are_rejected():
+    big = "x" * 200
+    with pytest.raises(RecordTooLargeError):
+        segments(json.dumps([{"text": big}]), "json", max_record_chars=100)
+    with pytest.raises(RecordTooLargeError):
+        segments(json.dumps({"text": big}) + "\n", "jsonl", max_record_chars=100)
+    # Records under the limit pass even when the document as a whole is larger
+    small = [{"text": "x" * 50} for _ in range(10)]
+    assert len(segments(json.dumps(small), "json", max_record_chars=100)) > 0
+
+
+def test_invalid_json_raises():
+    with pytest.raises(ValueError):
+        segments('[{"id": 1}, {"id": }]', "json")
+    with pytest.raises(ValueError):
+        segments("{}", "xml")
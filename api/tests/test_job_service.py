@@ -0,0 +1,249 @@
+import asyncio
+import socket
+
+import httpx
+import pytest
+
+from models.schemas import AgentJobRequest, AgentTaskResponse
+from services.job_service import (
+    JobQueueFullError, JobService, WebhookPolicy, WebhookURLError, _pinned_request
+)
+
+
+class FakeAgent:
+    """Records one step, then finishes when released (or fails with `error`)"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.release = asyncio.Event()
+        self.started = []
+
+    async def execute_task(self, task, on_step, **kwargs):
+        self.started.append(task)
+        await on_step({"iteration": 1, "thought": task, "tool_uses": []})
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return AgentTaskResponse(result=f"done: {task}", steps=[], usage={"input_tokens": 1}, success=True)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_job_runs_through_its_lifecycle():
+    async def scenario():
+        agent = FakeAgent()
+        jobs = JobService(agent, max_workers=1)
+        job = await jobs.submit(AgentJobRequest(task="t1"))
+        assert job["status"] == "queued"
+
+        await settle()
+        running = await jobs.get(job["job_id"])
+        assert running["status"] == "running"
+        assert [step["thought"] for step in running["steps"]] == ["t1"]
+
+        agent.release.set()
+        await settle()
+        finished = await jobs.get(job["job_id"])
+        assert finished["status"] == "succeeded"
+        assert finished["result"]["result"] == "done: t1"
+        assert finished["finished_at"] >= finished["started_at"]
+        await jobs.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_records_the_error():
+    async def scenario():
+        agent = FakeAgent(error=RuntimeError("boom"))
+        agent.release.set()
+        jobs = JobService(agent, max_workers=1)
+        job = await jobs.submit(AgentJobRequest(task="t1"))
+        await settle()
+        failed = await jobs.get(job["job_id"])
+        assert (failed["status"], failed["error"]) == ("failed", "boom")
+        await jobs.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_queued_and_running_jobs():
+    async def scenario():
+        agent = FakeAgent()
+        jobs = JobService(agent, max_workers=1)
+        running = await jobs.submit(AgentJobRequest(task="running"))
+        queued = await jobs.submit(AgentJobRequest(task="queued"))
+        await settle()
+
+        cancelled = await jobs.cancel(queued["job_id"])
+        assert (cancelled["status"], cancelled["cancel_requested"]) == ("cancelled", True)
+
+        await jobs.cancel(running["job_id"])
+        await settle()
+        assert (await jobs.get(running["job_id"]))["status"] == "cancelled"
+        # The cancelled queued job never started and stays cancelled
+        assert agent.started == ["running"]
+        assert (await jobs.get(queued["job_id"]))["status"] == "cancelled"
+        # Cancelling a finished job changes nothing
+        assert (await jobs.cancel(running["job_id"]))["status"] == "cancelled"
+        assert await jobs.cancel("unknown") is None
+        await jobs.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        jobs = JobService(FakeAgent(), max_workers=1, max_queue=1)
+        jobs._ensure_workers = lambda: None
+        await jobs.submit(AgentJobRequest(task="t1"))
+        with pytest.raises(JobQueueFullError):
+            await jobs.submit(AgentJobRequest(task="t2"))
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://hooks.example.com/x",
+    "http:///no-host",
+    "http://hooks.example.com:99999/x",
+    "http://127.0.0.1/x",
+    "http://10.0.0.5/x",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/x",
+    "http://[::ffff:192.168.0.1]/x",
+    "http://224.0.0.1/x"
+])
+def test_policy_rejects_unsafe_urls(url):
+    with pytest.raises(WebhookURLError):
+        WebhookPolicy().check(url)
+
+
+def test_policy_allowed_hosts_and_private_opt_in():
+    policy = WebhookPolicy(allowed_hosts=["hooks.example.com", "*.internal.example.com"])
+    assert policy.check("https://hooks.example.com/x") == "hooks.example.com"
+    assert policy.check("https://a.internal.example.com/x") == "a.internal.example.com"
+    for url in ("https://example.com/x", "https://evilhooks.example.com/x", "https://internal.example.com.evil/x"):
+        with pytest.raises(WebhookURLError):
+            policy.check(url)
+
+    assert WebhookPolicy(allow_private=True).check("http://10.0.0.5/x") == "10.0.0.5"
+    assert WebhookPolicy().check("https://8.8.8.8/x") == "8.8.8.8"
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    """Fake resolver: answers[host] is a list of address lists, one per lookup"""
+    answers = {}
+
+    async def getaddrinfo(loop, host, port, *args, **kwargs):
+        addresses = answers[host].pop(0) if len(answers[host]) > 1 else answers[host][0]
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port)) for address in addresses]
+
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", getaddrinfo)
+    return answers
+
+
+def test_resolve_checks_every_address(dns):
+    dns["hooks.example.com"] = [["93.184.216.34"]]
+    dns["mixed.example.com"] = [["93.184.216.34", "10.0.0.5"]]
+    policy = WebhookPolicy()
+
+    assert asyncio.run(policy.resolve("https://hooks.example.com/x")) == "93.184.216.34"
+    with pytest.raises(WebhookURLError):
+        asyncio.run(policy.resolve("https://mixed.example.com/x"))
+    # No lookup for IP literals or when private targets are allowed
+    assert asyncio.run(policy.resolve("https://8.8.8.8/x")) is None
+    assert asyncio.run(WebhookPolicy(allow_private=True).resolve("https://mixed.example.com/x")) is None
+
+
+def test_pinned_request_keeps_host_and_sni():
+    request = _pinned_request("https://hooks.example.com:8443/cb?x=1", "93.184.216.34")
+    assert str(request["url"]) == "https://93.184.216.34:8443/cb?x=1"
+    assert request["headers"] == {"Host": "hooks.example.com:8443"}
+    assert request["extensions"] == {"sni_hostname": "hooks.example.com"}
+
+    assert str(_pinned_request("http://h.example.com/", "2001:db8::1")["url"]) == "http://[2001:db8::1]/"
+    assert _pinned_request("http://8.8.8.8/", None) == {"url": "http://8.8.8.8/"}
+
+
+def test_pinned_request_connects_to_the_checked_address():
+    async def scenario():
+        received = []
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            received.append(head.decode())
+            writer.write(b"HTTP/1.1 204 No Content\r\ncontent-length: 0\r\n\r\n")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        # The name does not resolve at all: the connection must use the address
+        async with httpx.AsyncClient() as client:
+            response = await client.post(json={}, **_pinned_request(f"http://hooks.invalid:{port}/cb", "127.0.0.1"))
+        server.close()
+        await server.wait_closed()
+
+        assert response.status_code == 204
+        assert received[0].startswith("POST /cb HTTP/1.1")
+        assert f"host: hooks.invalid:{port}" in received[0].lower()
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def webhook_calls(monkeypatch):
+    """Capture webhook requests instead of sending them"""
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(200)
+
+    client_class = httpx.AsyncClient
+
+    def client(**kwargs):
+        return client_class(transport=httpx.MockTransport(handler), **kwargs)
+
+    monkeypatch.setattr(httpx, "AsyncClient", client)
+    return calls
+
+
+def run_job_with_webhook(url: str):
+    async def scenario():
+        agent = FakeAgent()
+        agent.release.set()
+        jobs = JobService(agent, max_workers=1, webhook_retries=0)
+        job = await jobs.submit(AgentJobRequest(task="t1", webhook_url=url))
+        await settle()
+        finished = await jobs.get(job["job_id"])
+        await jobs.shutdown()
+        return finished
+
+    return asyncio.run(scenario())
+
+
+def test_webhook_is_sent_to_the_validated_address(dns, webhook_calls):
+    dns["hooks.example.com"] = [["93.184.216.34"]]
+    job = run_job_with_webhook("https://hooks.example.com/cb")
+
+    assert job["webhook"] == {"delivered": True, "status_code": 200, "attempts": 1}
+    [request] = webhook_calls
+    assert request.url.host == "93.184.216.34"
+    assert request.headers["host"] == "hooks.example.com"
+    assert request.extensions["sni_hostname"] == "hooks.example.com"
+
+
+def test_webhook_rebound_to_a_private_address_is_not_sent(dns, webhook_calls):
+    # Public at submit time, internal by the time the job finishes
+    dns["hooks.example.com"] = [["93.184.216.34"], ["127.0.0.1"]]
+    asyncio.run(WebhookPolicy().resolve("https://hooks.example.com/cb"))
+    job = run_job_with_webhook("https://hooks.example.com/cb")
+
+    assert job["webhook"]["delivered"] is False
+    assert "not public" in job["webhook"]["error"]
+    assert webhook_calls == []
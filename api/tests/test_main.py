@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Without the context manager the startup warm-up never runs
+    monkeypatch.setattr(main, "claude_is_ready", lambda: True)
+    return TestClient(main.app)
+
+
+def test_liveness_does_not_wait_for_warm_up(client, monkeypatch):
+    assert client.get("/health/live").json() == {"status": "alive"}
+
+    monkeypatch.setattr(main.vectorstore_service, "is_ready", lambda: False)
+    response = client.get("/health/ready")
+    assert (response.status_code, response.json()["status"]) == (503, "not_ready")
+    assert "stage" in response.json()["warmup"]
+
+    monkeypatch.setattr(main.vectorstore_service, "is_ready", lambda: True)
+    assert client.get("/health/ready").status_code == 200
+
+
+@pytest.fixture
+def failing_warm_up(monkeypatch):
+    """Vector store initialization failing twice; records attempts, sleeps and kills"""
+    record = {"failures": 2, "attempts": 0, "sleeps": [], "killed": False}
+
+    async def initialize():
+        record["attempts"] += 1
+        if record["attempts"] <= record["failures"]:
+            raise ConnectionError("chroma not up yet")
+
+    async def sleep(delay):
+        record["sleeps"].append(delay)
+
+    monkeypatch.setattr(main.vectorstore_service, "initialize", initialize)
+    monkeypatch.setattr(main, "get_claude_service", lambda: None)
+    monkeypatch.setattr(main.asyncio, "sleep", sleep)
+    monkeypatch.setattr(main.os, "kill", lambda pid, sig: record.update(killed=True))
+    monkeypatch.setenv("WARMUP_RETRY_BASE_DELAY", "2")
+    monkeypatch.setenv("WARMUP_RETRY_MAX_DELAY", "3")
+    return record
+
+
+def test_failed_warm_up_is_retried_with_backoff(failing_warm_up):
+    asyncio.run(main.warm_up_services())
+    assert failing_warm_up["attempts"] == 3
+    assert failing_warm_up["sleeps"] == [2.0, 3.0]
+    assert not failing_warm_up["killed"]
+
+
+def test_warm_up_gives_up_after_max_attempts(failing_warm_up, monkeypatch):
+    monkeypatch.setenv("WARMUP_MAX_ATTEMPTS", "2")
+    asyncio.run(main.warm_up_services())
+    assert failing_warm_up["attempts"] == 2
+    assert failing_warm_up["killed"]
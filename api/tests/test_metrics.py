@@ -0,0 +1,40 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from monitoring.metrics import get_cache_stats, record_claude_usage, render_metrics, track_stage
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stage_latency_and_errors_are_recorded():
+    stage = {"component": "test", "stage": "work"}
+    count = sample("agentic_rag_stage_duration_seconds_count", **stage)
+    errors = sample("agentic_rag_stage_errors_total", **stage)
+
+    with track_stage("test", "work"):
+        assert sample("agentic_rag_stage_in_flight", **stage) == 1
+    with pytest.raises(RuntimeError):
+        with track_stage("test", "work"):
+            raise RuntimeError("boom")
+
+    assert sample("agentic_rag_stage_duration_seconds_count", **stage) == count + 2
+    assert sample("agentic_rag_stage_errors_total", **stage) == errors + 1
+    assert sample("agentic_rag_stage_in_flight", **stage) == 0
+
+
+def test_tokens_and_cache_ratio_are_exported():
+    tokens = sample("agentic_rag_claude_tokens_total", model="test-model", direction="output")
+    record_claude_usage("test-model", {"input_tokens": 3, "output_tokens": 5})
+    assert sample("agentic_rag_claude_tokens_total", model="test-model", direction="output") == tokens + 5
+
+    stats = get_cache_stats("test-cache")
+    assert get_cache_stats("test-cache") is stats
+    for hit in (True, True, False, True):
+        stats.record(hit)
+    assert sample("agentic_rag_cache_hit_ratio", cache="test-cache") == 0.75
+
+    body, content_type = render_metrics()
+    assert content_type.startswith("text/plain")
+    assert b'agentic_rag_cache_hits_total{cache="test-cache"} 3.0' in body
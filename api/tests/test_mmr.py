@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from core.mmr import mmr_select
+from mmr_benchmark import mmr_reference
+
+
+def clustered(rng: np.random.Generator, count: int, dim: int = 32, clusters: int = 6) -> np.ndarray:
+    """Near-duplicate groups, where MMR and plain ranking disagree"""
+    centers = rng.normal(size=(clusters, dim))
+    return centers[rng.integers(0, clusters, count)] + 0.05 * rng.normal(size=(count, dim))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.3, 0.5, 0.7, 1.0])
+def test_matches_reference(seed, lambda_mult):
+    rng = np.random.default_rng(seed)
+    # float32 throughout, as in the service, so both see the same similarities
+    candidates = clustered(rng, 60).astype(np.float32)
+    query = rng.normal(size=32).astype(np.float32)
+
+    assert mmr_select(query, candidates, 10, lambda_mult) == mmr_reference(query, candidates, 10, lambda_mult)
+
+
+def test_lambda_one_is_similarity_ranking():
+    rng = np.random.default_rng(7)
+    candidates = rng.normal(size=(20, 8)).astype(np.float32)
+    query = rng.normal(size=8).astype(np.float32)
+
+    normalized = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    ranking = np.argsort(-(normalized @ (query / np.linalg.norm(query))))
+    assert mmr_select(query, candidates, 5, 1.0) == ranking[:5].tolist()
+
+
+def test_duplicates_are_skipped():
+    query = [1.0, 0.0]
+    candidates = [[1.0, 0.0], [1.0, 0.001], [0.7, 0.7]]
+    assert mmr_select(query, candidates, 2, 0.3) == [0, 2]
+    assert mmr_select(query, candidates, 2, 1.0) == [0, 1]
+
+
+def test_edge_cases():
+    assert mmr_select([1.0, 0.0], [], 3) == []
+    assert mmr_select([1.0, 0.0], [[1.0, 0.0]], 0) == []
+    # k larger than the pool returns every candidate once
+    assert sorted(mmr_select([1.0, 0.0], [[1.0, 0.0], [0.0, 1.0]], 5)) == [0, 1]
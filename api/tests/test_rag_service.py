@@ -0,0 +1,127 @@
+import asyncio
+
+from core.admission import AdmissionRejectedError, RouteClassLimiter
+from core.rate_limit import Priority
+from models.schemas import RAGQueryRequest
+from monitoring.tracing import RequestTrace
+from services.rag_service import RAGService
+
+
+class FakeVectorStore:
+    async def search(self, query, knowledge_base_id, top_k, filter=None, **kwargs):
+        return [{"content": f"about {query}", "metadata": {"kb": knowledge_base_id}, "score": 0.9}]
+
+
+class FakeClaude:
+    """Answers once released, recording the priority of every call"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.priorities = []
+
+    async def generate(self, prompt, system_prompt, model, temperature, max_tokens, priority):
+        self.priorities.append(priority)
+        await self.release.wait()
+        return {"response": "answer", "usage": {"input_tokens": 1, "output_tokens": 1}, "model": model}
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run_concurrently(*requests):
+    """Start every (priority, traced) request, release Claude once all are waiting, return the service and results"""
+    async def scenario():
+        claude = FakeClaude()
+        rag = RAGService(FakeVectorStore(), claude)
+        rag.coalesce = True
+
+        async def request(priority: Priority, traced: bool):
+            with RequestTrace("rag.query", enabled=traced) as trace:
+                response = await rag.query("what is x?", knowledge_base_id="kb", priority=priority)
+            return response, trace.to_dict()
+
+        tasks = [asyncio.ensure_future(request(*args)) for args in requests]
+        await settle()
+        claude.release.set()
+        return claude, await asyncio.gather(*tasks)
+
+    return asyncio.run(scenario())
+
+
+def span_names(trace):
+    names = [trace["name"]]
+    for child in trace.get("children", []):
+        names.extend(span_names(child))
+    return names
+
+
+def test_identical_queries_share_one_generation():
+    claude, results = run_concurrently((Priority.INTERACTIVE, False), (Priority.INTERACTIVE, False))
+    assert claude.priorities == [Priority.INTERACTIVE]
+    assert [response.answer for response, _ in results] == ["answer", "answer"]
+    # Every caller gets its own copy
+    assert results[0][0] is not results[1][0]
+
+
+def test_priorities_are_not_coalesced():
+    claude, _ = run_concurrently((Priority.BATCH, False), (Priority.INTERACTIVE, False))
+    assert sorted(claude.priorities) == [Priority.INTERACTIVE, Priority.BATCH]
+
+
+def test_traced_request_runs_its_own_stages():
+    claude, results = run_concurrently((Priority.INTERACTIVE, False), (Priority.INTERACTIVE, True))
+    assert len(claude.priorities) == 2
+
+    _, trace = results[1]
+    assert "rag.retrieval" in span_names(trace)
+    assert "rag.generation" in span_names(trace)
+
+
+class CountingClaude:
+    """Answers after a few loop turns, recording the peak number of concurrent calls"""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def generate(self, prompt, system_prompt, model, temperature, max_tokens, priority):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await settle()
+        self.running -= 1
+        return {"response": "answer", "usage": {"input_tokens": 1, "output_tokens": 1}, "model": model}
+
+
+class BatchVectorStore(FakeVectorStore):
+    async def search_batch(self, searches):
+        return [await self.search(s["query"], s["knowledge_base_id"], s["top_k"]) for s in searches]
+
+
+def run_batch(limiter, size=6, concurrency=6):
+    async def scenario():
+        claude = CountingClaude()
+        rag = RAGService(BatchVectorStore(), claude)
+        requests = [RAGQueryRequest(query=f"q{i}") for i in range(size)]
+        items = [item async for item in rag.query_batch(requests, concurrency, limiter, "key:abc")]
+        return claude, dict(items)
+
+    return asyncio.run(scenario())
+
+
+def test_batch_generations_take_rag_slots():
+    limiter = RouteClassLimiter("rag", max_in_flight=2, max_queue=10, max_queue_per_tenant=10, queue_timeout=5.0)
+    claude, results = run_batch(limiter)
+    assert claude.peak == 2
+    assert all(result.answer == "answer" for result in results.values())
+    assert limiter.in_flight == 0
+
+
+def test_batch_items_beyond_the_rag_queue_are_rejected():
+    limiter = RouteClassLimiter("rag", max_in_flight=1, max_queue=1, max_queue_per_tenant=1, queue_timeout=5.0)
+    _, results = run_batch(limiter, size=4, concurrency=4)
+    rejected = [result for result in results.values() if isinstance(result, AdmissionRejectedError)]
+    assert len(rejected) == 2
+    assert all(result.retry_after >= 1 for result in rejected)
+    assert limiter.in_flight == 0
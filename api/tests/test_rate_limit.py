@@ -0,0 +1,197 @@
+import asyncio
+import types
+
+import pytest
+
+from core import rate_limit
+from core.rate_limit import Priority, RateLimitExceededError, TokenBucket, ClaudeScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the clock seen by core.rate_limit only (the event loop keeps the real one)"""
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+@pytest.fixture
+def sleeps(monkeypatch, clock):
+    """Record backoff sleeps and advance the fake clock instead of waiting"""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        clock.now += delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def test_bucket_refills_continuously(clock):
+    bucket = TokenBucket(60)  # one per second
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.wait_time(1) == 0.0
+
+
+def test_bucket_never_exceeds_capacity(clock):
+    bucket = TokenBucket(60)
+    clock.now += 3600
+    bucket.take(1)
+    assert bucket.level == pytest.approx(59.0)
+
+
+def test_bucket_debt_delays_later_requests(clock):
+    bucket = TokenBucket(60)
+    bucket.take(10)
+    # The request used 40 more than it reserved
+    bucket.give_back(-40)
+    assert bucket.level == pytest.approx(10.0)
+
+    bucket.take(10)
+    bucket.give_back(-20)
+    assert bucket.level == pytest.approx(-20.0)
+    assert bucket.wait_time(1) == pytest.approx(21.0)
+
+
+def test_oversized_request_only_needs_a_full_bucket(clock):
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(500) == 0.0
+    bucket.take(500)
+    assert bucket.level == 0.0
+
+
+def test_drain_and_disabled_bucket(clock):
+    bucket = TokenBucket(60)
+    bucket.drain()
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+    disabled = TokenBucket(0)
+    disabled.take(10 ** 6)
+    assert disabled.wait_time(10 ** 6) == 0.0
+
+
+def test_backoff_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda low, high: high)
+    scheduler = ClaudeScheduler(base_delay=1.0, max_delay=8.0)
+    assert [scheduler.backoff(attempt, 0) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 8.0, 8.0]
+
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda low, high: low)
+    assert [scheduler.backoff(attempt, None) for attempt in range(1, 4)] == [0.5, 1.0, 2.0]
+
+
+def test_backoff_honors_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda low, high: high)
+    scheduler = ClaudeScheduler(base_delay=1.0, max_delay=8.0)
+    # retry-after plus at most 10% jitter (capped at 1s)
+    assert scheduler.backoff(1, 5.0) == pytest.approx(5.5)
+    assert scheduler.backoff(1, 30.0) == pytest.approx(31.0)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("429")
+        self.retry_after = retry_after
+
+
+def run_scheduler(scheduler: ClaudeScheduler, responses):
+    """Run one call whose attempts raise or return `responses` in turn"""
+    attempts = iter(responses)
+    calls = []
+
+    async def call():
+        calls.append(scheduler.paused_until)
+        outcome = next(attempts)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def retry_after_of(error):
+        return error.retry_after if isinstance(error, RateLimited) else None
+
+    result = asyncio.run(scheduler.run(
+        call, 100, 50, Priority.INTERACTIVE,
+        usage_of=lambda response: (100, 10),
+        retry_after_of=retry_after_of
+    ))
+    return result, calls
+
+
+def test_429_is_retried_after_the_suggested_delay(monkeypatch, sleeps):
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda low, high: low)
+    scheduler = ClaudeScheduler(requests_per_minute=60)
+
+    result, calls = run_scheduler(scheduler, [RateLimited(2.0), RateLimited(0), "ok"])
+    assert result == "ok"
+    assert len(calls) == 3
+    # retry-after as given, then exponential backoff from base_delay
+    assert sleeps == [2.0, 1.0]
+    # A 429 drains the request bucket so queued requests hold off too
+    assert scheduler.requests.level < 60
+
+
+def test_429_gives_up_after_max_retries(sleeps):
+    scheduler = ClaudeScheduler(max_retries=2, base_delay=1.0)
+    with pytest.raises(RateLimitExceededError) as info:
+        run_scheduler(scheduler, [RateLimited(3.0)] * 3)
+    assert len(sleeps) == 2
+    assert info.value.retry_after >= 3.0
+
+
+def test_other_errors_are_not_retried(sleeps):
+    scheduler = ClaudeScheduler()
+    with pytest.raises(ValueError):
+        run_scheduler(scheduler, [ValueError("bad request")])
+    assert sleeps == []
+
+
+def test_unused_output_reservation_is_returned(clock, sleeps):
+    scheduler = ClaudeScheduler(input_tokens_per_minute=1000, output_tokens_per_minute=1000)
+    run_scheduler(scheduler, ["ok"])
+    assert scheduler.input_tokens.level == pytest.approx(900.0)
+    # 50 reserved, 10 used
+    assert scheduler.output_tokens.level == pytest.approx(990.0)
+
+
+def test_higher_priority_is_admitted_first(clock):
+    async def scenario():
+        scheduler = ClaudeScheduler(requests_per_minute=60)
+        scheduler.requests.take(60)
+        order = []
+
+        async def request(priority: Priority):
+            await scheduler.acquire(0, 0, priority)
+            order.append(priority)
+
+        tasks = [asyncio.ensure_future(request(priority)) for priority in (Priority.AGENT, Priority.BATCH, Priority.INTERACTIVE)]
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert order == []
+
+        # One request's worth of refill at a time
+        for _ in tasks:
+            clock.now += 1.0
+            async with scheduler._changed:
+                scheduler._changed.notify_all()
+            for _ in range(5):
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == [Priority.INTERACTIVE, Priority.BATCH, Priority.AGENT]
+
+    asyncio.run(scenario())
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from core.singleflight import SingleFlight, make_key
+
+
+class Work:
+    """Coroutine factory that blocks until released and counts its runs"""
+
+    def __init__(self, result="done"):
+        self.result = result
+        self.release = asyncio.Event()
+        self.runs = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.runs += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_callers_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work()
+        callers = [asyncio.ensure_future(flight.do("k", work)) for _ in range(3)]
+        await settle()
+        assert flight.in_flight() == 1
+
+        work.release.set()
+        assert await asyncio.gather(*callers) == ["done"] * 3
+        assert work.runs == 1
+        assert flight.in_flight() == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_one_caller_keeps_the_work_for_the_others():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work()
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await settle()
+
+        # The caller that started the work goes away
+        first.cancel()
+        await settle()
+        assert first.cancelled()
+        assert work.cancelled == 0
+
+        work.release.set()
+        assert await second == "done"
+        assert work.runs == 1
+
+    asyncio.run(scenario())
+
+
+def test_work_is_cancelled_once_every_caller_is_gone():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work()
+        callers = [asyncio.ensure_future(flight.do("k", work)) for _ in range(2)]
+        await settle()
+
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await settle()
+        assert work.cancelled == 1
+        assert flight.in_flight() == 0
+
+        # A later call starts fresh instead of joining the cancelled task
+        fresh = Work("again")
+        fresh.release.set()
+        assert await flight.do("k", fresh) == "again"
+
+    asyncio.run(scenario())
+
+
+def test_failure_is_shared_but_not_cached():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work(RuntimeError("boom"))
+        callers = [asyncio.ensure_future(flight.do("k", work)) for _ in range(2)]
+        await settle()
+
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert [str(result) for result in results] == ["boom", "boom"]
+        assert work.runs == 1
+
+        retry = Work()
+        retry.release.set()
+        assert await flight.do("k", retry) == "done"
+
+    asyncio.run(scenario())
+
+
+def test_distinct_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+        a, b = Work("a"), Work("b")
+        callers = [asyncio.ensure_future(flight.do("a", a)), asyncio.ensure_future(flight.do("b", b))]
+        await settle()
+        assert flight.in_flight() == 2
+
+        a.release.set()
+        b.release.set()
+        assert await asyncio.gather(*callers) == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("left, right", [
+    (({"b": 1, "a": [1, 2]},), ({"a": [1, 2], "b": 1},)),
+    (("kb", 5, {"x": None}), ("kb", 5, {"x": None}))
+])
+def test_make_key_canonicalizes_dicts(left, right):
+    assert make_key(*left) == make_key(*right)
+    assert hash(make_key(*left)) == hash(make_key(*right))
@@ -0,0 +1,90 @@
+import asyncio
+import io
+import os
+
+import numpy as np
+import pytest
+
+from services.snapshot_service import SnapshotError, SnapshotService, pack, read_manifest, unpack
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def contents(store, knowledge_base_id):
+    rows = store.client.get_collection(knowledge_base_id).get(include=["embeddings", "documents", "metadatas"])
+    return {
+        id_: (np.round(embedding, 6).tolist(), document, metadata)
+        for id_, embedding, document, metadata in zip(rows["ids"], rows["embeddings"], rows["documents"], rows["metadatas"])
+    }
+
+
+@pytest.fixture
+def docs(store):
+    """Knowledge base "docs" (cosine, M 32, document index) with three chunks"""
+    run(store.create_collection("docs", {"space": "cosine", "M": 32}, document_index=True, top_documents=2))
+    run(store.add_documents(
+        ["alpha", "beta gamma", "delta"],
+        [{"document_id": "a", "page": 1}, {"document_id": "a", "page": 2}, {"document_id": "b"}],
+        "docs",
+        ids=["a_0", "a_1", "b_0"]
+    ))
+    return store
+
+
+def test_export_and_import_round_trip(docs, tmp_path):
+    snapshots = SnapshotService(docs, batch_size=2)
+    manifest = run(snapshots.export("docs", str(tmp_path)))
+    assert (manifest["count"], manifest["embedding_model"], manifest["embedding_dim"]) == (3, "small", 4)
+    assert read_manifest(str(tmp_path))["collection_metadata"]["hnsw:M"] == 32
+    assert np.load(tmp_path / "embeddings.npy", mmap_mode="r").shape == (3, 4)
+
+    result = run(snapshots.import_(str(tmp_path), "copy"))
+    assert (result["imported"], result["replaced"]) == (3, False)
+    assert contents(docs, "copy") == contents(docs, "docs")
+
+    metadata = docs.client.get_collection("copy").metadata
+    assert (metadata["hnsw:space"], metadata["hnsw:M"], metadata["description"]) == ("cosine", 32, "Knowledge base: copy")
+    # Document vectors are rebuilt from the imported chunks
+    info = run(docs.get_index_info("copy"))
+    assert info["document_index"] == {"top_documents": 2, "documents": 2}
+    assert sorted(run(docs.list_collections())) == ["copy", "docs"]
+
+
+def test_reimport_upserts_and_replace_swaps(docs, tmp_path):
+    snapshots = SnapshotService(docs)
+    run(snapshots.export("docs", str(tmp_path)))
+
+    run(docs.add_documents(["epsilon"], [{"document_id": "c"}], "docs", ids=["c_0"]))
+    run(docs.delete_document("b", "docs"))
+    # Into the existing knowledge base: restores b_0, keeps c_0
+    run(snapshots.import_(str(tmp_path)))
+    assert sorted(contents(docs, "docs")) == ["a_0", "a_1", "b_0", "c_0"]
+
+    result = run(snapshots.import_(str(tmp_path), replace=True))
+    assert result["replaced"] is True
+    assert sorted(contents(docs, "docs")) == ["a_0", "a_1", "b_0"]
+    assert run(docs.list_collections()) == ["docs"]
+
+
+def test_archive_round_trip_and_bad_snapshots(docs, tmp_path):
+    snapshots = SnapshotService(docs)
+    run(snapshots.export("docs", str(tmp_path / "out")))
+    pack(str(tmp_path / "out"), str(tmp_path / "docs.tar"))
+    with open(tmp_path / "docs.tar", "rb") as archive:
+        unpack(archive, str(tmp_path / "in"))
+    assert sorted(os.listdir(tmp_path / "in")) == ["embeddings.npy", "manifest.json", "records.parquet"]
+    run(snapshots.import_(str(tmp_path / "in"), "restored"))
+    assert contents(docs, "restored") == contents(docs, "docs")
+
+    with pytest.raises(SnapshotError):
+        run(snapshots.export("missing", str(tmp_path / "missing")))
+    with pytest.raises(SnapshotError):
+        unpack(io.BytesIO(b"not a tar"), str(tmp_path / "junk"))
+
+    # A different model cannot be upserted into the existing knowledge base
+    run(docs.create_collection("wide", {}, embedding_model="big-model"))
+    with pytest.raises(SnapshotError):
+        run(snapshots.import_(str(tmp_path / "in"), "wide"))
+    assert docs.client.get_collection("wide").count() == 0
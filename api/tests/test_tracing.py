@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from monitoring.metrics import track_stage
+from monitoring.profiler import ProfilerBusyError, SamplingProfiler, profile_process
+from monitoring.tracing import RequestTrace, annotate, span, trace_requested, tracing
+
+
+def test_stages_become_spans_of_a_traced_request():
+    async def child():
+        with track_stage("vectorstore", "query"):
+            annotate(hits=3)
+
+    async def scenario():
+        with RequestTrace("rag.query") as trace:
+            assert tracing()
+            with track_stage("claude", "generate"):
+                pass
+            # Tasks spawned by the request inherit its trace
+            await asyncio.create_task(child())
+            with pytest.raises(ValueError):
+                with span("rerank", k=5):
+                    raise ValueError("bad")
+        return trace
+
+    trace = asyncio.run(scenario())
+    tree = trace.to_dict()
+    assert tree["name"] == "rag.query"
+    names = [child["name"] for child in tree["children"]]
+    assert names == ["claude.generate", "vectorstore.query", "rerank"]
+    assert tree["children"][1]["attributes"] == {"hits": 3}
+    assert tree["children"][2]["error"] == "ValueError: bad"
+    assert not tracing()
+
+
+def test_untraced_requests_record_nothing():
+    with RequestTrace("rag.query", enabled=False) as trace:
+        assert not tracing()
+        with track_stage("claude", "generate"):
+            annotate(ignored=True)
+    assert (trace.to_dict(), trace.server_timing()) == (None, "")
+
+
+def test_server_timing_names_repeated_stages_apart():
+    with RequestTrace("agent task") as trace:
+        for _ in range(2):
+            with track_stage("claude", "generate"):
+                pass
+    metrics = [entry.split(";")[0] for entry in trace.server_timing().split(", ")]
+    assert metrics == ["agent_task", "claude.generate", "claude.generate-2"]
+
+
+def test_trace_is_requested_by_flag_or_header():
+    assert trace_requested(True, {})
+    assert trace_requested(False, {"X-Debug-Trace": "true"})
+    assert not trace_requested(False, {"X-Debug-Trace": "0"})
+    assert not trace_requested(False, {})
+
+
+def test_profiler_samples_other_threads():
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            time.sleep(0.001)
+
+    worker = threading.Thread(target=busy_worker, name="busy")
+    worker.start()
+    try:
+        profiler = SamplingProfiler(interval=0.001)
+        result = profiler.run(0.05)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert result["sweeps"] > 0
+    assert any(stack.startswith("busy;") and "busy_worker" in stack for stack in profiler.samples)
+    line = profiler.collapsed().splitlines()[0]
+    assert line.rsplit(" ", 1)[1].isdigit()
+
+
+def test_one_profile_at_a_time():
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (started.set(), profile_process(0.2)))
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(ProfilerBusyError):
+            profile_process(0.01)
+    finally:
+        thread.join()
+    assert profile_process(0.01).sample_count > 0
@@ -0,0 +1,159 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from core.extraction_pool import ExtractionPool
+from services.document_service import DocumentService
+from services.vectorstore_service import document_index_name
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def metadata_of(store, name):
+    return dict(store.client.get_collection(name).metadata)
+
+
+def test_writes_keep_the_model_a_knowledge_base_was_created_with(store):
+    run(store.create_collection("docs", {"space": "cosine"}, embedding_model="big-model"))
+    created = metadata_of(store, "docs")
+    assert (created["embedding_model"], created["embedding_dim"]) == ("big-model", 8)
+
+    run(store.add_documents(["alpha beta"], [{"document_id": "d1"}], "docs"))
+    run(store.get_collection_count("docs"))
+    assert metadata_of(store, "docs") == created
+
+    # Still encoded with the 8-dimensional model
+    [hit] = run(store.search("alpha", "docs", top_k=1))
+    assert hit["content"] == "alpha beta"
+
+
+def test_implicit_knowledge_base_uses_the_defaults(store):
+    run(store.add_documents(["alpha"], [{}], "implicit"))
+    metadata = metadata_of(store, "implicit")
+    assert (metadata["embedding_model"], metadata["embedding_dim"]) == ("small", 4)
+
+
+def test_rebuilt_index_settings_survive_later_writes(store):
+    run(store.add_documents(["alpha", "beta"], [{"document_id": "d1"}, {"document_id": "d2"}], "docs"))
+    info = run(store.rebuild_collection("docs", {"space": "cosine", "M": 32}))
+    assert info["copied"] == 2
+
+    # Writes reopen the swapped-in collection; they must not reset it to the defaults
+    store.forget_collection("docs")
+    run(store.delete_document("d1", "docs"))
+    run(store.add_documents(["gamma"], [{"document_id": "d3"}], "docs"))
+    metadata = metadata_of(store, "docs")
+    assert (metadata["hnsw:space"], metadata["hnsw:M"]) == ("cosine", 32)
+    assert run(store.get_collection_count("docs")) == 2
+
+
+def ingest(store, knowledge_base_id, document_id, chunks, **metadata):
+    """Write a document's chunks and vector the way DocumentService does"""
+    documents = DocumentService(store, ExtractionPool(max_workers=1))
+
+    async def scenario():
+        centroid = await documents._new_centroid(knowledge_base_id)
+        await store.add_documents(
+            chunks,
+            [dict(metadata, document_id=document_id, chunk_index=i) for i in range(len(chunks))],
+            knowledge_base_id,
+            ids=[f"{document_id}_chunk_{i}" for i in range(len(chunks))],
+            on_embeddings=centroid.add if centroid else None
+        )
+        await documents._index_document(knowledge_base_id, document_id, centroid, metadata)
+
+    run(scenario())
+
+
+def document_vectors(store, knowledge_base_id):
+    rows = store.client.get_collection(document_index_name(knowledge_base_id)).get(include=["embeddings", "metadatas"])
+    return {id_: (embedding, metadata) for id_, embedding, metadata in zip(rows["ids"], rows["embeddings"], rows["metadatas"])}
+
+
+@pytest.fixture
+def indexed(store):
+    """Knowledge base "docs" with a document index searching the nearest document"""
+    run(store.create_collection("docs", {"space": "cosine"}, document_index=True, top_documents=1))
+    ingest(store, "docs", "a", ["alpha", "alpha beta"], lang="en")
+    ingest(store, "docs", "b", ["gamma", "beta"], lang="pt")
+    return store
+
+
+def test_each_document_is_stored_as_the_centroid_of_its_chunks(indexed):
+    vectors = document_vectors(indexed, "docs")
+    assert sorted(vectors) == ["a", "b"]
+    embedding, metadata = vectors["a"]
+    assert metadata == {"lang": "en", "document_id": "a", "chunks": 2}
+    # Mean of [1, 0, ...] and [1, 1, ...] (plus the encoder's 1e-3 floor),
+    # rescaled to the chunks' mean norm
+    chunks = np.array([[1.001, 0.001, 0.001, 0.001], [1.001, 1.001, 0.001, 0.001]])
+    mean = chunks.mean(axis=0)
+    expected = mean * np.linalg.norm(chunks, axis=1).mean() / np.linalg.norm(mean)
+    assert np.allclose(embedding, expected, atol=1e-5)
+
+    info = run(indexed.get_index_info("docs"))
+    assert info["document_index"] == {"top_documents": 1, "documents": 2}
+
+
+def test_uploads_and_deletes_maintain_the_document_vectors(indexed):
+    service = DocumentService(indexed, ExtractionPool(max_workers=1))
+    uploaded = run(service.upload_file(b"delta delta", "notes.txt", "docs"))
+    _, metadata = document_vectors(indexed, "docs")[uploaded.document_id]
+    assert (metadata["source"], metadata["chunks"]) == ("notes.txt", 1)
+
+    run(indexed.delete_document("a", "docs"))
+    assert set(document_vectors(indexed, "docs")) == {"b", uploaded.document_id}
+    assert run(indexed.get_collection_count("docs")) == 3
+
+
+def test_search_only_reads_chunks_of_the_nearest_documents(indexed):
+    hits = run(indexed.search("alpha", "docs", top_k=4))
+    assert {hit["metadata"]["document_id"] for hit in hits} == {"a"}
+    assert len(hits) == 2
+
+    # Without the first stage every chunk is a candidate
+    assert len(run(indexed.search("alpha", "docs", top_k=4, two_stage=False))) == 4
+
+    # The filter applies at both levels: the nearest Portuguese document is b
+    hits = run(indexed.search("alpha", "docs", top_k=4, filter={"lang": "pt"}))
+    assert {hit["metadata"]["document_id"] for hit in hits} == {"b"}
+
+    [scoped, direct] = run(indexed.search_batch([
+        {"query": "gamma", "knowledge_base_id": "docs", "top_k": 4},
+        {"query": "gamma", "knowledge_base_id": "docs", "top_k": 4, "two_stage": False}
+    ]))
+    assert {hit["metadata"]["document_id"] for hit in scoped} == {"b"}
+    assert len(direct) == 4
+
+
+def test_search_falls_back_when_no_document_matches(indexed):
+    # chunk_index exists only on chunks, so the document level finds nothing
+    hits = run(indexed.search("gamma", "docs", top_k=4, filter={"chunk_index": 1}))
+    assert sorted(hit["content"] for hit in hits) == ["alpha beta", "beta"]
+
+
+def test_document_index_settings_survive_writes(indexed):
+    indexed.forget_collection("docs")
+    ingest(indexed, "docs", "c", ["delta"])
+    run(indexed.delete_document("b", "docs"))
+    assert metadata_of(indexed, "docs")["document_index_top"] == 1
+    assert sorted(document_vectors(indexed, "docs")) == ["a", "c"]
+
+
+def test_long_knowledge_base_ids_get_a_valid_document_index_name(store):
+    first, second = "k" * 60 + "-one", "k" * 60 + "-two"
+    assert document_index_name("docs") == "docs__documents"
+    assert len(document_index_name(first)) <= 63
+    assert document_index_name(first) != document_index_name(second)
+
+    for knowledge_base_id in (first[:63], second[:63]):
+        run(store.create_collection(knowledge_base_id, {}, document_index=True))
+        ingest(store, knowledge_base_id, "a", ["alpha"])
+        assert [hit["content"] for hit in run(store.search("alpha", knowledge_base_id))] == ["alpha"]
+    assert sorted(run(store.list_collections())) == [first[:63], second[:63]]
+
+    run(store.rebuild_collection(first[:63], {"M": 32}))
+    assert sorted(document_vectors(store, first[:63])) == ["a"]